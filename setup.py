@@ -5,6 +5,7 @@ setup(name='symcc',
         description='Symbolic Mathematics Compiler',
         author='Jim Crist',
         install_requires=['sympy>=0.7.5-git'],
+        extras_require={'ufunc': ['numpy']},
         tests_require=['pytest'],
         dependency_links = ['http://github.com/sympy/sympy/tarball/master#egg=sympy-0.7.5-git']
 )
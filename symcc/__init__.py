@@ -1,2 +1,4 @@
 from .printers import *
 from .types import *
+from .transforms import *
+from .wrappers import *
@@ -1,11 +1,16 @@
 from __future__ import print_function, division
 
-from sympy.core import S
+from sympy.core import S, Symbol
 from sympy.core.compatibility import string_types
-from sympy.printing.precedence import precedence
+from sympy.printing.precedence import precedence, PRECEDENCE
 from sympy.sets.fancysets import Range
+from sympy.matrices.expressions.matexpr import MatrixSymbol
+from sympy.tensor import IndexedBase
 
-from symcc.types.ast import Assign, datatype, Result
+from symcc.types import ir
+from symcc.types.ast import (Assign, datatype, Result, OutArgument,
+        InOutArgument, Int, Float, Double)
+from symcc.transforms.blas import signatures
 from symcc.printers.codeprinter import CodePrinter
 
 __all__ = ["CCodePrinter", "ccode"]
@@ -35,19 +40,25 @@ known_functions = {
     "ceiling": "ceil",
 }
 
+# C types of the arguments of the Fortran routines in `signatures`, which are
+# all passed by reference
+_pointer_types = {
+    'char': 'char *',
+    'int': 'int *',
+    'double': 'double *',
+    'int[]': 'int *',
+    'double[]': 'double *',
+}
+
 
 class CCodePrinter(CodePrinter):
     """A printer to convert python expressions to strings of c code"""
     printmethod = "_ccode"
     language = "C"
+    _flat_indexing = True
 
-    _default_settings = {
-        'order': None,
-        'full_prec': 'auto',
-        'precision': 15,
-        'user_functions': {},
-        'dereference': set()
-    }
+    _default_settings = dict(CodePrinter._default_settings,
+            dereference=set())
 
     def __init__(self, settings={}):
         CodePrinter.__init__(self, settings)
@@ -63,7 +74,7 @@ class CCodePrinter(CodePrinter):
         return "// {0}".format(text)
 
     def _format_code(self, lines):
-        return self.indent_code(lines)
+        return self._iter_indent_code(lines)
 
     def _traverse_matrix_indices(self, mat):
         rows, cols = mat.shape
@@ -79,7 +90,13 @@ class CCodePrinter(CodePrinter):
 
     def _print_Declare(self, expr):
         dtype = self._print(expr.dtype)
-        variables = ', '.join(self._print(i.name) for i in expr.variables)
+        def declarator(x):
+            if isinstance(x, MatrixSymbol):
+                # Local matrices are flat arrays, in row-major order
+                return '{0}[{1}]'.format(self._print(x),
+                                         self._print(x.rows*x.cols))
+            return self._print(x)
+        variables = ', '.join(declarator(i.name) for i in expr.variables)
         return '{0} {1};'.format(dtype, variables)
 
     def _print_NativeBool(self, expr):
@@ -98,20 +115,62 @@ class CCodePrinter(CodePrinter):
         return 'void'
 
     def _print_FunctionDef(self, expr):
-        if len(expr.results) == 1:
-            ret_type = self._print(expr.results[0].dtype)
-        elif len(expr.results) > 1:
+        return '\n'.join(self._iter_print_FunctionDef(expr))
+
+    def _iter_print_FunctionDef(self, expr):
+        results = [r.dtype for r in expr.results]
+        return self._iter_function(expr.name, expr.arguments, expr.body,
+                results)
+
+    def _print_Procedure(self, expr):
+        return '\n'.join(self._iter_print_Procedure(expr))
+
+    def _iter_print_Procedure(self, expr):
+        # External routines are declared before the function calling them
+        names = []
+        for stmt in ir.walk(expr.body):
+            if isinstance(stmt, ir.Call) and stmt.name not in names:
+                names.append(stmt.name)
+        for name in names:
+            args = ', '.join(_pointer_types[t] for t in signatures[name])
+            yield 'void {0}_({1});'.format(name, args)
+        for line in self._iter_function(expr.name, expr.arguments, expr.body,
+                expr.results):
+            yield line
+
+    def _iter_function(self, name, arguments, body, results):
+        if len(results) == 1:
+            ret_type = self._print(results[0])
+        elif len(results) > 1:
             raise ValueError("C doesn't support multiple return values.")
         else:
             ret_type = self._print(datatype('void'))
-        name = expr.name
-        arg_code = ', '.join(self._print(i) for i in expr.arguments)
-        body = '\n'.join(self._print(i) for i in expr.body)
-        return '{0} {1}({2}) {{\n{3}\n}}'.format(ret_type, name, arg_code, body)
+        arg_code = ', '.join(self._print(i) for i in arguments)
+        yield '{0} {1}({2}) {{'.format(ret_type, name, arg_code)
+        # Scalar outputs are passed by address, and must be dereferenced
+        deref = set(a.name for a in arguments if isinstance(a,
+                    (OutArgument, InOutArgument)) and isinstance(a.name, Symbol))
+        old_deref = self._dereference
+        with self._function_context(name, arguments, body, results):
+            self._dereference = old_deref.union(deref)
+            try:
+                for line in self._iter_body(body):
+                    yield line
+            finally:
+                self._dereference = old_deref
+        yield '}'
+
+    def _print_Routine(self, expr):
+        return '\n'.join(self._iter_print_Routine(expr))
+
+    def _iter_print_Routine(self, expr):
+        return self._iter_print(self._lower_routine(expr))
 
     def _print_InArgument(self, expr):
         dtype = self._print(expr.dtype)
         arg = self._print(expr.name)
+        if isinstance(expr.name, (MatrixSymbol, IndexedBase)):
+            return '{0} *{1}'.format(dtype, arg)
         return '{0} {1}'.format(dtype, arg)
 
     def _print_OutArgument(self, expr):
@@ -127,6 +186,48 @@ class CCodePrinter(CodePrinter):
     def _print_Return(self, expr):
         return 'return {0};'.format(self._print(expr.expr))
 
+    def _print_If(self, expr):
+        return '\n'.join(self._iter_print_If(expr))
+
+    def _iter_print_If(self, expr):
+        for i, (c, body) in enumerate(expr.cases):
+            if i == 0:
+                yield 'if ({0}) {{'.format(self._print(c))
+            elif i == len(expr.cases) - 1 and c == True:
+                yield 'else {'
+            else:
+                yield 'else if ({0}) {{'.format(self._print(c))
+            for line in self._iter_body(body):
+                yield line
+            yield '}'
+
+    def _print_Clear(self, expr):
+        target = self._print(expr.target)
+        return 'memset({0}, 0, {1}*sizeof(*{0}));'.format(target,
+                self._print(expr.target.rows*expr.target.cols))
+
+    def _print_SinCos(self, expr):
+        return 'sincos({0}, &{1}, &{2});'.format(self._print(expr.arg),
+                self._print(expr.sin), self._print(expr.cos))
+
+    def _print_Call(self, expr):
+        # The routines are called through their Fortran interface, with all
+        # arguments passed by reference
+        args = []
+        for arg, kind in zip(expr.args, signatures[expr.name]):
+            if kind == 'char':
+                args.append('"{0}"'.format(arg))
+            elif kind.endswith('[]'):
+                args.append(self._print(arg))
+            else:
+                dtype = Int if kind == 'int' else Double
+                if isinstance(arg, Symbol) and self._dtypes.get(arg) is dtype:
+                    args.append('&' + self._print(arg))
+                else:
+                    args.append('&({0}){{{1}}}'.format(kind,
+                                                       self._print(arg)))
+        return '{0}_({1});'.format(expr.name, ', '.join(args))
+
     def _print_AugAssign(self, expr):
         lhs_code = self._print(expr.lhs)
         op = expr.op._symbol
@@ -134,22 +235,52 @@ class CCodePrinter(CodePrinter):
         return "{0} {1}= {2};".format(lhs_code, op, rhs_code)
 
     def _print_For(self, expr):
-        target = self._print(expr.target)
+        return '\n'.join(self._iter_print_For(expr))
+
+    def _iter_print_For(self, expr):
         if isinstance(expr.iterable, Range):
             start, stop, step = expr.iterable.args
         else:
             raise NotImplementedError("Only iterable currently supported is Range")
-        body = '\n'.join(self._print(i) for i in expr.body)
-        return ('for ({target} = {start}; {target} < {stop}; {target} += '
-                '{step}) {{\n{body}\n}}').format(target=target, start=start,
-                stop=stop, step=step, body=body)
+        return self._iter_loop(expr.target, start, stop, step, expr.body)
+
+    def _iter_loop(self, target, start, stop, step, body):
+        target = self._print(target)
+        start, stop, step = [self._print(i) for i in (start, stop, step)]
+        yield ('for ({target} = {start}; {target} < {stop}; {target} += '
+               '{step}) {{').format(target=target, start=start, stop=stop,
+                       step=step)
+        for line in self._iter_body(body):
+            yield line
+        yield '}'
+
+    def _print_ParallelFor(self, expr):
+        return '\n'.join(self._iter_print_ParallelFor(expr))
+
+    def _iter_print_ParallelFor(self, expr):
+        yield '#pragma omp parallel for{0}'.format(self._omp_clauses(expr))
+        for line in self._iter_print_For(expr):
+            yield line
+
+    def _print_Loop(self, expr):
+        return '\n'.join(self._iter_print_Loop(expr))
+
+    def _iter_print_Loop(self, expr):
+        if expr.parallel:
+            yield '#pragma omp parallel for{0}'.format(self._omp_clauses(expr))
+        for line in self._iter_loop(expr.target, expr.start, expr.stop,
+                expr.step, expr.body):
+            yield line
 
     def _print_Pow(self, expr):
         if "Pow" in self.known_functions:
             return self._print_Function(expr)
+        reduced = self._print_reduced_Pow(expr)
+        if reduced is not None:
+            return reduced
         PREC = precedence(expr)
         if expr.exp == -1:
-            return '1.0/%s' % (self.parenthesize(expr.base, PREC))
+            return self._print_reciprocal(self.parenthesize(expr.base, PREC))
         elif expr.exp == 0.5:
             return 'sqrt(%s)' % self._print(expr.base)
         else:
@@ -158,8 +289,21 @@ class CCodePrinter(CodePrinter):
 
     def _print_Rational(self, expr):
         p, q = int(expr.p), int(expr.q)
+        if self._integer_literals():
+            return '%d/%d' % (p, q)
+        elif self._folds_rationals():
+            code = repr(float(expr))
+            return code + 'f' if self._literal_dtype is Float else code
         return '%d.0L/%d.0L' % (p, q)
 
+    def _print_Float(self, expr):
+        code = CodePrinter._print_Float(self, expr)
+        return code + 'f' if self._literal_dtype is Float else code
+
+    def _print_reciprocal(self, code):
+        one = '1.0f' if self._literal_dtype is Float else '1.0'
+        return '{0}/{1}'.format(one, code)
+
     def _print_Indexed(self, expr):
         # calculate index for 1d array
         dims = expr.shape
@@ -173,6 +317,32 @@ class CCodePrinter(CodePrinter):
     def _print_Idx(self, expr):
         return self._print(expr.label)
 
+    def _print_Min(self, expr):
+        return self._print_extremum(expr, '<', 'fmin')
+
+    def _print_Max(self, expr):
+        return self._print_extremum(expr, '>', 'fmax')
+
+    def _print_extremum(self, expr, op, func):
+        # C has no integer min or max, so these are conditionals
+        args = [self._print(a) for a in expr.args]
+        integer = all(a.is_integer for a in expr.args)
+        code = args[0]
+        for arg in args[1:]:
+            if integer:
+                code = '(({0} {1} {2}) ? {0} : {2})'.format(code, op, arg)
+            else:
+                code = '{0}({1}, {2})'.format(func, code, arg)
+        return code
+
+    def _print_Mod(self, expr):
+        p, q = expr.args
+        if p.is_integer and q.is_integer:
+            return '({0} % {1})'.format(
+                    self.parenthesize(p, PRECEDENCE['Mul']),
+                    self.parenthesize(q, PRECEDENCE['Pow']))
+        return 'fmod({0}, {1})'.format(self._print(p), self._print(q))
+
     def _print_Exp1(self, expr):
         return "M_E"
 
@@ -233,27 +403,24 @@ class CCodePrinter(CodePrinter):
         if isinstance(code, string_types):
             code_lines = self.indent_code(code.splitlines(True))
             return ''.join(code_lines)
+        return list(self._iter_indent_code(code))
+
+    def _iter_indent_code(self, code):
+        """Indents an iterable of code lines, yielding one line at a time"""
 
         tab = "    "
         inc_token = ('{', '(', '{\n', '(\n')
         dec_token = ('}', ')')
 
-        code = [ line.lstrip(' \t') for line in code ]
-
-        increase = [ int(any(map(line.endswith, inc_token))) for line in code ]
-        decrease = [ int(any(map(line.startswith, dec_token)))
-                     for line in code ]
-
-        pretty = []
         level = 0
-        for n, line in enumerate(code):
+        for line in code:
+            line = line.lstrip(' \t')
             if line == '' or line == '\n':
-                pretty.append(line)
+                yield line
                 continue
-            level -= decrease[n]
-            pretty.append("%s%s" % (tab*level, line))
-            level += increase[n]
-        return pretty
+            level -= int(any(map(line.startswith, dec_token)))
+            yield "%s%s" % (tab*level, line)
+            level += int(any(map(line.endswith, inc_token)))
 
 
 def ccode(expr, assign_to=None, **settings):
@@ -281,6 +448,52 @@ def ccode(expr, assign_to=None, **settings):
         expression. These would be values passed by address to the function.
         For example, if ``dereference=[a]``, the resulting code would print
         ``(*a)`` instead of ``a``.
+    memoize : bool, optional
+        If True [default], each distinct subexpression is only printed once,
+        which is much faster for expressions with many shared subtrees.
+    iterative : bool, optional
+        If True, expressions are printed bottom up using an explicit stack
+        instead of recursion, so very deep expressions can be printed without
+        exceeding the recursion limit. The output is unchanged. Implies
+        ``memoize``. Default is False.
+    max_pow : int, optional
+        Powers with an integer or half-integer exponent of magnitude at most
+        ``max_pow`` are printed as products computed by repeated squaring
+        (times ``sqrt`` of the base for half-integers), instead of calls to
+        the power function. Negative exponents are printed as a single
+        division. In a ``Routine``, the squares of large powers are stored in
+        temporaries. Powers of integers are never rewritten, as the product
+        may overflow. Default is 0, which disables this.
+    dtype : str or DataType, optional
+        The datatype of the printed expression, which sets how its literals
+        are printed. For ``'double'``, rationals are folded into a single
+        literal (``3.5``), and for ``'float'`` into a single precision one
+        (``3.5f``, as are floats). For ``'int'``, rationals are integer
+        divisions. Inside a ``Routine``, each statement instead uses the type
+        of the variable it assigns to, or the return type. Default is None,
+        which prints rationals as ``long double`` divisions (``7.0L/2.0L``).
+    reassociate : int, optional
+        Sums and products of more than ``reassociate`` terms are printed as
+        a balanced tree of parenthesized chains of at most that many terms,
+        instead of a single chain, so the operations can run in parallel.
+        Default is 0, which disables this.
+    structured_matrices : int, optional
+        If nonzero, matrices assigned to a ``MatrixSymbol`` with at least
+        ``structured_matrices`` zero entries are set to zero with
+        ``memset`` (from ``string.h``), and the zeros aren't assigned. In a
+        ``Routine``, equal entries are also assigned in loops, see
+        `symcc.transforms.optimize_routine`. Default is 0, which disables
+        this.
+    cse, parallel, horner, fold_constants, hoist_reciprocals, ... : optional
+        The optimizations applied when printing a ``Routine``, along with
+        ``hoist_invariants``, ``eliminate_dead_code``, ``split_sums``,
+        ``fuse_transcendentals``, ``select_piecewise`` and ``blas``. They're
+        documented in `symcc.transforms.optimize_routine`, and only ``cse``
+        is enabled by default.
+        In C, sines and cosines of the same argument are computed by one
+        call to ``sincos`` (a GNU extension), selected ``Piecewise`` use
+        ``fmin``, ``fmax``, ``fabs`` or the conditional operator, and BLAS and
+        LAPACK are called through their Fortran interface.
 
     Examples
     ========
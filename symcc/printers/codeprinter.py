@@ -1,19 +1,83 @@
 from __future__ import print_function, division
 
-from sympy.core import C, Add, Mul, Pow, S
+from contextlib import contextmanager
+
+from sympy.core import C, Add, Mul, Pow, S, Integer
 from sympy.core.compatibility import default_sort_key, string_types
 from sympy.core.sympify import _sympify
 from sympy.core.mul import _keep_coeff
 from sympy.printing.str import StrPrinter
-from sympy.printing.precedence import precedence
-
-from symcc.types.ast import Assign
+from sympy.printing.precedence import precedence, PRECEDENCE
+from sympy.logic.boolalg import Boolean
+from sympy.matrices import MatrixBase
+from sympy.matrices.expressions.matexpr import MatrixElement, MatrixSymbol
+from sympy.tensor import Indexed, IndexedBase
+
+from symcc.types.ast import (Assign, AugAssign, Declare, Return, DataType,
+        datatype, Int, Bool, Float, Double)
+from symcc.types import ir
+from symcc.types.ir import Node
+from symcc.transforms.powers import pow_reduction
+from symcc.transforms.pipeline import pipeline_settings, optimize_routine
 
 __all__ = ["CodePrinter"]
 
+# Types of nodes traversed by `CodePrinter._print_tree`. Statements in the AST
+# are printed normally, as their printed form may depend on their context.
+_traversed = (C.Expr, Boolean)
+
+
+def _join_terms(terms):
+    """Join printed terms of a sum, given as pairs of ``(sign, code)``."""
+    sign, code = terms[0]
+    parts = ['-' + code if sign == '-' else code]
+    parts.extend('{0} {1}'.format(sign, code) for (sign, code) in terms[1:])
+    return ' '.join(parts)
+
+
+def _square_chain(base, n):
+    """Returns code computing ``base**n`` with multiplications, by repeated
+    squaring. `n` must be positive."""
+    if n == 1:
+        return base
+    half = _square_chain(base, n//2)
+    code = half + '*' + ('({0})'.format(half) if n//2 > 1 else half)
+    if n % 2:
+        code += '*' + base
+    return code
+
+
+def _target(expr):
+    """Returns the symbol naming the variable `expr` is an element of."""
+    if isinstance(expr, Indexed):
+        return expr.base.label
+    elif isinstance(expr, IndexedBase):
+        return expr.label
+    elif isinstance(expr, MatrixElement):
+        return expr.parent
+    return expr
+
+
 class CodePrinter(StrPrinter):
     """
     The base class for code-printing subclasses.
+
+    Within each call to `doprint`, the printed form of every distinct
+    subexpression is memoized, so subtrees shared between different parts of
+    an expression are only printed once. This can be disabled with the
+    ``memoize`` setting. Statistics on the last call are available from
+    `memo_stats`.
+
+    With the ``iterative`` setting, expressions are traversed with an
+    explicit stack and printed bottom up. Each node is then printed from the
+    already printed forms of its children, so the depth of recursion no
+    longer grows with the depth of the expression.
+
+    Numeric literals are printed for the `DataType` of the value being
+    computed. Inside a function, this is the type of the variable each
+    statement assigns to, or the return type for returns. Elsewhere, it's
+    given by the ``dtype`` setting. Without a type, rationals are printed as
+    divisions in the highest available precision.
     """
 
     _operators = {
@@ -22,6 +86,42 @@ class CodePrinter(StrPrinter):
         'not': '!',
     }
 
+    # The settings of the printer, followed by those of the optimization
+    # passes applied to routines, see `optimize_routine`
+    _default_settings = dict({
+        'order': None,
+        'full_prec': 'auto',
+        'user_functions': {},
+        'memoize': True,
+        'iterative': False,
+        'dtype': None,
+        'reassociate': 0,
+    }, **pipeline_settings)
+
+    # If True, multidimensional arrays are printed with flattened indices,
+    # which loop-invariant code motion may then optimize
+    _flat_indexing = False
+
+    # If True, arrays are stored in row-major order, otherwise column-major
+    _row_major = True
+
+    def __init__(self, settings=None):
+        StrPrinter.__init__(self, settings)
+        # Mapping of expr -> printed string, only defined during `doprint`
+        self._memo = None
+        self._memo_hits = 0
+        self._memo_misses = 0
+        # Subexpressions printed by `_print_tree`, keyed by id
+        self._tree = None
+        # The datatype literals are printed for, and the datatypes of the
+        # variables and results of the function being printed
+        dtype = self._settings.get('dtype', None)
+        if dtype is not None and not isinstance(dtype, DataType):
+            dtype = datatype(dtype)
+        self._default_dtype = self._literal_dtype = dtype
+        self._dtypes = {}
+        self._result_dtype = dtype
+
     def doprint(self, expr, assign_to=None):
         """
         Print the expression as code.
@@ -36,6 +136,27 @@ class CodePrinter(StrPrinter):
             variable with name ``assign_to``.
         """
 
+        return "\n".join(self.iter_lines(expr, assign_to))
+
+    def iter_lines(self, expr, assign_to=None):
+        """
+        Print the expression as code, yielding one formatted line at a time.
+
+        Statements containing other statements (functions and loops) are
+        printed one child statement at a time, and formatted as they're
+        printed. Memory use is then bounded by the largest single statement,
+        instead of growing with the size of the output.
+
+        Parameters
+        ----------
+        expr : Expression
+            The expression to be printed.
+
+        assign_to : Symbol, MatrixSymbol, or string (optional)
+            If provided, the printed code will set the expression to a
+            variable with name ``assign_to``.
+        """
+
         if isinstance(assign_to, string_types):
             assign_to = C.Symbol(assign_to)
         elif not isinstance(assign_to, (C.Basic, type(None))):
@@ -44,14 +165,220 @@ class CodePrinter(StrPrinter):
 
         if assign_to:
             expr = Assign(assign_to, expr)
-        else:
+        elif not isinstance(expr, Node):
             expr = _sympify(expr)
 
-        # Do the actual printing
-        lines = self._print(expr).splitlines()
+        # Do the actual printing. Nested calls share the outer memo.
+        toplevel = self._memo is None
+        iterative = self._settings.get('iterative', False)
+        if toplevel and (iterative or self._settings.get('memoize', True)):
+            self._memo = {}
+            self._tree = {} if iterative else None
+            self._memo_hits = self._memo_misses = 0
+        try:
+            # Format the output
+            for line in self._format_code(self._iter_print(expr)):
+                yield line
+        finally:
+            if toplevel:
+                self._memo = self._tree = None
+
+    def write(self, expr, file, assign_to=None):
+        """
+        Print the expression as code, writing each line to a file as soon as
+        it's printed. See `iter_lines`.
+
+        Parameters
+        ----------
+        expr : Expression
+            The expression to be printed.
+
+        file : file-like
+            An object with a ``write`` method, such as an open file. Every
+            line is terminated with a newline.
+
+        assign_to : Symbol, MatrixSymbol, or string (optional)
+            If provided, the printed code will set the expression to a
+            variable with name ``assign_to``.
+        """
 
-        # Format the output
-        return "\n".join(self._format_code(lines))
+        for line in self.iter_lines(expr, assign_to):
+            file.write(line + "\n")
+
+    def _iter_print(self, expr):
+        """Returns an iterator of the unformatted lines of code for `expr`.
+
+        Nodes with an ``_iter_print_<Type>`` method are printed lazily by it.
+        All others are printed at once with `_print`."""
+        for cls in type(expr).__mro__:
+            method = getattr(self, '_iter_print_' + cls.__name__, None)
+            if method is not None:
+                return method(expr)
+        return iter(self._print(expr).splitlines())
+
+    def _iter_body(self, body):
+        """Yields the unformatted lines of code for a sequence of statements.
+
+        The memo is cleared after each statement, so its size doesn't grow
+        with the length of the body. Each statement is printed with the
+        datatype of the value it computes, see `_statement_dtype`."""
+        outer = self._literal_dtype
+        try:
+            for stmt in body:
+                dtype = self._statement_dtype(stmt)
+                if dtype is not self._literal_dtype:
+                    # Literals printed for the previous type can't be reused
+                    if self._memo is not None:
+                        self._memo.clear()
+                    self._literal_dtype = dtype
+                for line in self._iter_print(stmt):
+                    yield line
+                if self._memo is not None:
+                    self._memo.clear()
+        finally:
+            self._literal_dtype = outer
+
+    def _statement_dtype(self, stmt):
+        """Returns the datatype of the value computed by a statement.
+
+        This is the type of the target of assignments, and the return type
+        for returns. Other statements, and assignments to variables of
+        unknown type, use the ``dtype`` setting."""
+        if isinstance(stmt, (Assign, AugAssign, ir.Store)):
+            return self._dtypes.get(_target(stmt.lhs), self._default_dtype)
+        elif isinstance(stmt, (Return, ir.Return)):
+            return self._result_dtype
+        elif isinstance(stmt, ir.Call):
+            # The BLAS and LAPACK routines called are double precision
+            return Double
+        return self._default_dtype
+
+    def _print(self, expr, *args, **kwargs):
+        memo = self._memo
+        if memo is None or args or kwargs or not isinstance(expr, C.Basic):
+            return StrPrinter._print(self, expr, *args, **kwargs)
+        if self._tree is not None and isinstance(expr, _traversed):
+            return self._print_tree(expr)
+        if self._print_level == 0:
+            # The outermost expression is printed directly, as some printed
+            # forms depend on the nesting level (e.g. the precision of Floats)
+            return StrPrinter._print(self, expr)
+        try:
+            result = memo[expr]
+        except KeyError:
+            self._memo_misses += 1
+            result = memo[expr] = StrPrinter._print(self, expr)
+        else:
+            self._memo_hits += 1
+        return result
+
+    def _print_tree(self, expr):
+        """Print an expression with an explicit stack, instead of recursion.
+
+        All subexpressions are printed in post-order. As the children of a
+        node are always printed before it, printing the node only recurses
+        one level before finding their printed forms. Hashes and sort keys,
+        which SymPy computes recursively and caches, are also computed bottom
+        up this way.
+
+        Printed subexpressions are kept by identity with a count of their
+        unprinted parents, and dropped once all parents are printed. This
+        keeps memory linear in the size of the expression."""
+        tree = self._tree
+        entry = tree.get(id(expr))
+        if entry is not None and entry[2] is not None:
+            self._memo_hits += 1
+            return entry[2]
+        if entry is None:
+            # Entries are [node, refcount, printed, expanded]
+            entry = tree[id(expr)] = [expr, 0, None, False]
+        stack = [(expr, False)]
+        while stack:
+            node, expanded = stack.pop()
+            node_entry = tree[id(node)]
+            if expanded:
+                node.sort_key()
+                self._memo_misses += 1
+                if node is expr:
+                    node_entry[2] = StrPrinter._print(self, node)
+                else:
+                    # Print subexpressions at the level they'd be nested at
+                    self._print_level += 1
+                    try:
+                        node_entry[2] = StrPrinter._print(self, node)
+                    finally:
+                        self._print_level -= 1
+                for a in node.args:
+                    if isinstance(a, _traversed):
+                        a_entry = tree[id(a)]
+                        a_entry[1] -= 1
+                        if a_entry[1] == 0:
+                            del tree[id(a)]
+                continue
+            if node_entry[3]:
+                continue
+            node_entry[3] = True
+            stack.append((node, True))
+            for a in reversed(node.args):
+                if not isinstance(a, _traversed):
+                    continue
+                a_entry = tree.get(id(a))
+                if a_entry is None:
+                    a_entry = tree[id(a)] = [a, 0, None, False]
+                a_entry[1] += 1
+                if a_entry[2] is None:
+                    stack.append((a, False))
+        result = entry[2]
+        if entry[1] == 0:
+            del tree[id(expr)]
+        return result
+
+    def memo_stats(self):
+        """Returns statistics on the memoization of the last call to
+        `doprint`, as a dict with keys ``hits``, ``misses``, and
+        ``hit_rate``."""
+        hits, misses = self._memo_hits, self._memo_misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': hits/total if total else 0.0}
+
+    @contextmanager
+    def _printing_context(self):
+        """Context manager for printing while state affecting the printed
+        form of expressions is changed. Expressions printed inside the
+        context don't share memoized results with those printed outside."""
+        memo, tree = self._memo, self._tree
+        if memo is not None:
+            self._memo = {}
+        if tree is not None:
+            self._tree = {}
+        try:
+            yield
+        finally:
+            self._memo, self._tree = memo, tree
+
+    @contextmanager
+    def _function_context(self, name, arguments, body, results):
+        """Context manager for printing the body of a function.
+
+        The datatypes of its arguments and declared variables are recorded,
+        for `_statement_dtype`. Scalar results may also be assigned to the
+        function name."""
+        dtypes = dict((_target(a.name), a.dtype) for a in arguments)
+        for stmt in body:
+            if isinstance(stmt, (Declare, ir.Declare)):
+                dtypes.update((_target(v.name), stmt.dtype)
+                              for v in stmt.variables)
+        result = results[0] if len(results) == 1 else self._default_dtype
+        if len(results) == 1:
+            dtypes[name] = result
+        old = self._dtypes, self._result_dtype
+        with self._printing_context():
+            self._dtypes, self._result_dtype = dtypes, result
+            try:
+                yield
+            finally:
+                self._dtypes, self._result_dtype = old
 
     def _get_statement(self, codestring):
         """Formats a codestring with the proper line ending."""
@@ -76,10 +403,105 @@ class CodePrinter(StrPrinter):
                                   "subclass of CodePrinter.")
 
     def _print_Assign(self, expr):
-        lhs_code = self._print(expr.lhs)
-        rhs_code = self._print(expr.rhs)
+        lhs, rhs = expr.lhs, expr.rhs
+        if hasattr(lhs, 'shape') and not isinstance(lhs, Indexed):
+            # Matrices are assigned element-wise
+            lines = []
+            skip_zeros = False
+            min_run = self._settings.get('structured_matrices', 0)
+            if (min_run and isinstance(lhs, MatrixSymbol) and
+                    isinstance(rhs, MatrixBase)):
+                # Mostly zero matrices are set to zero first, and the zeros
+                # skipped
+                if sum(1 for e in rhs if e == 0) >= min_run:
+                    lines.append(self._print(ir.Clear(lhs)))
+                    skip_zeros = True
+            for (i, j) in self._traverse_matrix_indices(lhs):
+                if skip_zeros and rhs[i, j] == 0:
+                    continue
+                lines.append(self._print(Assign(lhs[i, j], rhs[i, j])))
+            return "\n".join(lines)
+        lhs_code = self._print(lhs)
+        rhs_code = self._print(rhs)
         return self._get_statement("%s = %s" % (lhs_code, rhs_code))
 
+    def parenthesize(self, item, level):
+        if self._folds_rationals() and getattr(item, 'is_Rational', False):
+            # Rationals printed as a single literal bind like a float
+            prec = PRECEDENCE['Add'] if item.is_negative else PRECEDENCE['Atom']
+            if prec <= level:
+                return "(%s)" % self._print(item)
+            return self._print(item)
+        reduction = self._pow_reduction(item)
+        if reduction is None:
+            return StrPrinter.parenthesize(self, item, level)
+        # Powers printed as products bind like a product, unless they're a
+        # single factor
+        n, half, negative = reduction
+        if n + half == 1 and not negative:
+            prec = PRECEDENCE['Atom']
+        else:
+            prec = PRECEDENCE['Mul']
+        if prec <= level:
+            return "(%s)" % self._print(item)
+        return self._print(item)
+
+    def _folds_rationals(self):
+        """Check if rationals are printed as a single floating point literal
+        in the current datatype."""
+        return self._literal_dtype in (Float, Double)
+
+    def _integer_literals(self):
+        """Check if literals are printed for integer arithmetic in the
+        current datatype, so rationals are integer divisions."""
+        return self._literal_dtype in (Int, Bool)
+
+    def _print_reciprocal(self, code):
+        """Returns code for the reciprocal of the already printed `code`."""
+        return '1.0/' + code
+
+    def _pow_reduction(self, expr):
+        """Check if a power should be printed as a product, according to the
+        ``max_pow`` setting. See `pow_reduction`."""
+        if 'Pow' in self.known_functions:
+            return None
+        return pow_reduction(expr, self._settings.get('max_pow', 0))
+
+    def _lower_routine(self, routine):
+        """Lower a `Routine` into an IR `Procedure`, and apply the
+        optimizations enabled by the settings. See `optimize_routine`."""
+        return optimize_routine(routine, self._settings,
+                row_major=self._row_major, flat_indexing=self._flat_indexing)
+
+    def _print_reduced_Pow(self, expr):
+        """Print a power as a product of its base, if allowed by the
+        ``max_pow`` setting. Returns None otherwise.
+
+        The product is computed by repeated squaring. Each square is
+        parenthesized, so it's the same subexpression each time it's used,
+        and the compiler only computes it once."""
+        reduction = self._pow_reduction(expr)
+        if reduction is None:
+            return None
+        n, half, negative = reduction
+        factors = []
+        if n:
+            factors.append(_square_chain(self.parenthesize(expr.base,
+                    PRECEDENCE['Mul']), n))
+        if half:
+            factors.append('sqrt({0})'.format(self._print(expr.base)))
+        code = '*'.join(factors)
+        if negative:
+            if n + half > 1:
+                code = '({0})'.format(code)
+            code = self._print_reciprocal(code)
+        return code
+
+    def _print_Store(self, expr):
+        if expr.op is None:
+            return self._print_Assign(expr)
+        return self._print_AugAssign(expr)
+
     def _print_Function(self, expr):
         if expr.func.__name__ in self.known_functions:
             cond_func = self.known_functions[expr.func.__name__]
@@ -98,6 +520,30 @@ class CodePrinter(StrPrinter):
         else:
             return self._print_not_supported(expr)
 
+    def _print_IndexedBase(self, expr):
+        return self._print(expr.label)
+
+    def _omp_clauses(self, expr):
+        """Returns the data-sharing clauses of an OpenMP parallel loop, as a
+        string. These are the same in C and Fortran."""
+        clauses = []
+        if expr.private:
+            clauses.append('private({0})'.format(', '.join(
+                    self._print(s) for s in expr.private)))
+        if expr.shared:
+            clauses.append('shared({0})'.format(', '.join(
+                    self._print(s) for s in expr.shared)))
+        # Group reductions by operator, in order of first appearance
+        ops = []
+        for (op, s) in expr.reductions:
+            if op not in ops:
+                ops.append(op)
+        for op in ops:
+            syms = [self._print(s) for (o, s) in expr.reductions if o == op]
+            clauses.append('reduction({0}:{1})'.format(op._symbol,
+                    ', '.join(syms)))
+        return ''.join(' ' + c for c in clauses)
+
     def _print_NumberSymbol(self, expr):
         return str(expr)
 
@@ -134,6 +580,50 @@ class CodePrinter(StrPrinter):
         PREC = precedence(expr)
         return self._operators['not'] + self.parenthesize(expr.args[0], PREC)
 
+    def _reassociate(self, items, join, group):
+        """Join the printed terms or factors of a sum or product.
+
+        With the ``reassociate`` setting, more than that many items are split
+        in halves, which are joined as parenthesized groups. This gives a
+        balanced tree of short chains, which can be evaluated in parallel,
+        instead of one long chain depending on each previous operation.
+        `join` joins a list of items, and `group` makes an item of a joined
+        group."""
+        n = self._settings.get('reassociate', 0)
+        if not n or len(items) <= n:
+            return join(items)
+        half = len(items)//2
+        halves = [items[:half], items[half:]]
+        return join([h[0] if len(h) == 1 else
+                     group(self._reassociate(h, join, group))
+                     for h in halves])
+
+    def _print_Add(self, expr, order=None):
+        n = self._settings.get('reassociate', 0)
+        if not n or len(expr.args) <= n:
+            return StrPrinter._print_Add(self, expr, order)
+        if self.order == 'none':
+            terms = list(expr.args)
+        else:
+            terms = self._as_ordered_terms(expr, order=order)
+        PREC = precedence(expr)
+        items = []
+        for term in terms:
+            t = self._print(term)
+            if t.startswith('-'):
+                sign = "-"
+                t = t[1:]
+            else:
+                sign = "+"
+            if precedence(term) < PREC:
+                t = "(%s)" % t
+            items.append((sign, t))
+        return self._reassociate(items, _join_terms,
+                                 lambda code: ('+', '({0})'.format(code)))
+
+    def _join_factors(self, factors):
+        return self._reassociate(factors, '*'.join, '({0})'.format)
+
     def _print_Mul(self, expr):
 
         prec = precedence(expr)
@@ -156,7 +646,13 @@ class CodePrinter(StrPrinter):
 
         # Gather args for numerator/denominator
         for item in args:
-            if item.is_commutative and item.is_Pow and item.exp.is_Rational and item.exp.is_negative:
+            if item.is_Rational and item.q != 1 and self._integer_literals():
+                # The coefficient of an integer expression is an integer
+                # division, after multiplying by the numerator
+                if item.p != 1:
+                    a.append(Integer(item.p))
+                b.append(Integer(item.q))
+            elif item.is_commutative and item.is_Pow and item.exp.is_Rational and item.exp.is_negative:
                 if item.exp != -1:
                     b.append(Pow(item.base, -item.exp, evaluate=False))
                 else:
@@ -170,14 +666,15 @@ class CodePrinter(StrPrinter):
         b_str = [self.parenthesize(x, prec) for x in b]
 
         if len(b) == 0:
-            return sign + '*'.join(a_str)
+            return sign + self._join_factors(a_str)
         elif len(b) == 1:
             if len(a) == 1 and not (a[0].is_Atom or a[0].is_Add):
-                return sign + "%s/" % a_str[0] + '*'.join(b_str)
+                return sign + "%s/" % a_str[0] + self._join_factors(b_str)
             else:
-                return sign + '*'.join(a_str) + "/%s" % b_str[0]
+                return sign + self._join_factors(a_str) + "/%s" % b_str[0]
         else:
-            return sign + '*'.join(a_str) + "/(%s)" % '*'.join(b_str)
+            return (sign + self._join_factors(a_str) +
+                    "/(%s)" % self._join_factors(b_str))
 
     def _print_not_supported(self, expr):
         raise TypeError("{0} not supported in {1}".format(type(expr), self.language))
@@ -7,11 +7,16 @@ from itertools import groupby
 
 from sympy.core import S, C, Add, N
 from sympy.core.compatibility import string_types
-from sympy.printing.precedence import precedence
+from sympy.printing.precedence import precedence, PRECEDENCE
 from sympy.sets.fancysets import Range
-
-from symcc.types.ast import (Assign, Result, InArgument,
-        OutArgument, InOutArgument, Variable)
+from sympy.tensor import IndexedBase
+
+from symcc.types import ir
+from symcc.types.ast import (Assign, InArgument, OutArgument, InOutArgument,
+        Variable, Float)
+from symcc.transforms.lowering import declare
+from symcc.transforms.piecewise import lower_piecewise
+from symcc.transforms.blas import signatures
 from symcc.printers.codeprinter import CodePrinter
 
 __all__ = ["FCodePrinter", "fcode"]
@@ -39,13 +44,7 @@ class FCodePrinter(CodePrinter):
     """A printer to convert sympy expressions to strings of Fortran code"""
     printmethod = "_fcode"
     language = "Fortran"
-
-    _default_settings = {
-        'order': None,
-        'full_prec': 'auto',
-        'precision': 15,
-        'user_functions': {},
-    }
+    _row_major = False
 
     _operators = {
         'and': '.and.',
@@ -72,7 +71,7 @@ class FCodePrinter(CodePrinter):
         return "! {0}".format(text)
 
     def _format_code(self, lines):
-        return self._wrap_fortran(self.indent_code(lines))
+        return self._iter_wrap_fortran(self._iter_indent_code(lines))
 
     def _traverse_matrix_indices(self, mat):
         rows, cols = mat.shape
@@ -97,17 +96,24 @@ class FCodePrinter(CodePrinter):
                          OutArgument: 'out',
                          InOutArgument: 'inout',
                          Variable: None}
-        # Group the variables by intent
-        f = lambda x: intent_lookup[type(x)]
-        arg_types = [type(v) for v in expr.variables]
+        def dims(x):
+            shape = getattr(x.name, 'shape', None) or ()
+            if isinstance(x.name, IndexedBase):
+                # Indexed objects are indexed from 0
+                return ', '.join('0:' + self._print(i - 1) for i in shape)
+            return ', '.join(self._print(i) for i in shape)
+        # Group the variables by intent and shape
+        f = lambda x: (intent_lookup[type(x)] or '', dims(x))
         var_list = groupby(sorted(expr.variables, key=f), f)
         decs = []
-        for intent, g in var_list:
+        for (intent, shape), g in var_list:
             vstr = ', '.join(self._print(i.name) for i in g)
+            attrs = [dtype]
             if intent:
-                decs.append('{0}, intent({1}) :: {2}'.format(dtype, intent, vstr))
-            else:
-                decs.append('{0} :: {2}'.format(dtype, intent, vstr))
+                attrs.append('intent({0})'.format(intent))
+            if shape:
+                attrs.append('dimension({0})'.format(shape))
+            decs.append('{0} :: {1}'.format(', '.join(attrs), vstr))
         return '\n'.join(decs)
 
     def _print_NativeBool(self, expr):
@@ -124,23 +130,62 @@ class FCodePrinter(CodePrinter):
         return 'real(dp)'
 
     def _print_FunctionDef(self, expr):
-        name = expr.name
-        if len(expr.results) == 1:
-            ret_type = self._print(expr.results[0].dtype)
+        return '\n'.join(self._iter_print_FunctionDef(expr))
+
+    def _iter_print_FunctionDef(self, expr):
+        results = [r.dtype for r in expr.results]
+        return self._iter_function(expr.name, expr.arguments, expr.body,
+                results)
+
+    def _print_Procedure(self, expr):
+        return '\n'.join(self._iter_print_Procedure(expr))
+
+    def _iter_print_Procedure(self, expr):
+        return self._iter_function(expr.name, expr.arguments, expr.body,
+                expr.results)
+
+    def _iter_function(self, name, arguments, body, results):
+        if len(results) == 1:
+            ret_type = self._print(results[0])
             sig = '{0} function {1}'.format(ret_type, name)
             func_type = 'function'
-        elif len(expr.results) > 1:
+        elif len(results) > 1:
             raise ValueError("Fortran doesn't support multiple return values.")
         else:
-            sig = 'subroutine ' + name
+            sig = 'subroutine {0}'.format(name)
             func_type = 'subroutine'
-        arg_code = ', '.join(self._print(i) for i in expr.arguments)
-        body = '\n'.join(self._print(i) for i in expr.body)
-        return ('{0}({1})\n'
-                'implicit none\n'
-                'integer, parameter:: dp=kind(0.d0)\n'
-                '{2}\n'
-                'end {3}').format(sig, arg_code, body, func_type)
+        arg_code = ', '.join(self._print(i) for i in arguments)
+        yield '{0}({1})'.format(sig, arg_code)
+        yield 'implicit none'
+        yield 'integer, parameter:: dp=kind(0.d0)'
+        with self._function_context(name, arguments, body, results):
+            for line in self._iter_body(body):
+                yield line
+        yield 'end {0}'.format(func_type)
+
+    def _lower_routine(self, routine):
+        func = CodePrinter._lower_routine(self, routine)
+        if not self._settings['select_piecewise']:
+            # merge evaluates all of its arguments, so Piecewise with any
+            # piece that isn't trivial are computed in if blocks instead
+            lower_piecewise(func, 0)
+        return func
+
+    def _print_Routine(self, expr):
+        return '\n'.join(self._iter_print_Routine(expr))
+
+    def _iter_print_Routine(self, expr):
+        func = self._lower_routine(expr)
+        # Fortran requires arguments to be declared in the body, and results
+        # to be assigned to the function name.
+        body = [ir.Declare(d.dtype, d.variables)
+                for d in declare(func.arguments)]
+        for stmt in func.body:
+            if isinstance(stmt, ir.Return):
+                stmt = ir.Store(func.name, stmt.expr)
+            body.append(stmt)
+        func.body = body
+        return self._iter_print(func)
 
     def _print_InArgument(self, expr):
         return self._print(expr.name)
@@ -159,20 +204,104 @@ class FCodePrinter(CodePrinter):
             raise ValueError("Fortran return doesn't accept expressions")
         return 'return'
 
+    def _print_If(self, expr):
+        return '\n'.join(self._iter_print_If(expr))
+
+    def _iter_print_If(self, expr):
+        for i, (c, body) in enumerate(expr.cases):
+            if i == 0:
+                yield 'if ({0}) then'.format(self._print(c))
+            elif i == len(expr.cases) - 1 and c == True:
+                yield 'else'
+            else:
+                yield 'else if ({0}) then'.format(self._print(c))
+            for line in self._iter_body(body):
+                yield line
+        yield 'end if'
+
+    def _print_Call(self, expr):
+        args = []
+        for arg, kind in zip(expr.args, signatures[expr.name]):
+            if kind == 'char':
+                args.append("'{0}'".format(arg))
+            else:
+                # Literals passed as doubles must be real
+                args.append(self._print_intrinsic_arg(arg, kind == 'double'))
+        return 'call {0}({1})'.format(expr.name, ', '.join(args))
+
+    def _print_Clear(self, expr):
+        return '{0} = 0'.format(self._print(expr.target))
+
+    def _print_SinCos(self, expr):
+        # Fortran has no sincos, but compilers merge adjacent calls
+        arg = self._print(expr.arg)
+        return '{0} = sin({2})\n{1} = cos({2})'.format(self._print(expr.sin),
+                self._print(expr.cos), arg)
+
     def _print_AugAssign(self, expr):
-        raise NotImplementedError("Fortran doesn't support AugAssign")
+        # Fortran doesn't support augmented assignment, so it's expanded
+        lhs_code = self._print(expr.lhs)
+        op = expr.op._symbol
+        rhs_code = self.parenthesize(expr.rhs, PRECEDENCE['Atom'] - 1)
+        return "{0} = {0} {1} {2}".format(lhs_code, op, rhs_code)
 
     def _print_For(self, expr):
-        target = self._print(expr.target)
+        return '\n'.join(self._iter_print_For(expr))
+
+    def _iter_print_For(self, expr):
         if isinstance(expr.iterable, Range):
             start, stop, step = expr.iterable.args
         else:
             raise NotImplementedError("Only iterable currently supported is Range")
-        body = '\n'.join(self._print(i) for i in expr.body)
-        return ('do {target} = {start}, {stop}, {step}\n'
-                '{body}\n'
-                'end do').format(target=target, start=start, stop=stop,
-                        step=step, body=body)
+        return self._iter_loop(expr.target, start, stop, step, expr.body)
+
+    def _iter_loop(self, target, start, stop, step, body):
+        target = self._print(target)
+        # Range excludes the stop value, while Fortran includes it. Any
+        # bound past the last value works, which is stop - step if the
+        # range is known to be a whole number of steps.
+        if ((stop - start)/step).is_integer:
+            last = stop - step
+        elif step.is_negative:
+            last = stop + 1
+        else:
+            last = stop - 1
+        start, stop, step = [self._print(i) for i in (start, last, step)]
+        yield 'do {target} = {start}, {stop}, {step}'.format(target=target,
+                start=start, stop=stop, step=step)
+        for line in self._iter_body(body):
+            yield line
+        yield 'end do'
+
+    def _print_ParallelFor(self, expr):
+        return '\n'.join(self._iter_print_ParallelFor(expr))
+
+    def _iter_print_ParallelFor(self, expr):
+        yield '!$omp parallel do{0}'.format(self._omp_clauses(expr))
+        for line in self._iter_print_For(expr):
+            yield line
+        yield '!$omp end parallel do'
+
+    def _print_Loop(self, expr):
+        return '\n'.join(self._iter_print_Loop(expr))
+
+    def _iter_print_Loop(self, expr):
+        if expr.parallel:
+            yield '!$omp parallel do{0}'.format(self._omp_clauses(expr))
+        for line in self._iter_loop(expr.target, expr.start, expr.stop,
+                expr.step, expr.body):
+            yield line
+        if expr.parallel:
+            yield '!$omp end parallel do'
+
+    def _print_Assign(self, expr):
+        rhs = expr.rhs
+        if (isinstance(rhs, C.Piecewise) and rhs.args[-1].cond == True and
+                any(e.count_ops() for (e, c) in rhs.args)):
+            # Only the piece selected is computed, unlike with merge
+            return self._print(C.Piecewise(*[(Assign(expr.lhs, e), c)
+                                             for (e, c) in rhs.args]))
+        return CodePrinter._print_Assign(self, expr)
 
     def _print_Piecewise(self, expr):
         if expr.args[-1].cond != True:
@@ -200,16 +329,32 @@ class FCodePrinter(CodePrinter):
             # operators. This has the downside that inline operators will
             # not work for statements that span multiple lines (Matrix or
             # Indexed expressions).
+            real = self._has_real([e for (e, c) in expr.args])
             pattern = "merge({T}, {F}, {COND})"
-            code = self._print(expr.args[-1].expr)
+            code = self._print_intrinsic_arg(expr.args[-1].expr, real)
             terms = list(expr.args[:-1])
             while terms:
                 e, c = terms.pop()
-                expr = self._print(e)
+                expr = self._print_intrinsic_arg(e, real)
                 cond = self._print(c)
                 code = pattern.format(T=expr, F=code, COND=cond)
             return code
 
+    def _print_intrinsic_arg(self, expr, real):
+        """Print an argument of an intrinsic requiring all its arguments to
+        be of the same type (e.g. ``merge`` or ``max``). Integer literals
+        are printed as reals if `real`, and other integer arguments are
+        converted."""
+        if real and expr.is_Integer:
+            if self._literal_dtype is Float:
+                return '{0}.0'.format(expr)
+            return '{0}.0d0'.format(expr)
+        if real and expr.is_integer:
+            if self._literal_dtype is Float:
+                return 'real({0})'.format(self._print(expr))
+            return 'real({0}, dp)'.format(self._print(expr))
+        return self._print(expr)
+
     def _print_MatrixElement(self, expr):
         return "{0}({1}, {2})".format(expr.parent, expr.i + 1, expr.j + 1)
 
@@ -279,6 +424,9 @@ class FCodePrinter(CodePrinter):
             return CodePrinter._print_Mul(self, expr)
 
     def _print_Pow(self, expr):
+        reduced = self._print_reduced_Pow(expr)
+        if reduced is not None:
+            return reduced
         PREC = precedence(expr)
         if expr.exp == -1:
             return '1.0/%s' % (self.parenthesize(expr.base, PREC))
@@ -296,6 +444,16 @@ class FCodePrinter(CodePrinter):
 
     def _print_Rational(self, expr):
         p, q = int(expr.p), int(expr.q)
+        if self._integer_literals():
+            return "%d/%d" % (p, q)
+        elif self._folds_rationals():
+            printed = repr(float(expr))
+            if self._literal_dtype is Float:
+                return printed
+            e = printed.find('e')
+            if e > -1:
+                return "%sd%s" % (printed[:e], printed[e + 1:])
+            return "%sd0" % printed
         return "%d.0d0/%d.0d0" % (p, q)
 
     def _print_Float(self, expr):
@@ -312,6 +470,25 @@ class FCodePrinter(CodePrinter):
     def _print_Idx(self, expr):
         return self._print(expr.label)
 
+    def _print_Min(self, expr):
+        return self._print_intrinsic('min', expr)
+
+    def _print_Max(self, expr):
+        return self._print_intrinsic('max', expr)
+
+    def _print_Mod(self, expr):
+        return self._print_intrinsic('mod', expr)
+
+    def _has_real(self, args):
+        """Check if any of the arguments of an intrinsic which aren't
+        literals may be real."""
+        return not all(a.is_integer for a in args if not a.is_Number)
+
+    def _print_intrinsic(self, name, expr):
+        real = self._has_real(expr.args)
+        return '{0}({1})'.format(name, ', '.join(
+                self._print_intrinsic_arg(a, real) for a in expr.args))
+
     def _pad_leading_columns(self, lines):
         result = []
         for line in lines:
@@ -330,6 +507,11 @@ class FCodePrinter(CodePrinter):
            A comment line is split at white space. Code lines are split with a more
            complex rule to give nice results.
         """
+        return list(self._iter_wrap_fortran(lines))
+
+    def _iter_wrap_fortran(self, lines):
+        """Wrap an iterable of Fortran lines, yielding one line at a time.
+        See `_wrap_fortran`."""
         # routine to find split point in a code line
         my_alnum = set("_+-." + string.digits + string.ascii_letters)
         my_white = set(" \t()")
@@ -348,11 +530,21 @@ class FCodePrinter(CodePrinter):
                 if pos == 0:
                     return endpos
             return pos
-        # split line by line and add the splitted lines to result
-        result = []
+        # split line by line and yield the splitted lines
         trailing = ' &'
         for line in lines:
-            if line.startswith("! "):
+            if line.lstrip().startswith("!$omp"):
+                # directive line, continued with the directive sentinel
+                pos = split_pos_code(line, 72)
+                hunk = line[:pos].rstrip()
+                line = line[pos:].lstrip()
+                while line:
+                    yield hunk + trailing
+                    pos = split_pos_code(line, 65)
+                    hunk = "!$omp& " + line[:pos].rstrip()
+                    line = line[pos:].lstrip()
+                yield hunk
+            elif line.startswith("! "):
                 # comment line
                 if len(line) > 72:
                     pos = line.rfind(" ", 6, 72)
@@ -360,16 +552,16 @@ class FCodePrinter(CodePrinter):
                         pos = 72
                     hunk = line[:pos]
                     line = line[pos:].lstrip()
-                    result.append(hunk)
+                    yield hunk
                     while len(line) > 0:
                         pos = line.rfind(" ", 0, 66)
                         if pos == -1 or len(line) < 66:
                             pos = 66
                         hunk = line[:pos]
                         line = line[pos:].lstrip()
-                        result.append("%s%s" % ("! ", hunk))
+                        yield "%s%s" % ("! ", hunk)
                 else:
-                    result.append(line)
+                    yield line
             else:
                 # code line
                 pos = split_pos_code(line, 72)
@@ -377,57 +569,47 @@ class FCodePrinter(CodePrinter):
                 line = line[pos:].lstrip()
                 if line:
                     hunk += trailing
-                result.append(hunk)
+                yield hunk
                 while len(line) > 0:
                     pos = split_pos_code(line, 65)
                     hunk = line[:pos].rstrip()
                     line = line[pos:].lstrip()
                     if line:
                         hunk += trailing
-                    result.append("%s%s" % ("      " , hunk))
-        return result
+                    yield "%s%s" % ("      " , hunk)
 
     def indent_code(self, code):
         """Accepts a string of code or a list of code lines"""
         if isinstance(code, string_types):
             code_lines = self.indent_code(code.splitlines(True))
             return ''.join(code_lines)
+        return list(self._iter_indent_code(code))
 
-        code = [ line.lstrip(' \t') for line in code ]
+    def _iter_indent_code(self, code):
+        """Indents an iterable of code lines, yielding one line at a time"""
 
         inc_keyword = ('do ', 'if(', 'if ', 'do\n', 'else')
         dec_keyword = ('end do', 'enddo', 'end if', 'endif', 'else')
 
-        increase = [ int(any(map(line.startswith, inc_keyword)))
-                     for line in code ]
-        decrease = [ int(any(map(line.startswith, dec_keyword)))
-                     for line in code ]
-        continuation = [ int(any(map(line.endswith, ['&', '&\n'])))
-                         for line in code ]
-
         level = 0
         cont_padding = 0
         tabwidth = 4
-        new_code = []
-        for i, line in enumerate(code):
+        for line in code:
+            line = line.lstrip(' \t')
             if line == '' or line == '\n':
-                new_code.append(line)
+                yield line
                 continue
-            level -= decrease[i]
+            level -= int(any(map(line.startswith, dec_keyword)))
 
             padding = " "*(level*tabwidth + cont_padding)
 
-            line = "%s%s" % (padding, line)
+            yield "%s%s" % (padding, line)
 
-            new_code.append(line)
-
-            if continuation[i]:
+            if any(map(line.endswith, ['&', '&\n'])):
                 cont_padding = 2*tabwidth
             else:
                 cont_padding = 0
-            level += increase[i]
-
-        return new_code
+            level += int(any(map(line.startswith, inc_keyword)))
 
 
 def fcode(expr, assign_to=None, **settings):
@@ -450,6 +632,54 @@ def fcode(expr, assign_to=None, **settings):
         their string representations. Alternatively, the dictionary value can
         be a list of tuples i.e. [(argument_test, cfunction_string)]. See below
         for examples.
+    memoize : bool, optional
+        If True [default], each distinct subexpression is only printed once,
+        which is much faster for expressions with many shared subtrees.
+    iterative : bool, optional
+        If True, expressions are printed bottom up using an explicit stack
+        instead of recursion, so very deep expressions can be printed without
+        exceeding the recursion limit. The output is unchanged. Implies
+        ``memoize``. Default is False.
+    max_pow : int, optional
+        Powers with an integer or half-integer exponent of magnitude at most
+        ``max_pow`` are printed as products computed by repeated squaring
+        (times ``sqrt`` of the base for half-integers), instead of calls to
+        the power function. Negative exponents are printed as a single
+        division. In a ``Routine``, the squares of large powers are stored in
+        temporaries. Powers of integers are never rewritten, as the product
+        may overflow. Default is 0, which disables this.
+    dtype : str or DataType, optional
+        The datatype of the printed expression, which sets how its literals
+        are printed. For ``'double'``, rationals are folded into a single
+        double precision literal (``3.5d0``), and for ``'float'`` into a
+        default real one (``3.5``). For ``'int'``, rationals are integer
+        divisions. Inside a ``Routine``, each statement instead uses the type
+        of the variable it assigns to, or the return type. Default is None,
+        which prints rationals as double precision divisions
+        (``7.0d0/2.0d0``).
+    reassociate : int, optional
+        Sums and products of more than ``reassociate`` terms are printed as
+        a balanced tree of parenthesized chains of at most that many terms,
+        instead of a single chain, so the operations can run in parallel.
+        Default is 0, which disables this.
+    structured_matrices : int, optional
+        If nonzero, matrices assigned to a ``MatrixSymbol`` with at least
+        ``structured_matrices`` zero entries are set to zero with an array
+        assignment, and the zeros aren't assigned. In a ``Routine``, equal
+        entries are also assigned in loops, see
+        `symcc.transforms.optimize_routine`. Default is 0, which disables
+        this.
+    cse, parallel, horner, fold_constants, hoist_reciprocals, ... : optional
+        The optimizations applied when printing a ``Routine``, along with
+        ``hoist_invariants``, ``eliminate_dead_code``, ``split_sums``,
+        ``fuse_transcendentals``, ``select_piecewise`` and ``blas``. They're
+        documented in `symcc.transforms.optimize_routine`, and only ``cse``
+        is enabled by default.
+        In Fortran, sines and cosines of the same argument are computed next
+        to each other, so the compiler can combine them, and selected
+        ``Piecewise`` use ``min``, ``max``, ``abs`` or ``merge``. Without
+        ``select_piecewise``, only ``Piecewise`` whose pieces are all symbols
+        or numbers use ``merge``, as it evaluates all its arguments.
 
     Examples
     ========
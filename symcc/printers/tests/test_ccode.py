@@ -1,13 +1,18 @@
-from sympy.core import (pi, oo, symbols, Rational, Integer, Float, GoldenRatio,
-        EulerGamma, Catalan, Lambda)
-from sympy.functions import Piecewise, sin, cos, Abs, exp, ceiling, sqrt, gamma
+from sympy.core import (pi, oo, symbols, Symbol, Rational, Integer, Float, GoldenRatio,
+        EulerGamma, Catalan, Lambda, Mod)
+from sympy.functions import (Piecewise, sin, cos, Abs, exp, ceiling, sqrt,
+        gamma, Min, Max)
 from sympy.sets.fancysets import Range
 from sympy.utilities.pytest import raises
 from sympy.utilities.lambdify import implemented_function
 from sympy.tensor import IndexedBase, Idx
+from sympy.matrices import Matrix, MatrixSymbol, Inverse
 
-from symcc.types.ast import (Assign, AugAssign, For, InArgument, Result,
-        FunctionDef, Return, Import, Declare, Variable)
+from symcc.types import ir
+from symcc.types.ast import (Assign, AugAssign, For, ParallelFor, InArgument, Result,
+        FunctionDef, Return, Import, Declare, Variable, OutArgument, Double,
+        Int, datatype, loop_range)
+from symcc.types.routines import routine
 from symcc.printers import ccode, CCodePrinter
 
 x, y, z = symbols('x, y, z')
@@ -27,6 +32,38 @@ def test_ccode_sqrt():
     assert ccode(sqrt(Float(10))) == "3.16227766016838"
 
 
+def test_ccode_memoize():
+    e = sin(x + y)
+    for i in range(5):
+        e = e*cos(e) + e
+    p = CCodePrinter()
+    code = p.doprint(e)
+    assert code == ccode(e, memoize=False)
+    stats = p.memo_stats()
+    assert stats['hits'] > stats['misses'] > 0
+    assert stats['hit_rate'] == stats['hits']/float(stats['hits'] + stats['misses'])
+    p = CCodePrinter({'memoize': False})
+    p.doprint(e)
+    assert p.memo_stats() == {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
+
+
+def test_ccode_iterative():
+    # Horner form of a polynomial, nested too deep to print recursively
+    e = x
+    for i in range(2000):
+        e = Symbol('c%d' % i) + x*e
+    code = 'c0 + pow(x, 2)'
+    for i in range(1, 2000):
+        code = 'c%d + x*(%s)' % (i, code)
+    raises(RuntimeError, lambda: ccode(e))
+    assert ccode(e, iterative=True) == code
+    e = sin(x + y)*3.5
+    for i in range(3):
+        e = e*cos(e) + e
+    assert ccode(e, iterative=True) == ccode(e)
+    assert ccode(Assign(z, e), iterative=True) == ccode(Assign(z, e))
+
+
 def test_ccode_Pow():
     assert ccode(x**3) == "pow(x, 3)"
     assert ccode(x**(y**3)) == "pow(x, pow(y, 3))"
@@ -54,6 +91,156 @@ def test_ccode_constants_other():
     assert ccode(2*EulerGamma) == "2*EulerGamma"
 
 
+def test_ccode_max_pow():
+    n = symbols('n', integer=True)
+    assert ccode(x**2, max_pow=8) == 'x*x'
+    assert ccode(x**5, max_pow=8) == 'x*x*(x*x)*x'
+    assert ccode(x**8, max_pow=8) == 'x*x*(x*x)*(x*x*(x*x))'
+    assert ccode(x**9, max_pow=8) == 'pow(x, 9)'
+    assert ccode(x**-3, max_pow=8) == '1.0/(x*x*x)'
+    assert ccode(y/x**2, max_pow=8) == 'y/(x*x)'
+    assert ccode(x**Rational(5, 2), max_pow=8) == 'x*x*sqrt(x)'
+    assert ccode(x**Rational(-1, 2), max_pow=8) == '1.0/sqrt(x)'
+    assert ccode((x + y)**2*z, max_pow=8) == 'z*((x + y)*(x + y))'
+    # Powers of integers are left alone
+    assert ccode(n**2, max_pow=8) == 'pow(n, 2)'
+    assert ccode(x**2) == 'pow(x, 2)'
+
+
+def test_ccode_Routine_max_pow():
+    r = routine('test', (a, b), a**7 + b**2*sin(a**5))
+    assert ccode(r, max_pow=8) == ("double test(double a, double b) {\n"
+                                   "    double pw0, pw1;\n"
+                                   "    pw0 = a*a;\n"
+                                   "    pw1 = pw0*pw0;\n"
+                                   "    return a*pw0*pw1 + (b*b)*sin(a*pw1);\n"
+                                   "}")
+
+
+def test_ccode_Routine_horner():
+    r = routine('test', (a, b), sin(a**3*b + 2*a**2 + 1)*(b**3 - b))
+    assert ccode(r, horner=True) == ("double test(double a, double b) {\n"
+                                     "    return b*(pow(b, 2) - 1)*sin(pow(a, 2)*(a*b + 2) + 1);\n"
+                                     "}")
+
+
+def test_ccode_Routine_split_sums():
+    t = symbols('t0:5')
+    r = routine('test', t, sum(t))
+    assert ccode(r, split_sums=2) == (
+            "double test(double t0, double t1, double t2, double t3, double t4) {\n"
+            "    double acc0, acc1, acc2;\n"
+            "    acc0 = t0 + t1;\n"
+            "    acc1 = t2 + t3;\n"
+            "    acc2 = t4;\n"
+            "    return acc0 + acc1 + acc2;\n"
+            "}")
+
+
+def test_ccode_Routine_fuse_transcendentals():
+    r = routine('test', (a, b), sin(a)*cos(a) + exp(a)*exp(b)*cos(b))
+    assert ccode(r, fuse_transcendentals=True) == (
+            "double test(double a, double b) {\n"
+            "    double sin0, cos0;\n"
+            "    sincos(a, &sin0, &cos0);\n"
+            "    return cos0*sin0 + exp(a + b)*cos(b);\n"
+            "}")
+
+
+def test_ccode_Routine_blas():
+    X, Y = MatrixSymbol('X', 2, 2), MatrixSymbol('Y', 2, 2)
+    U, V = MatrixSymbol('U', 2, 1), MatrixSymbol('V', 2, 1)
+    r = routine('test', (X, U, Y, V), (Assign(Y, 2*X*X.T),
+                                       Assign(V, Inverse(X)*U)))
+    assert ccode(r, blas=True) == (
+            "void dgemm_(char *, char *, int *, int *, int *, double *, "
+            "double *, int *, double *, int *, double *, double *, int *);\n"
+            "void dcopy_(int *, double *, int *, double *, int *);\n"
+            "void dgetrf_(int *, int *, double *, int *, int *, int *);\n"
+            "void dgetrs_(char *, int *, int *, double *, int *, int *, "
+            "double *, int *, int *);\n"
+            "void test(double *X, double *U, double *Y, double *V) {\n"
+            "    int ipiv0[2], info0;\n"
+            "    double mat0[4];\n"
+            "    dgemm_(\"T\", \"N\", &(int){2}, &(int){2}, &(int){2}, "
+            "&(double){2}, X, &(int){2}, X, &(int){2}, &(double){0}, Y, "
+            "&(int){2});\n"
+            "    dcopy_(&(int){4}, X, &(int){1}, mat0, &(int){1});\n"
+            "    dgetrf_(&(int){2}, &(int){2}, mat0, &(int){2}, ipiv0, "
+            "&info0);\n"
+            "    dcopy_(&(int){2}, U, &(int){1}, V, &(int){1});\n"
+            "    dgetrs_(\"T\", &(int){2}, &(int){1}, mat0, &(int){2}, ipiv0, "
+            "V, &(int){2}, &info0);\n"
+            "}")
+
+
+def test_ccode_Routine_structured_matrices():
+    X = MatrixSymbol('X', 4, 4)
+    mat = Matrix(4, 4, lambda i, j: x if i == j else (1 if i == 3 else 0))
+    r = routine('test', (x, X), Assign(X, mat))
+    assert ccode(r, structured_matrices=3) == (
+            "void test(double x, double *X) {\n"
+            "    int i0, i1;\n"
+            "    memset(X, 0, 16*sizeof(*X));\n"
+            "    for (i1 = 0; i1 < 3; i1 += 1) {\n"
+            "        X[i1 + 12] = 1;\n"
+            "    }\n"
+            "    for (i0 = 0; i0 < 4; i0 += 1) {\n"
+            "        X[5*i0] = x;\n"
+            "    }\n"
+            "}")
+    # Outside routines, the zeros are only skipped
+    A = MatrixSymbol('A', 2, 3)
+    assert ccode(Matrix([[x, 0, 0], [0, 0, y]]), A,
+                 structured_matrices=3) == (
+            "memset(A, 0, 6*sizeof(*A));\n"
+            "A[0] = x;\n"
+            "A[5] = y;")
+
+
+def test_ccode_Routine_select_piecewise():
+    expr = (Piecewise((a, a < b), (b, True)) +
+            Piecewise((2*a, a > 0), (b, True)) +
+            Piecewise((exp(sin(a) + b), a > 1), (0, True)))
+    r = routine('test', (a, b), expr)
+    assert ccode(r, select_piecewise=2) == (
+            "double test(double a, double b) {\n"
+            "    double pw0, pw1;\n"
+            "    pw0 = 2*a;\n"
+            "    if (a > 1) {\n"
+            "        pw1 = exp(b + sin(a));\n"
+            "    }\n"
+            "    else {\n"
+            "        pw1 = 0;\n"
+            "    }\n"
+            "    return pw1 + ((a > 0) ? (\n"
+            "        pw0\n"
+            "    )\n"
+            "    : (\n"
+            "        b\n"
+            "    )) + fmin(a, b);\n"
+            "}")
+
+
+def test_ccode_Routine_constants():
+    r = routine('test', (a, b), sqrt(2)*pi*a/(a + b) + sin(b)/(a + b))
+    assert ccode(r, fold_constants=True, hoist_reciprocals=True, cse=False) == (
+            "double test(double a, double b) {\n"
+            "    double rcp0;\n"
+            "    rcp0 = 1.0/(a + b);\n"
+            "    return 4.44288293815837*a*rcp0 + rcp0*sin(b);\n"
+            "}")
+
+
+def test_ccode_reassociate():
+    t = symbols('t0:7')
+    assert ccode(sum(t), reassociate=2) == \
+            "(t0 + (t1 + t2)) + ((t3 + t4) + (t5 + t6))"
+    assert ccode(sum(t) - 2*x, reassociate=4) == \
+            "(t0 + t1 + t2 + t3) + (t4 + t5 + t6 - 2*x)"
+    assert ccode(x*y*z/(a*b*c), reassociate=2) == "x*(y*z)/(a*(b*c))"
+
+
 def test_ccode_Rational():
     assert ccode(Rational(3, 7)) == "3.0L/7.0L"
     assert ccode(Rational(18, 9)) == "2"
@@ -63,6 +250,17 @@ def test_ccode_Rational():
     assert ccode(Rational(3, 7)*x) == "(3.0L/7.0L)*x"
 
 
+def test_ccode_Rational_dtype():
+    n = symbols('n', integer=True)
+    assert ccode(Rational(3, 8)*x, dtype='double') == "0.375*x"
+    assert ccode(x - Rational(1, 3), dtype='double') == "x - 0.3333333333333333"
+    assert ccode(x**Rational(-3, 2), dtype='double') == "pow(x, -1.5)"
+    assert ccode(Rational(3, 8)*x + Float(1.5) + 1/x, dtype='float') == \
+            "0.375f*x + 1.5f + 1.0f/x"
+    assert ccode(Rational(3, 2)*n, dtype='int') == "3*n/2"
+    assert ccode(Rational(-1, 2)*n, dtype='int') == "-n/2"
+
+
 def test_ccode_Integer():
     assert ccode(Integer(67)) == "67"
     assert ccode(Integer(-1)) == "-1"
@@ -208,6 +406,60 @@ def test_ccode_For():
                    "}")
 
 
+def test_ccode_ParallelFor():
+    f = ParallelFor(x, Range(0, 10), [Assign(z, x**2), AugAssign(y, '+', z)])
+    assert ccode(f) == ("#pragma omp parallel for private(z) reduction(+:y)\n"
+                        "for (x = 0; x < 10; x += 1) {\n"
+                        "    z = pow(x, 2);\n"
+                        "    y += z;\n"
+                        "}")
+    f = ParallelFor(x, Range(0, 10), [Assign(y, x)], shared=[a])
+    assert ccode(f) == ("#pragma omp parallel for private(y) shared(a)\n"
+                        "for (x = 0; x < 10; x += 1) {\n"
+                        "    y = x;\n"
+                        "}")
+
+
+def test_ccode_For_tiled():
+    i, j, n = symbols('i, j, n', integer=True)
+    i_tile, j_tile = symbols('i_tile, j_tile', integer=True)
+    A = IndexedBase('A', shape=(n, n))
+    f = For(i_tile, Range(0, 64, 32), [
+            For(j_tile, loop_range(0, n, 32), [
+                For(i, loop_range(i_tile, i_tile + 32), [
+                    For(j, loop_range(j_tile, Min(j_tile + 32, n)),
+                        [AugAssign(x, '+', A[i, j])])])])])
+    assert ccode(f) == (
+            "for (i_tile = 0; i_tile < 64; i_tile += 32) {\n"
+            "    for (j_tile = 0; j_tile < n; j_tile += 32) {\n"
+            "        for (i = i_tile; i < i_tile + 32; i += 1) {\n"
+            "            for (j = j_tile; j < ((n < j_tile + 32) ? n : j_tile + 32); j += 1) {\n"
+            "                x += A[i*n + j];\n"
+            "            }\n"
+            "        }\n"
+            "    }\n"
+            "}")
+
+
+def test_ccode_For_unrolled():
+    i, n = symbols('i, n', integer=True)
+    end = n - Mod(n, 2, evaluate=False)
+    f = For(i, loop_range(0, end, 2), [AugAssign(x, '+', i),
+                                       AugAssign(x, '+', i + 1)])
+    assert ccode(f) == ("for (i = 0; i < n - (n % 2); i += 2) {\n"
+                        "    x += i;\n"
+                        "    x += i + 1;\n"
+                        "}")
+
+
+def test_ccode_Min_Max_Mod():
+    i, n = symbols('i, n', integer=True)
+    assert ccode(Min(i + 1, n)) == '((n < i + 1) ? n : i + 1)'
+    assert ccode(Max(x, y)) == 'fmax(x, y)'
+    assert ccode(Mod(i + 1, 2*n)) == '((i + 1) % (2*n))'
+    assert ccode(Mod(x, y)) == 'fmod(x, y)'
+
+
 def test_ccode_FunctionDef():
     name = 'test'
     args = (InArgument('double', a), InArgument('int', b))
@@ -219,6 +471,72 @@ def test_ccode_FunctionDef():
                         "}")
 
 
+def test_ccode_Procedure():
+    args = (InArgument('double', a), OutArgument('double', c))
+    body = [ir.Store(c, a), ir.Loop(x, 0, 4, 1, [ir.Store(c, a*x, '+')], True)]
+    f = ir.Procedure('test', args, body)
+    assert ccode(f) == ("void test(double a, double *c) {\n"
+                        "    (*c) = a;\n"
+                        "    #pragma omp parallel for\n"
+                        "    for (x = 0; x < 4; x += 1) {\n"
+                        "        (*c) += a*x;\n"
+                        "    }\n"
+                        "}")
+    f.body.append(ir.Return(a))
+    f.results.append(Double)
+    assert ccode(f).splitlines()[-2:] == ["    return a;", "}"]
+
+
+def test_ccode_Procedure_dtype():
+    n = symbols('n', integer=True)
+    args = (InArgument('float', a), InArgument('int', n),
+            OutArgument('double', c))
+    body = [ir.Declare(Int, [Variable('int', b)]), ir.Store(b, n/2 + 1),
+            ir.Store(c, a/4), ir.Return(a/4)]
+    f = ir.Procedure('test', args, body, [datatype('float')])
+    assert ccode(f) == ("float test(float a, int n, double *c) {\n"
+                        "    int b;\n"
+                        "    b = n/2 + 1;\n"
+                        "    (*c) = 0.25*a;\n"
+                        "    return 0.25f*a;\n"
+                        "}")
+    r = routine('test', (a,), a/3 + 1)
+    assert ccode(r) == ("double test(double a) {\n"
+                        "    return 0.3333333333333333*a + 1;\n"
+                        "}")
+
+
+def test_ccode_iter_lines():
+    args = (InArgument('double', a), InArgument('int', b))
+    body = (Assign(c, a + b), For(x, Range(0, 2), [AugAssign(c, '+', x)]),
+            For(x, (1, 2), [AugAssign(c, '+', x)]))
+    f = FunctionDef('test', args, body, ())
+    lines = CCodePrinter().iter_lines(f)
+    # Lines are printed lazily, up to the unsupported loop
+    assert [next(lines) for i in range(5)] == [
+            "void test(double a, int b) {",
+            "    c = a + b;",
+            "    for (x = 0; x < 2; x += 1) {",
+            "        c += x;",
+            "    }"]
+    raises(NotImplementedError, lambda: next(lines))
+    f = FunctionDef('test', args, body[:2], ())
+    assert list(CCodePrinter().iter_lines(f)) == ccode(f).splitlines()
+    assert list(CCodePrinter().iter_lines(a + b, 'c')) == ['c = a + b;']
+
+
+def test_ccode_write():
+    class Writer(object):
+        def __init__(self):
+            self.data = []
+        def write(self, s):
+            self.data.append(s)
+    f = For(x, Range(0, 2), [AugAssign(y, '+', x)])
+    out = Writer()
+    CCodePrinter().write(f, out)
+    assert ''.join(out.data) == ccode(f) + '\n'
+
+
 def test_ccode_Import():
     assert ccode(Import('math.h')) == '#include "math.h"'
 
@@ -226,3 +544,86 @@ def test_ccode_Import():
 def test_ccode_Declare():
     assert ccode(Declare('int', Variable('int', a))) == 'int a;'
     assert ccode(Declare('double', (Variable('double', a), Variable('double', b)))) == 'double a, b;'
+
+
+def test_ccode_Assign_Matrix():
+    A = MatrixSymbol('A', 2, 2)
+    mat = Matrix([[x, y], [sin(x), 0]])
+    assert ccode(mat, A) == ("A[0] = x;\n"
+                             "A[1] = y;\n"
+                             "A[2] = sin(x);\n"
+                             "A[3] = 0;")
+
+
+def test_ccode_Routine():
+    X = MatrixSymbol('X', 2, 1)
+    r = routine('test', (a, b, c, X), (sin(a)*cos(b) + 1,
+            Assign(c, 2*sin(a)*cos(b)), Assign(X, Matrix([a*sin(a)*cos(b), b]))))
+    assert ccode(r) == ("double test(double a, double b, double *c, double *X) {\n"
+                        "    double tmp0;\n"
+                        "    tmp0 = sin(a)*cos(b);\n"
+                        "    (*c) = 2*tmp0;\n"
+                        "    X[0] = a*tmp0;\n"
+                        "    X[1] = b;\n"
+                        "    return tmp0 + 1;\n"
+                        "}")
+    assert ccode(r, cse=False) == (
+            "double test(double a, double b, double *c, double *X) {\n"
+            "    (*c) = 2*sin(a)*cos(b);\n"
+            "    X[0] = a*sin(a)*cos(b);\n"
+            "    X[1] = b;\n"
+            "    return sin(a)*cos(b) + 1;\n"
+            "}")
+    r = routine('test', (X, c), Assign(c, X[0, 0] + X[1, 0]))
+    assert ccode(r) == ("void test(double *X, double *c) {\n"
+                        "    (*c) = X[0] + X[1];\n"
+                        "}")
+
+
+def test_ccode_Routine_Indexed():
+    m, n = symbols('m, n', integer=True)
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', m), Idx('j', n)
+    r = routine('matvec', (A, x, y, m, n, a), Assign(y[i], A[i, j]*x[j] + a))
+    assert ccode(r) == (
+            "void matvec(double *A, double *x, double *y, int m, int n, double a) {\n"
+            "    int i, j;\n"
+            "    for (i = 0; i < m; i += 1) {\n"
+            "        y[i] = a;\n"
+            "        for (j = 0; j < n; j += 1) {\n"
+            "            y[i] += x[j]*A[n*i + j];\n"
+            "        }\n"
+            "    }\n"
+            "}")
+    assert ccode(r, parallel=True) == (
+            "void matvec(double *A, double *x, double *y, int m, int n, double a) {\n"
+            "    int i, j;\n"
+            "    #pragma omp parallel for private(j)\n"
+            "    for (i = 0; i < m; i += 1) {\n"
+            "        y[i] = a;\n"
+            "        for (j = 0; j < n; j += 1) {\n"
+            "            y[i] += x[j]*A[n*i + j];\n"
+            "        }\n"
+            "    }\n"
+            "}")
+
+
+def test_ccode_Routine_invariants():
+    m, n = symbols('m, n', integer=True)
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', m), Idx('j', n)
+    r = routine('matvec', (A, x, y, m, n, a),
+                Assign(y[i], sin(a)*A[i, j]*x[j]))
+    assert ccode(r, hoist_invariants=True) == (
+            "void matvec(double *A, double *x, double *y, int m, int n, double a) {\n"
+            "    int i, j, inv0;\n"
+            "    double inv1;\n"
+            "    inv1 = sin(a);\n"
+            "    for (i = 0; i < m; i += 1) {\n"
+            "        y[i] = 0;\n"
+            "        inv0 = n*i;\n"
+            "        for (j = 0; j < n; j += 1) {\n"
+            "            y[i] += inv1*A[inv0 + j]*x[j];\n"
+            "        }\n"
+            "    }\n"
+            "}")
@@ -1,7 +1,7 @@
 from sympy import (sin, cos, atan2, log, exp, gamma, conjugate, sqrt,
         factorial, Piecewise,  symbols, S, Float)
 from sympy import Catalan, EulerGamma, GoldenRatio, I
-from sympy import Function, Rational, Integer, Lambda
+from sympy import Function, Rational, Integer, Lambda, Min, Max, Mod
 
 from sympy.core.relational import Relational
 from sympy.logic.boolalg import And, Or, Not, Equivalent, Xor
@@ -9,8 +9,10 @@ from sympy.tensor import IndexedBase, Idx
 from sympy.utilities.lambdify import implemented_function
 from sympy.sets.fancysets import Range
 from sympy.utilities.pytest import raises
+from sympy.matrices import Matrix, MatrixSymbol, Inverse
 
-from symcc.types.ast import Assign, For, Import, Declare, Variable, InArgument, InOutArgument, OutArgument
+from symcc.types.ast import Assign, AugAssign, For, ParallelFor, Import, Declare, Variable, InArgument, InOutArgument, OutArgument, loop_range
+from symcc.types.routines import routine
 from symcc.printers import fcode, FCodePrinter
 
 x, y, z = symbols('x, y, z')
@@ -33,6 +35,14 @@ def test_fcode_sqrt():
     assert fcode(sqrt(10)) == 'sqrt(10.0d0)'
 
 
+def test_fcode_iterative():
+    e = sin(x + y)*3.5
+    for i in range(3):
+        e = e*cos(e) + e
+    assert fcode(e, iterative=True) == fcode(e)
+    assert fcode(Assign(z, e), iterative=True) == fcode(Assign(z, e))
+
+
 def test_fcode_Pow():
     assert fcode(x**3) == "x**3"
     assert fcode(x**(y**3)) == "x**(y**3)"
@@ -43,6 +53,13 @@ def test_fcode_Pow():
     assert fcode(x**-2.0, 'y') == 'y = x**(-2.0d0)'
 
 
+def test_fcode_max_pow():
+    assert fcode(x**3, max_pow=4) == "x*x*x"
+    assert fcode(x**5, max_pow=4) == "x**5"
+    assert fcode(x**Rational(-7, 2), max_pow=4) == "1.0/(x*x*x*sqrt(x))"
+    assert fcode(n**2, max_pow=4) == "n**2"
+
+
 def test_fcode_constants_other():
     assert fcode(2*GoldenRatio) == "2*GoldenRatio"
     assert fcode(2*Catalan) == "2*Catalan"
@@ -59,6 +76,16 @@ def test_fcode_Rational():
     assert fcode(Rational(3, 7)*x) == "(3.0d0/7.0d0)*x"
 
 
+def test_fcode_Rational_dtype():
+    x = symbols('x')
+    assert fcode(Rational(3, 8)*x, dtype='double') == "0.375d0*x"
+    assert fcode(Rational(1, 10**20)*x, dtype='double') == "1d-20*x"
+    assert fcode(Rational(3, 8)*x, dtype='float') == "0.375*x"
+    assert fcode(Rational(3, 2)*n, dtype='int') == "3*n/2"
+    r = routine('test', (x,), x/4)
+    assert fcode(r).splitlines()[-2] == "test = 0.25d0*x"
+
+
 def test_fcode_Integer():
     assert fcode(Integer(67)) == "67"
     assert fcode(Integer(-1)) == "-1"
@@ -353,11 +380,72 @@ def test_fcode_Assign():
 def test_fcode_For():
     f = For(x, Range(0, 10, 2), [Assign(y, x * y)])
     sol = fcode(f)
-    assert sol == ("do x = 0, 10, 2\n"
+    assert sol == ("do x = 0, 8, 2\n"
                    "    y = x*y\n"
                    "end do")
 
 
+def test_fcode_For_tiled():
+    i, i_tile = symbols('i, i_tile', integer=True)
+    f = For(i_tile, loop_range(0, n, 32), [
+            For(i, loop_range(i_tile, Min(i_tile + 32, n)),
+                [AugAssign(y, '+', i)])])
+    assert fcode(f) == ("do i_tile = 0, n - 1, 32\n"
+                        "    do i = i_tile, min(n, i_tile + 32) - 1, 1\n"
+                        "        y = y + i\n"
+                        "    end do\n"
+                        "end do")
+
+
+def test_fcode_For_unrolled():
+    i = symbols('i', integer=True)
+    end = n - Mod(n, 2, evaluate=False)
+    f = For(i, loop_range(0, end, 2), [AugAssign(y, '+', i),
+                                       AugAssign(y, '+', i + 1)])
+    assert fcode(f) == ("do i = 0, n - mod(n, 2) - 1, 2\n"
+                        "    y = y + i\n"
+                        "    y = y + (i + 1)\n"
+                        "end do")
+
+
+def test_fcode_Min_Max():
+    assert fcode(Max(x, Min(y, z))) == "max(x, min(y, z))"
+    # Arguments must be of the same type
+    assert fcode(Max(x, 0)) == "max(0.0d0, x)"
+    assert fcode(Max(n, 0)) == "max(0, n)"
+    assert fcode(Max(x, n)) == "max(real(n, dp), x)"
+    assert fcode(Min(x, n, 1)) == "min(1.0d0, real(n, dp), x)"
+
+
+def test_fcode_ParallelFor():
+    f = ParallelFor(x, Range(0, 10), [Assign(z, x**2), AugAssign(y, '+', z)])
+    assert fcode(f) == ("!$omp parallel do private(z) reduction(+:y)\n"
+                        "do x = 0, 9, 1\n"
+                        "    z = x**2\n"
+                        "    y = y + z\n"
+                        "end do\n"
+                        "!$omp end parallel do")
+    # Long directives are continued with the directive sentinel
+    names = symbols('a_long_variable_name0:4')
+    f = ParallelFor(x, Range(0, 10), [Assign(y, x)], private=names)
+    assert fcode(f) == (
+            "!$omp parallel do private(a_long_variable_name0, a_long_variable_name1, &\n"
+            "!$omp& a_long_variable_name2, a_long_variable_name3)\n"
+            "do x = 0, 9, 1\n"
+            "    y = x\n"
+            "end do\n"
+            "!$omp end parallel do")
+
+
+def test_fcode_iter_lines():
+    r = routine('test', (a, b, c), Assign(c, sin(a)*cos(b)))
+    assert list(FCodePrinter().iter_lines(r)) == fcode(r).splitlines()
+    f = ParallelFor(x, Range(0, 10), [Assign(y, x)], private=symbols('a_long_variable_name0:4'))
+    assert list(FCodePrinter().iter_lines(f)) == fcode(f).splitlines()
+    assert FCodePrinter().indent_code(['do x = 0, 9, 1', 'y = x', 'end do']) == \
+            ['do x = 0, 9, 1', '    y = x', 'end do']
+
+
 def test_fcode_Import():
     assert fcode(Import('math', 'sin')) == 'use math, only: sin'
 
@@ -369,3 +457,170 @@ def test_fcode_Declare():
             InOutArgument('double', x)))) == ("real(dp), intent(in) :: a, b\n" 
                                               "real(dp), intent(inout) :: x\n" 
                                               "real(dp), intent(out) :: c")
+
+
+def test_fcode_Declare_Matrix():
+    A = MatrixSymbol('A', 3, 2)
+    assert fcode(Declare('double', (InArgument('double', a),
+            InArgument('double', A), Variable('double', b)))) == (
+                    "real(dp) :: b\n"
+                    "real(dp), intent(in) :: a\n"
+                    "real(dp), intent(in), dimension(3, 2) :: A")
+
+
+def test_fcode_Assign_Matrix():
+    A = MatrixSymbol('A', 2, 2)
+    mat = Matrix([[x, y], [sin(x), 0]])
+    assert fcode(mat, A) == ("A(1, 1) = x\n"
+                             "A(2, 1) = sin(x)\n"
+                             "A(1, 2) = y\n"
+                             "A(2, 2) = 0")
+
+
+def test_fcode_Routine():
+    X = MatrixSymbol('X', 2, 1)
+    r = routine('test', (a, b, c, X), (sin(a)*cos(b) + 1,
+            Assign(c, 2*sin(a)*cos(b)), Assign(X, Matrix([a*sin(a)*cos(b), b]))))
+    assert fcode(r) == ("real(dp) function test(a, b, c, X)\n"
+                        "implicit none\n"
+                        "integer, parameter:: dp=kind(0.d0)\n"
+                        "real(dp), intent(in) :: a, b\n"
+                        "real(dp), intent(out) :: c\n"
+                        "real(dp), intent(out), dimension(2, 1) :: X\n"
+                        "real(dp) :: tmp0\n"
+                        "tmp0 = sin(a)*cos(b)\n"
+                        "c = 2*tmp0\n"
+                        "X(1, 1) = a*tmp0\n"
+                        "X(2, 1) = b\n"
+                        "test = tmp0 + 1\n"
+                        "end function")
+
+
+def test_fcode_Routine_Indexed():
+    m = symbols('m', integer=True)
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', m), Idx('j', n)
+    r = routine('matvec', (A, x, y, m, n), Assign(y[i], A[i, j]*x[j]))
+    assert fcode(r) == ("subroutine matvec(A, x, y, m, n)\n"
+                        "implicit none\n"
+                        "integer, parameter:: dp=kind(0.d0)\n"
+                        "real(dp), intent(in), dimension(0:m - 1, 0:n - 1) :: A\n"
+                        "real(dp), intent(in), dimension(0:n - 1) :: x\n"
+                        "real(dp), intent(out), dimension(0:m - 1) :: y\n"
+                        "integer, intent(in) :: m, n\n"
+                        "integer :: i, j\n"
+                        "do i = 0, m - 1, 1\n"
+                        "    y(i) = 0\n"
+                        "    do j = 0, n - 1, 1\n"
+                        "        y(i) = y(i) + (x(j)*A(i, j))\n"
+                        "    end do\n"
+                        "end do\n"
+                        "end subroutine")
+
+
+def test_fcode_Routine_fuse_transcendentals():
+    r = routine('test', (a, b), sin(a)*cos(a) + exp(a)*exp(b))
+    assert fcode(r, fuse_transcendentals=True) == (
+            "real(dp) function test(a, b)\n"
+            "implicit none\n"
+            "integer, parameter:: dp=kind(0.d0)\n"
+            "real(dp), intent(in) :: a, b\n"
+            "real(dp) :: sin0, cos0\n"
+            "sin0 = sin(a)\n"
+            "cos0 = cos(a)\n"
+            "test = cos0*sin0 + exp(a + b)\n"
+            "end function")
+
+
+def test_fcode_Routine_blas():
+    X, Y = MatrixSymbol('X', 2, 2), MatrixSymbol('Y', 2, 2)
+    U, V = MatrixSymbol('U', 2, 1), MatrixSymbol('V', 2, 1)
+    r = routine('test', (X, U, Y, V), (Assign(Y, 2*X*X.T),
+                                       Assign(V, Inverse(X)*U)))
+    assert fcode(r, blas=True) == (
+            "subroutine test(X, U, Y, V)\n"
+            "implicit none\n"
+            "integer, parameter:: dp=kind(0.d0)\n"
+            "real(dp), intent(in), dimension(2, 1) :: U\n"
+            "real(dp), intent(in), dimension(2, 2) :: X\n"
+            "real(dp), intent(out), dimension(2, 1) :: V\n"
+            "real(dp), intent(out), dimension(2, 2) :: Y\n"
+            "integer :: info0\n"
+            "integer, dimension(2, 1) :: ipiv0\n"
+            "real(dp), dimension(2, 2) :: mat0\n"
+            "call dgemm('N', 'T', 2, 2, 2, 2.0d0, X, 2, X, 2, 0.0d0, Y, 2)\n"
+            "call dcopy(4, X, 1, mat0, 1)\n"
+            "call dcopy(2, U, 1, V, 1)\n"
+            "call dgesv(2, 1, mat0, 2, ipiv0, V, 2, info0)\n"
+            "end subroutine")
+
+
+def test_fcode_Routine_structured_matrices():
+    A = MatrixSymbol('A', 3, 3)
+    mat = Matrix(3, 3, lambda i, j: x if i == j else (y if i == j + 1 else 0))
+    r = routine('test', (x, y, A), Assign(A, mat))
+    assert fcode(r, structured_matrices=2) == (
+            "subroutine test(x, y, A)\n"
+            "implicit none\n"
+            "integer, parameter:: dp=kind(0.d0)\n"
+            "real(dp), intent(in) :: x, y\n"
+            "real(dp), intent(out), dimension(3, 3) :: A\n"
+            "integer :: i0\n"
+            "A = 0\n"
+            "do i0 = 1, 2, 1\n"
+            "    A(i0 + 1, i0) = y\n"
+            "end do\n"
+            "do i0 = 0, 2, 1\n"
+            "    A(i0 + 1, i0 + 1) = x\n"
+            "end do\n"
+            "end subroutine")
+
+
+def test_fcode_Routine_shared_condition():
+    # Conditions aren't stored in temporaries, which would be real
+    r = routine('test', (a, b, c, x, y),
+                (Assign(x, Piecewise((a + c, a > b), (b, True))),
+                 Assign(y, Piecewise((sin(a) + c, a > b), (c, True)))))
+    assert fcode(r) == (
+            "subroutine test(a, b, c, x, y)\n"
+            "implicit none\n"
+            "integer, parameter:: dp=kind(0.d0)\n"
+            "real(dp), intent(in) :: a, b, c\n"
+            "real(dp), intent(out) :: x, y\n"
+            "if (a > b) then\n"
+            "    x = a + c\n"
+            "else\n"
+            "    x = b\n"
+            "end if\n"
+            "if (a > b) then\n"
+            "    y = c + sin(a)\n"
+            "else\n"
+            "    y = c\n"
+            "end if\n"
+            "end subroutine")
+
+
+def test_fcode_Piecewise_lifted():
+    # Integer literals are real, as merge needs values of the same type
+    assert fcode(Piecewise((x, x < 1), (0, True))) == "merge(x, 0.0d0, x < 1)"
+    # Only the selected piece is computed
+    expr = Piecewise((x, x < 1), (sin(x)**2, True))
+    assert fcode(expr, assign_to=c) == ("if (x < 1) then\n"
+                                        "    c = x\n"
+                                        "else\n"
+                                        "    c = sin(x)**2\n"
+                                        "end if")
+    r = routine('test', (a, b), 2*Piecewise((a, a < b), (sin(b), True)) +
+                Piecewise((a, a > 0), (b, True)))
+    assert fcode(r) == ("real(dp) function test(a, b)\n"
+                        "implicit none\n"
+                        "integer, parameter:: dp=kind(0.d0)\n"
+                        "real(dp), intent(in) :: a, b\n"
+                        "real(dp) :: pw0\n"
+                        "if (a < b) then\n"
+                        "    pw0 = a\n"
+                        "else\n"
+                        "    pw0 = sin(b)\n"
+                        "end if\n"
+                        "test = 2*pw0 + merge(a, b, a > 0)\n"
+                        "end function")
@@ -0,0 +1,16 @@
+from .cse import *
+from .lowering import *
+from .powers import *
+from .horner import *
+from .constants import *
+from .reciprocals import *
+from .invariants import *
+from .loops import *
+from .deadcode import *
+from .reassociate import *
+from .transcendentals import *
+from .piecewise import *
+from .blas import *
+from .sparse import *
+from .pipeline import *
+from .derivatives import *
@@ -0,0 +1,306 @@
+"""
+Lowering of matrix expressions in lowered functions into calls to BLAS and
+LAPACK.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import S, Symbol
+from sympy.matrices.expressions import (MatrixSymbol, MatAdd, MatMul,
+        Transpose, Inverse, Identity)
+
+from symcc.types import ir
+from symcc.types.ast import Int, Double
+
+__all__ = ["lower_blas", "signatures"]
+
+
+# The types of the arguments of the routines called, which are all passed by
+# reference. Arrays are 'double[]' or 'int[]'.
+signatures = {
+    'dcopy': ('int', 'double[]', 'int', 'double[]', 'int'),
+    'dgemm': ('char', 'char', 'int', 'int', 'int', 'double', 'double[]',
+              'int', 'double[]', 'int', 'double', 'double[]', 'int'),
+    'dgemv': ('char', 'int', 'int', 'double', 'double[]', 'int', 'double[]',
+              'int', 'double', 'double[]', 'int'),
+    'dgesv': ('int', 'int', 'double[]', 'int', 'int[]', 'double[]', 'int',
+              'int'),
+    'dgetrf': ('int', 'int', 'double[]', 'int', 'int[]', 'int'),
+    'dgetrs': ('char', 'int', 'int', 'double[]', 'int', 'int[]', 'double[]',
+               'int', 'int'),
+}
+
+
+def _is_product(expr):
+    """Check if a matrix expression is a product of several matrices."""
+    return isinstance(expr, MatMul) and len(expr.as_coeff_matrices()[1]) > 1
+
+
+def _needs_blas(expr):
+    """Check if a matrix expression has any products or inverses."""
+    return any(isinstance(e, Inverse) or _is_product(e)
+               for e in expr.atoms(MatMul, Inverse))
+
+
+def _flip(flag):
+    return 'N' if flag == 'T' else 'T'
+
+
+class _Lowering(object):
+    """Builds the statements computing matrix expressions, and keeps track
+    of the temporaries they need."""
+
+    def __init__(self, procedure, row_major):
+        self.row_major = row_major
+        self.arrays = ir.new_symbols(procedure, 'mat')
+        self.pivots = ir.new_symbols(procedure, 'ipiv')
+        self.counters = ir.new_symbols(procedure, 'i')
+        self.statuses = ir.new_symbols(procedure, 'info')
+        self.doubles = []
+        self.ints = []
+        self.indices = None
+        self.info = None
+
+    def temp(self, rows, cols, dtype=Double):
+        if dtype is Int:
+            s = MatrixSymbol(next(self.pivots).name, rows, cols)
+            self.ints.append(s)
+        else:
+            s = MatrixSymbol(next(self.arrays).name, rows, cols)
+            self.doubles.append(s)
+        return s
+
+    def status(self):
+        """Returns the variable LAPACK routines report errors in."""
+        if self.info is None:
+            self.info = Symbol(next(self.statuses).name, integer=True)
+            self.ints.append(self.info)
+        return self.info
+
+    def loops(self, target, body):
+        """Returns a loop nest over the entries of `target`, with the body
+        given by ``body(i, j)``. The same loop variables are used for all
+        loop nests."""
+        if self.indices is None:
+            self.indices = [Symbol(next(self.counters).name, integer=True)
+                            for n in range(2)]
+            self.ints.extend(self.indices)
+        i, j = self.indices
+        rows, cols = target.shape
+        return [ir.Loop(i, 0, rows, 1, [ir.Loop(j, 0, cols, 1, body(i, j))])]
+
+    def entrywise(self, expr, out):
+        """Returns an expression equal to `expr`, whose entries can be
+        indexed. Products and inverses in it are computed into temporaries
+        by statements appended to `out`."""
+        if isinstance(expr, MatrixSymbol):
+            return expr
+        elif isinstance(expr, (Transpose, MatAdd)):
+            return expr.func(*[self.entrywise(a, out) for a in expr.args])
+        elif isinstance(expr, MatMul) and not _is_product(expr):
+            coeff, matrices = expr.as_coeff_matrices()
+            return coeff*self.entrywise(matrices[0], out)
+        t = self.temp(*expr.shape)
+        out.extend(self.compute(expr, t))
+        return t
+
+    def operand(self, expr, out):
+        """Returns an array holding `expr` or its transpose, and the BLAS
+        flag saying which. Statements computing it are appended to
+        `out`."""
+        if isinstance(expr, Transpose) and isinstance(expr.arg, MatrixSymbol):
+            return expr.arg, 'T'
+        elif isinstance(expr, MatrixSymbol):
+            return expr, 'N'
+        t = self.temp(*expr.shape)
+        out.extend(self.compute(expr, t))
+        return t, 'N'
+
+    def compute(self, expr, target):
+        """Returns statements storing the matrix expression `expr` in the
+        array `target`, which must not be an operand of `expr`."""
+        if isinstance(expr, MatrixSymbol):
+            rows, cols = expr.shape
+            return [ir.Call('dcopy', (rows*cols, expr, 1, target, 1))]
+        elif isinstance(expr, Identity):
+            out = self.loops(target, lambda i, j: [
+                ir.Store(target[i, j], S.Zero)])
+            i = self.indices[0]
+            out.append(ir.Loop(i, 0, expr.rows, 1,
+                               [ir.Store(target[i, i], S.One)]))
+            return out
+        elif _is_product(expr):
+            return self.product(expr, target, S.Zero)
+        elif isinstance(expr, Inverse):
+            return self.solve(expr.arg, Identity(expr.arg.rows), target)
+        elif isinstance(expr, MatAdd) and any(map(_is_product, expr.args)):
+            # The other terms are stored first, and the products added to
+            # them by the BLAS routines
+            out = []
+            rest = [a for a in expr.args if not _is_product(a)]
+            if len(rest) == 1:
+                out.extend(self.compute(rest[0], target))
+            elif rest:
+                out.extend(self.compute(MatAdd(*rest), target))
+            for a in expr.args:
+                if _is_product(a):
+                    beta = S.One if out else S.Zero
+                    out.extend(self.product(a, target, beta))
+            return out
+        elif isinstance(expr, (Transpose, MatAdd, MatMul)):
+            out = []
+            expr = self.entrywise(expr, out)
+            out.extend(self.loops(target, lambda i, j: [
+                ir.Store(target[i, j], expr[i, j])]))
+            return out
+        # Left to the printer, which stores each entry
+        return [ir.Store(target, expr)]
+
+    def product(self, expr, target, beta):
+        """Returns statements computing ``target = expr + beta*target``, for
+        a product `expr`."""
+        coeff, matrices = expr.as_coeff_matrices()
+        out = []
+        if isinstance(matrices[0], Inverse):
+            rest = matrices[1] if len(matrices) == 2 else MatMul(*matrices[1:])
+            if beta == 0:
+                return self.solve(matrices[0].arg, coeff*rest, target)
+            t = self.temp(*expr.shape)
+            out = self.solve(matrices[0].arg, coeff*rest, t)
+            out.extend(self.loops(target, lambda i, j: [
+                ir.Store(target[i, j], t[i, j], '+')]))
+            return out
+        # Longer products are multiplied two factors at a time, from the
+        # right if the result is a vector, so each product is a matrix-vector
+        # product. Inverses are applied by solving, without computing them.
+        matrices = list(matrices)
+        while len(matrices) > 2:
+            n = len(matrices) - 2 if matrices[-1].cols == 1 else 0
+            a, b = matrices[n:n + 2]
+            t = self.temp(a.rows, b.cols)
+            if isinstance(a, Inverse):
+                out.extend(self.solve(a.arg, b, t))
+            else:
+                out.extend(self.multiply(a, b, t, S.One, S.Zero))
+            matrices[n:n + 2] = [t]
+        out.extend(self.multiply(matrices[0], matrices[1], target, coeff,
+                                 beta))
+        return out
+
+    def multiply(self, a, b, target, alpha, beta):
+        """Returns statements computing ``target = alpha*a*b + beta*target``
+        with ``dgemm``, or ``dgemv`` if `b` is a vector."""
+        out = []
+        m, k = a.shape
+        n = b.cols
+        a, ta = self.operand(a, out)
+        b, tb = self.operand(b, out)
+        if n == 1:
+            # A vector is stored the same way as its transpose
+            rows, cols = a.shape
+            if self.row_major:
+                # Arrays are transposed when viewed in column-major order
+                ta, rows, cols = _flip(ta), cols, rows
+            out.append(ir.Call('dgemv', (ta, rows, cols, alpha, a, rows, b, 1,
+                                         beta, target, 1)))
+        elif self.row_major:
+            # Computes the transpose of the result in column-major order,
+            # which is the result in row-major order
+            out.append(ir.Call('dgemm', (tb, ta, n, m, k, alpha, b, b.cols,
+                                         a, a.cols, beta, target, n)))
+        else:
+            out.append(ir.Call('dgemm', (ta, tb, m, n, k, alpha, a, a.rows,
+                                         b, b.rows, beta, target, m)))
+        return out
+
+    def solve(self, a, rhs, target):
+        """Returns statements computing ``target = a**-1*rhs``, with an LU
+        factorization of `a`."""
+        n = a.rows
+        nrhs = rhs.cols
+        lu = self.temp(n, n)
+        ipiv = self.temp(n, 1, Int)
+        info = self.status()
+        out = self.compute(a, lu)
+        if not self.row_major or isinstance(rhs, Identity):
+            # In row-major order, the factorization is of the transpose of
+            # `a`. The identity is its own transpose, and the inverse of the
+            # transpose, viewed in row-major order, is the inverse.
+            out.extend(self.compute(rhs, target))
+            out.append(ir.Call('dgesv', (n, nrhs, lu, n, ipiv, target, n,
+                                         info)))
+            return out
+        out.append(ir.Call('dgetrf', (n, n, lu, n, ipiv, info)))
+        if nrhs == 1:
+            out.extend(self.compute(rhs, target))
+            out.append(ir.Call('dgetrs', ('T', n, 1, lu, n, ipiv, target, n,
+                                          info)))
+            return out
+        # The right hand sides are solved for in column-major order, and
+        # transposed back
+        work = self.temp(nrhs, n)
+        out.extend(self.compute(rhs.T, work))
+        out.append(ir.Call('dgetrs', ('T', n, nrhs, lu, n, ipiv, work, n,
+                                      info)))
+        out.extend(self.loops(target, lambda i, j: [
+            ir.Store(target[i, j], work[j, i])]))
+        return out
+
+
+def lower_blas(procedure, row_major=True):
+    """Compute the matrix expressions stored in a `Procedure` with calls to
+    BLAS and LAPACK.
+
+    Each array whose value is a matrix expression with products or
+    inverses is computed with `Call` statements, instead of a store of each
+    entry. Products are computed with ``dgemm``, or ``dgemv`` if the result
+    is a vector, with transposed operands passed as such. Longer products
+    are computed two factors at a time, and sums by adding the products to
+    the other terms, which are computed in loops. An inverse multiplying
+    other factors is applied by solving for them with an LU factorization
+    (``dgesv``), without computing the inverse, which is only done for an
+    inverse on its own. Other operands are computed into temporary arrays
+    first.
+
+    The shapes used are those of the operands, so they may be any
+    `MatrixExpr` with a shape, including the results of a `RoutineCall`.
+    The status of the LAPACK routines isn't checked, so the result of
+    inverting a singular matrix is undefined.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    row_major : bool, optional
+        If True [default], arrays are stored in row-major order, as in C.
+        Otherwise they're in column-major order, as in Fortran.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The temporaries are declared at the top of
+        the body.
+
+    """
+    lowering = _Lowering(procedure, row_major)
+    body = []
+    for stmt in procedure.body:
+        if (isinstance(stmt, ir.Store) and stmt.op is None and
+                isinstance(stmt.lhs, MatrixSymbol) and
+                hasattr(stmt.rhs, 'shape') and _needs_blas(stmt.rhs)):
+            target, expr = stmt.lhs, stmt.rhs
+            if target in expr.free_symbols:
+                # The BLAS routines don't allow their output to alias their
+                # inputs
+                t = lowering.temp(*target.shape)
+                body.extend(lowering.compute(expr, t))
+                body.extend(lowering.compute(t, target))
+            else:
+                body.extend(lowering.compute(expr, target))
+        else:
+            body.append(stmt)
+    procedure.body = body
+    ir.declare_temps(procedure, Int, lowering.ints)
+    ir.declare_temps(procedure, Double, lowering.doubles)
+    return procedure
@@ -0,0 +1,72 @@
+"""
+Folding of constant subexpressions.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Basic, Expr, Add, Mul
+from sympy.core.mul import _keep_coeff
+from sympy.matrices import MatrixBase
+
+__all__ = ["fold_constants", "rewrite_constants"]
+
+
+def _evaluate(expr, precision):
+    """Evaluate a constant expression to a Float, if it's real."""
+    value = expr.evalf(precision)
+    return value if value.is_Float else expr
+
+
+def fold_constants(expr, precision=15):
+    """Evaluate all constant subexpressions to floating point numbers.
+
+    The largest subexpressions with no free symbols are evaluated to
+    `precision` significant digits, as are the constant terms of sums and
+    factors of products. Rationals and named constants (e.g. ``pi``) on their
+    own are left as they are, as the printers already print them as
+    literals. Constants which aren't real are also kept.
+
+    Examples
+    --------
+
+    >>> from sympy import symbols, sqrt, pi, sin
+    >>> x = symbols('x')
+    >>> fold_constants(sqrt(2)*pi*x/3 + sin(x + sqrt(3)), 5)
+    1.481*x + sin(x + 1.732)
+
+    """
+    if isinstance(expr, MatrixBase):
+        return expr.applyfunc(lambda e: fold_constants(e, precision))
+    if not isinstance(expr, Basic) or expr.is_Atom:
+        return expr
+    if isinstance(expr, Expr) and expr.is_number:
+        return _evaluate(expr, precision)
+    if expr.is_Add or expr.is_Mul:
+        const = [a for a in expr.args if a.is_number]
+        rest = [fold_constants(a, precision) for a in expr.args
+                if not a.is_number]
+        if len(const) > 1 or (const and not const[0].is_Atom):
+            c = _evaluate(expr.func(*const), precision)
+            if expr.is_Mul:
+                # Don't distribute the coefficient over a sum
+                return _keep_coeff(c, Mul(*rest))
+            return Add(c, *rest)
+        return expr.func(*(const + rest))
+    return expr.func(*[fold_constants(a, precision) for a in expr.args])
+
+
+def rewrite_constants(routine, precision=15):
+    """Evaluate all constant subexpressions in the results of a `Routine`.
+
+    See `fold_constants` for details.
+
+    Returns
+    -------
+    Routine
+        A new routine, with the rewritten results.
+
+    """
+    results = [r.func(r.args[0], fold_constants(r.expr, precision),
+                      *r.args[2:]) for r in routine.results]
+    return routine.func(routine.name, routine.arguments, results)
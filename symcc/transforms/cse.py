@@ -0,0 +1,144 @@
+"""
+Common subexpression elimination for `Routine` objects.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy import cse
+from sympy.core import Expr, Dummy, S
+from sympy.logic.boolalg import Boolean
+from sympy.matrices import ImmutableMatrix, MatrixBase
+from sympy.matrices.expressions.matexpr import MatrixElement
+from sympy.tensor import Idx
+from sympy.utilities.iterables import numbered_symbols
+
+from symcc.types.ast import Variable, datatype
+
+__all__ = ["routine_cse"]
+
+
+def temporary_symbols(expr, prefix='tmp'):
+    """Returns an iterator of unique symbols for use as temporaries.
+
+    Symbols are of the form ``prefix0, prefix1, ...``. Any names already used
+    in `expr` are skipped, so the temporaries never shadow an argument or any
+    other symbol in the generated code.
+    """
+    used = set(str(s) for s in expr.free_symbols)
+    return (s for s in numbered_symbols(prefix) if s.name not in used)
+
+
+def _flatten(exprs):
+    """Flatten explicit matrices into a list of their elements.
+
+    Returns the flat list of scalar expressions, and a list of shapes used to
+    rebuild the original structure. Expressions that can't be reduced (matrix
+    expressions like `MatMul`, or expressions computed inside loops over
+    indices) have a shape of `False`, and aren't included in the flat list."""
+    flat = []
+    shapes = []
+    for e in exprs:
+        if e.has(Idx):
+            shapes.append(False)
+        elif isinstance(e, MatrixBase):
+            flat.extend(e)
+            shapes.append(e.shape)
+        elif isinstance(e, Expr):
+            flat.append(e)
+            shapes.append(None)
+        else:
+            shapes.append(False)
+    return flat, shapes
+
+
+def _unflatten(exprs, flat, shapes):
+    """Inverse of `_flatten`"""
+    flat = iter(flat)
+    out = []
+    for e, shape in zip(exprs, shapes):
+        if shape is None:
+            out.append(next(flat))
+        elif shape is False:
+            out.append(e)
+        else:
+            rows, cols = shape
+            out.append(ImmutableMatrix(rows, cols,
+                    [next(flat) for i in range(rows*cols)]))
+    return out
+
+
+def routine_cse(routine, symbols=None, optimizations=None):
+    """Perform common subexpression elimination on a `Routine`.
+
+    All results of the routine (both `RoutineReturn` and `RoutineInplace`)
+    are reduced jointly, so subexpressions shared between different results
+    are only computed once.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to reduce.
+    symbols : iterator, optional
+        An iterator yielding unique Symbols used to label the temporaries. If
+        not provided, symbols of the form ``tmp0, tmp1, ...`` are used, skipping
+        any names already present in the routine.
+    optimizations : list, optional
+        Pre and post optimizations, passed through to `sympy.cse`.
+
+    Returns
+    -------
+    temps : list
+        A list of ``(Variable, expr)`` pairs, in the order they must be
+        computed.
+    routine : Routine
+        A new `Routine`, with results expressed in terms of the temporaries.
+
+    Examples
+    --------
+
+    >>> from sympy import symbols, sin, cos
+    >>> from symcc.types.ast import Assign
+    >>> from symcc.types.routines import routine
+    >>> a, b, out = symbols('a, b, out')
+    >>> r = routine('test', (a, b, out),
+    ...         (sin(a)*cos(b) + 1, Assign(out, 2*sin(a)*cos(b))))
+    >>> temps, r = routine_cse(r)
+    >>> temps
+    [(Variable(NativeDouble(), tmp0), sin(a)*cos(b))]
+    """
+
+    if symbols is None:
+        symbols = temporary_symbols(routine)
+    exprs = [r.expr for r in routine.results]
+    flat, shapes = _flatten(exprs)
+    # `sympy.cse` can't handle matrix elements, so they're replaced with
+    # dummies for the duration of the elimination. So is True, which it
+    # would otherwise extract from the default conditions of `Piecewise`.
+    elems = set().union(*[e.atoms(MatrixElement) for e in flat])
+    to_dummy = dict((m, Dummy()) for m in elems)
+    to_dummy[S.true] = Dummy()
+    from_dummy = dict((d, m) for (m, d) in to_dummy.items())
+    flat = [e.xreplace(to_dummy) for e in flat]
+    if flat:
+        replacements, reduced = cse(flat, symbols=symbols,
+                optimizations=optimizations)
+    else:
+        replacements, reduced = [], []
+    # Conditions shared by several `Piecewise` can't be stored in the
+    # numeric temporaries, so they're substituted back into their uses
+    conditions = {}
+    temps = []
+    for s, e in replacements:
+        e = e.xreplace(conditions)
+        if isinstance(e, Boolean):
+            conditions[s] = e
+        else:
+            temps.append((s, e))
+    reduced = [e.xreplace(conditions).xreplace(from_dummy) for e in reduced]
+    temps = [(Variable(datatype(e), s), e.xreplace(from_dummy))
+             for (s, e) in temps]
+    reduced = _unflatten(exprs, reduced, shapes)
+    results = [r.func(r.args[0], e, *r.args[2:])
+               for (r, e) in zip(routine.results, reduced)]
+    return temps, routine.func(routine.name, routine.arguments, results)
@@ -0,0 +1,270 @@
+"""
+Dead code elimination and reuse of temporaries in lowered functions.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Symbol
+from sympy.core.compatibility import string_types
+from sympy.matrices.expressions.matexpr import MatrixSymbol, MatrixElement
+from sympy.tensor import Indexed, IndexedBase
+
+from symcc.types import ir
+from symcc.types.ast import FunctionDef, OutArgument, InOutArgument
+from symcc.transforms.lowering import to_ir, from_ir
+
+__all__ = ["eliminate_dead_code"]
+
+
+def _store_uses(stmt):
+    """Returns the names read by a `Store`, including the indices of its
+    target, and the target itself for updates."""
+    lhs = stmt.lhs
+    names = ir.free_names(stmt.rhs)
+    if isinstance(lhs, Indexed):
+        for i in lhs.indices:
+            names.update(ir.free_names(i))
+    elif isinstance(lhs, MatrixElement):
+        names.update(ir.free_names(lhs.i))
+        names.update(ir.free_names(lhs.j))
+    if stmt.op is not None:
+        names.add(ir.target_name(lhs))
+    return names
+
+
+def _overwrites(stmt):
+    """Check if a store overwrites the whole of its target."""
+    return stmt.op is None and isinstance(stmt.lhs, (Symbol, MatrixSymbol))
+
+
+def _live_out(procedure):
+    """Returns the names of the variables that are visible after the
+    procedure returns: arrays, which are passed by reference, and output
+    scalars."""
+    names = set()
+    for a in procedure.arguments:
+        if (isinstance(a.name, (IndexedBase, MatrixSymbol)) or
+                isinstance(a, (OutArgument, InOutArgument))):
+            names.add(str(a.name))
+    return names
+
+
+def _liveness(body, live, remove=False):
+    """Propagate the set of live variables backwards through a list of
+    statements, returning the variables live before them.
+
+    `live` is the set of variables live after the statements. Stores to
+    variables that aren't live are dead, and are removed from `body` if
+    `remove`, as are loops and conditionals left empty."""
+    keep = []
+    for stmt in reversed(body):
+        if isinstance(stmt, ir.Store):
+            name = ir.target_name(stmt.lhs)
+            if name not in live:
+                continue
+            if _overwrites(stmt):
+                live = live - set([name])
+            live = live | _store_uses(stmt)
+        elif isinstance(stmt, ir.Loop):
+            live = _loop_liveness(stmt, live, remove)
+            if not stmt.body:
+                continue
+        elif isinstance(stmt, ir.If):
+            live = _if_liveness(stmt, live, remove)
+            if not any(b for (c, b) in stmt.cases):
+                continue
+        elif isinstance(stmt, ir.Return):
+            live = live | ir.free_names(stmt.expr)
+        elif isinstance(stmt, ir.SinCos):
+            written = set([str(stmt.sin), str(stmt.cos)])
+            if not written & live:
+                continue
+            live = (live - written) | ir.free_names(stmt.arg)
+        elif isinstance(stmt, ir.Call):
+            # Arrays passed may be read or written, so calls are kept, and
+            # the arrays are live before them
+            live = live | ir.names(stmt)
+        elif isinstance(stmt, ir.Clear):
+            name = str(stmt.target)
+            if name not in live:
+                continue
+            live = live - set([name])
+        elif not isinstance(stmt, ir.Declare):
+            live = live | ir.names(stmt)
+        keep.append(stmt)
+    if remove:
+        body[:] = reversed(keep)
+    return live
+
+
+def _loop_liveness(loop, live, remove):
+    """`_liveness` for a loop. The body may run any number of times, so
+    variables live at its start are also live at its end, which is iterated
+    to a fixed point."""
+    end = set(live)
+    while True:
+        start = _liveness(loop.body, end, False)
+        if start.issubset(end):
+            break
+        end |= start
+    if remove:
+        _liveness(loop.body, end, True)
+    bounds = set()
+    for e in (loop.start, loop.stop, loop.step):
+        bounds.update(ir.free_names(e))
+    return live | start | bounds
+
+
+def _if_liveness(stmt, live, remove):
+    """`_liveness` for a conditional. Any one of the cases may run, so the
+    variables live before it are those live before any case body, and
+    those read by the conditions. Without a default case, none may run."""
+    start = set()
+    for (cond, body) in stmt.cases:
+        start |= _liveness(body, live, remove)
+        start |= ir.free_names(cond)
+    if stmt.cases[-1][0] != True:
+        start |= live
+    return start
+
+
+def _prune_clauses(body):
+    """Remove variables no longer used in a parallel loop from its private
+    variables and reductions."""
+    for stmt in ir.walk(body):
+        if isinstance(stmt, ir.Loop) and stmt.parallel:
+            used = set()
+            for s in stmt.body:
+                used.update(ir.names(s))
+            stmt.private = tuple(s for s in stmt.private if str(s) in used)
+            stmt.reductions = tuple((op, s) for (op, s) in stmt.reductions
+                                    if str(s) in used)
+
+
+def _prune_declarations(procedure):
+    """Remove declarations of variables that are no longer used."""
+    used = set()
+    for stmt in procedure.body:
+        used.update(ir.names(stmt))
+    body = []
+    for stmt in procedure.body:
+        if isinstance(stmt, ir.Declare):
+            stmt.variables = [v for v in stmt.variables
+                              if str(v.name) in used]
+            if not stmt.variables:
+                continue
+        body.append(stmt)
+    procedure.body = body
+
+
+def _rename(stmt, mapping):
+    """Replace symbols in a statement in place, including in nested loops
+    and their clauses."""
+    for s in ir.walk([stmt]):
+        if isinstance(s, ir.Store):
+            s.lhs = s.lhs.xreplace(mapping)
+            s.rhs = s.rhs.xreplace(mapping)
+        elif isinstance(s, ir.Loop):
+            s.start, s.stop, s.step = [e.xreplace(mapping) for e in
+                                       (s.start, s.stop, s.step)]
+            s.private = tuple(mapping.get(v, v) for v in s.private)
+            s.shared = tuple(mapping.get(v, v) for v in s.shared)
+            s.reductions = tuple((op, mapping.get(v, v))
+                                 for (op, v) in s.reductions)
+        elif isinstance(s, ir.Return):
+            s.expr = s.expr.xreplace(mapping)
+        elif isinstance(s, ir.SinCos):
+            s.arg = s.arg.xreplace(mapping)
+            s.sin = mapping.get(s.sin, s.sin)
+            s.cos = mapping.get(s.cos, s.cos)
+        elif isinstance(s, ir.If):
+            s.cases = [(c.xreplace(mapping), b) for (c, b) in s.cases]
+        elif isinstance(s, ir.Call):
+            s.args = [a if isinstance(a, string_types) else a.xreplace(mapping)
+                      for a in s.args]
+        elif isinstance(s, ir.Clear):
+            s.target = mapping.get(s.target, s.target)
+
+
+def _reuse_temps(procedure):
+    """Merge local scalars of the same datatype whose lifetimes don't
+    overlap.
+
+    The lifetime of a variable spans the top level statements from its
+    first to its last reference, where a loop counts as one statement. A
+    variable may also take over one whose last use is the statement first
+    assigning it, as the value is stored after the old one is read."""
+    excluded = set(str(a.name) for a in procedure.arguments)
+    excluded.update(str(s.target) for s in ir.walk(procedure.body)
+                    if isinstance(s, ir.Loop))
+    variables = {}
+    for stmt in procedure.body:
+        if isinstance(stmt, ir.Declare):
+            for v in stmt.variables:
+                name = str(v.name)
+                if isinstance(v.name, Symbol) and name not in excluded:
+                    variables[name] = v
+    first, last = {}, {}
+    for n, stmt in enumerate(procedure.body):
+        if isinstance(stmt, ir.Declare):
+            continue
+        for name in ir.names(stmt).intersection(variables):
+            first.setdefault(name, n)
+            last[name] = n
+    # Linear scan, in order of first reference. Registers are the variables
+    # kept, and are active until the last use of every variable mapped
+    # to them.
+    active = []
+    mapping = {}
+    for name in sorted(first, key=lambda s: (first[s], s)):
+        n, v = first[name], variables[name]
+        stmt = procedure.body[n]
+        assigned = (isinstance(stmt, ir.Store) and _overwrites(stmt) and
+                    str(stmt.lhs) == name)
+        for reg in active:
+            end, r = reg
+            if r.dtype is v.dtype and (end < n or (assigned and end == n)):
+                active.remove(reg)
+                mapping[v.name] = r.name
+                active.append((last[name], r))
+                break
+        else:
+            active.append((last[name], v))
+    if mapping:
+        for stmt in procedure.body:
+            if not isinstance(stmt, ir.Declare):
+                _rename(stmt, mapping)
+        _prune_declarations(procedure)
+
+
+def eliminate_dead_code(procedure, reuse_temps=True):
+    """Remove the dead stores in a `Procedure`, and the declarations of
+    variables no longer used.
+
+    A store is dead if the value it writes is never read: it's overwritten
+    first, or the variable isn't read again, and isn't visible to the caller
+    (arrays and output arguments are). Loops left empty are removed too.
+
+    Parameters
+    ----------
+    procedure : Procedure or FunctionDef
+        The function to transform. A `Procedure` is modified in place.
+    reuse_temps : bool, optional
+        If True [default], local scalars of the same datatype whose
+        lifetimes don't overlap are merged into one, so fewer are declared.
+
+    Returns
+    -------
+    Procedure or FunctionDef
+        The transformed function, of the same type as `procedure`.
+
+    """
+    if isinstance(procedure, FunctionDef):
+        return from_ir(eliminate_dead_code(to_ir(procedure), reuse_temps))
+    _liveness(procedure.body, _live_out(procedure), remove=True)
+    _prune_clauses(procedure.body)
+    _prune_declarations(procedure)
+    if reuse_temps:
+        _reuse_temps(procedure)
+    return procedure
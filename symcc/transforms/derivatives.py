@@ -0,0 +1,169 @@
+"""
+Generation of routines computing the derivatives of the results of a
+routine.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Derivative, Symbol
+from sympy.matrices import ImmutableMatrix, MatrixBase
+from sympy.matrices.expressions.matexpr import MatrixSymbol
+
+from symcc.types.ast import (InArgument, InOutArgument, OutArgument, Float,
+        Double)
+from symcc.types.routines import Routine, RoutineInplace
+
+__all__ = ["jacobian_routine"]
+
+
+def _input(routine, a):
+    """Returns the argument of `routine` given by `a`, which may be the
+    argument or its name. It must be a scalar or matrix input."""
+    for arg in routine.arguments:
+        if a == arg or a == arg.name:
+            break
+    else:
+        raise ValueError("{0} isn't an argument of {1}".format(a,
+                         routine.name))
+    if not isinstance(arg, (InArgument, InOutArgument)):
+        raise ValueError("{0} isn't an input".format(arg.name))
+    if not isinstance(arg.name, (Symbol, MatrixSymbol)):
+        raise ValueError("Can't differentiate with respect to "
+                         "{0}".format(arg.name))
+    if arg.dtype not in (Float, Double):
+        raise ValueError("Can't differentiate with respect to {0}, of "
+                         "datatype {1}".format(arg.name, arg.dtype))
+    return arg
+
+
+def _variables(arg):
+    """Returns the scalars making up an argument, in row-major order."""
+    name = arg.name
+    if isinstance(name, MatrixSymbol):
+        return [name[i, j] for i in range(name.rows)
+                for j in range(name.cols)]
+    return [name]
+
+
+def _derivatives(result, variables):
+    """Returns the gradient of a scalar `result`, or the Jacobian of a
+    vector one, as an explicit matrix."""
+    expr = result.expr
+    if getattr(result, 'indices', ()):
+        raise ValueError("Can't differentiate indexed results")
+    if getattr(expr, 'is_Matrix', False):
+        if not isinstance(expr, MatrixBase):
+            expr = expr.as_explicit()
+        if expr.cols != 1:
+            raise ValueError("Can't differentiate a matrix result, only "
+                             "scalars and column vectors")
+        entries = [[e.diff(v) for v in variables] for e in expr]
+    else:
+        entries = [[expr.diff(v)] for v in variables]
+    matrix = ImmutableMatrix(entries)
+    if matrix.has(Derivative):
+        raise ValueError("Can't differentiate {0}".format(result.expr))
+    return matrix
+
+
+def _output_name(result, returns):
+    """Returns the name of the output holding the derivatives of `result`.
+    ``returns`` is the tuple of the `RoutineReturn` of the routine."""
+    vector = getattr(result.expr, 'is_Matrix', False)
+    if isinstance(result, RoutineInplace):
+        return '{0}_{1}'.format(result.argument.name,
+                                'jac' if vector else 'grad')
+    name = 'jac' if vector else 'grad'
+    if len(returns) > 1:
+        name += str(returns.index(result))
+    return name
+
+
+def jacobian_routine(routine, wrt, name=None, values=True):
+    """Return a routine computing the derivatives of the results of a
+    `Routine`.
+
+    The derivatives are taken with respect to the scalars making up the
+    inputs `wrt`: a scalar argument, or each entry of a matrix argument,
+    in row-major order. For each scalar result, the gradient, a column
+    vector, is computed. For each column vector result, the Jacobian is
+    computed, with a row for each entry of the vector. They're computed in
+    new `MatrixSymbol` output arguments, appended to the arguments:
+
+    - ``X_grad`` or ``X_jac`` for a result computed in the argument ``X``.
+    - ``grad`` or ``jac`` for a returned result, numbered by its position
+      in the returns (``grad0``, ``grad1``...) if there are several.
+
+    If `values` is True, the new routine also computes the results of
+    `routine`. All the results are reduced jointly by common subexpression
+    elimination when the code is generated, so work shared between the
+    values and their derivatives is only done once. The derivatives come
+    first in the results, so they're stored before the values overwrite
+    any input they're computed in. Otherwise the new routine takes the same
+    inputs, and only computes the derivatives.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to differentiate.
+    wrt : iterable
+        The inputs to differentiate with respect to, as arguments of
+        `routine`, or their `Symbol` or `MatrixSymbol`.
+    name : str, optional
+        The name of the new routine. Default is the name of `routine` with
+        ``_jac`` appended.
+    values : bool, optional
+        If True [default], the new routine computes the results of
+        `routine` as well.
+
+    Returns
+    -------
+    Routine
+
+    Examples
+    --------
+
+    >>> from sympy import symbols, sin
+    >>> from symcc.types.routines import routine
+    >>> x, y = symbols('x, y')
+    >>> r = jacobian_routine(routine('f', (x, y), sin(x*y)), (x, y))
+    >>> [a.name for a in r.arguments]
+    [x, y, grad]
+    >>> r.results[0].expr
+    Matrix([
+    [y*cos(x*y)],
+    [x*cos(x*y)]])
+    """
+
+    wrt = [_input(routine, a) for a in wrt]
+    if not wrt:
+        raise ValueError("No arguments to differentiate with respect to")
+    variables = []
+    for arg in wrt:
+        variables.extend(_variables(arg))
+    if name is None:
+        name = '{0}_jac'.format(routine.name)
+    used = set(str(a.name) for a in routine.arguments)
+    returns = routine.returns
+    if values:
+        args = list(routine.arguments)
+    else:
+        # The inputs are kept, so both routines take the same inputs
+        args = [InArgument(a.dtype, a.name) if isinstance(a, InOutArgument)
+                else a for a in routine.arguments
+                if not isinstance(a, OutArgument)]
+    results = []
+    for r in routine.results:
+        matrix = _derivatives(r, variables)
+        label = _output_name(r, returns)
+        if label in used:
+            raise ValueError("The output {0} is already an "
+                             "argument".format(label))
+        dtype = Float if r.dtype is Float else Double
+        out = OutArgument(dtype, MatrixSymbol(label, *matrix.shape))
+        args.append(out)
+        results.append(RoutineInplace(out, matrix))
+    if values:
+        results.extend(routine.results)
+    return Routine(name, args, results)
@@ -0,0 +1,94 @@
+"""
+Rewriting of polynomials into Horner form.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Expr, Add, Float
+from sympy.matrices import MatrixBase
+from sympy.polys import Poly
+from sympy.polys.polyerrors import BasePolynomialError
+
+__all__ = ["horner_form", "rewrite_horner"]
+
+
+def _horner_terms(terms, gens):
+    """Build the Horner form of a polynomial.
+
+    `terms` is a dict of ``monomial: coefficient``, and `gens` the
+    expressions for each variable of the monomials. The polynomial is
+    factored in the variable of highest degree, and the coefficients of each
+    power of it recursively, so the result is multivariate Horner form."""
+    degrees = [max(m[k] for m in terms) for k in range(len(gens))]
+    top = max(degrees)
+    if top == 0:
+        return Add(*terms.values())
+    k = degrees.index(top)
+    # Group the terms by their power of gens[k]
+    groups = {}
+    for m, c in terms.items():
+        rest = m[:k] + (0,) + m[k + 1:]
+        groups.setdefault(m[k], {})[rest] = c
+    powers = sorted(groups, reverse=True)
+    form = _horner_terms(groups[powers[0]], gens)
+    for prev, e in zip(powers, powers[1:]):
+        form = form*gens[k]**(prev - e) + _horner_terms(groups[e], gens)
+    return form*gens[k]**powers[-1]
+
+
+def horner_form(expr):
+    """Rewrite all polynomials in an expression into Horner form.
+
+    The largest sums that are polynomials of degree 2 or higher in some
+    variable are rewritten, with their variables (which may be any
+    non-polynomial subexpression, e.g. ``sin(x)``) rewritten recursively.
+    Multivariate polynomials are factored in the variable of highest degree
+    first, and then recursively in the others.
+
+    Examples
+    --------
+
+    >>> from sympy import symbols, sin
+    >>> x, y = symbols('x, y')
+    >>> horner_form(3*x**3 + 2*x**2 + x + 5)
+    x*(x*(3*x + 2) + 1) + 5
+    >>> horner_form(sin(x**2*y + x*y + 1))
+    sin(x*(x*y + y) + 1)
+
+    """
+    if isinstance(expr, MatrixBase):
+        return expr.applyfunc(horner_form)
+    if not isinstance(expr, Expr) or expr.is_Atom:
+        return expr
+    if expr.is_Add:
+        try:
+            poly = Poly(expr)
+            # Floats are kept exactly as they are, instead of being
+            # converted to machine precision
+            if expr.has(Float):
+                poly = Poly(expr, *poly.gens, domain='EX')
+        except BasePolynomialError:
+            poly = None
+        if poly is not None and max(poly.degree_list()) > 1:
+            gens = [horner_form(g) for g in poly.gens]
+            return _horner_terms(dict(poly.terms()), gens)
+    return expr.func(*[horner_form(a) for a in expr.args])
+
+
+def rewrite_horner(routine):
+    """Rewrite all polynomials in the results of a `Routine` into Horner form.
+
+    See `horner_form` for details. This should be done before common
+    subexpression elimination, which would otherwise split the polynomials
+    apart.
+
+    Returns
+    -------
+    Routine
+        A new routine, with the rewritten results.
+
+    """
+    results = [r.func(r.args[0], horner_form(r.expr), *r.args[2:])
+               for r in routine.results]
+    return routine.func(routine.name, routine.arguments, results)
@@ -0,0 +1,209 @@
+"""
+Loop-invariant code motion in lowered functions.
+
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+from sympy.core import Basic, Expr, S
+from sympy.tensor import Indexed, IndexedBase, Idx
+from sympy.tensor.indexed import IndexException
+
+from symcc.types import ir
+from symcc.types.ast import datatype
+
+__all__ = ["flatten_indexed", "hoist_invariants"]
+
+
+def flatten_indexed(expr):
+    """Rewrite multidimensional `Indexed` objects as one-dimensional ones.
+
+    Elements are stored in row-major order, as in the C printer, so
+    ``A[i, j]`` for ``A`` of shape ``(m, n)`` becomes ``A[n*i + j]``, of an
+    array of shape ``(m*n,)`` with the same label. Objects without a known
+    shape are left as they are.
+
+    """
+    if not isinstance(expr, Basic) or expr.is_Atom:
+        return expr
+    if isinstance(expr, Indexed):
+        indices = [flatten_indexed(i) for i in expr.indices]
+        try:
+            shape = expr.shape
+        except IndexException:
+            shape = None
+        if expr.rank == 1 or shape is None:
+            return expr.func(expr.base, *indices)
+        offset = S.Zero
+        stride = S.One
+        for i, dim in reversed(list(zip(indices, shape))):
+            offset += i*stride
+            stride *= dim
+        return IndexedBase(expr.base.label, shape=(stride,))[offset]
+    return expr.func(*[flatten_indexed(a) for a in expr.args])
+
+
+def _worth_hoisting(expr):
+    """Check if an invariant expression is worth computing into a temporary.
+    Atoms (including indices), and negations or numeric multiples of atoms,
+    are cheaper to recompute."""
+    if expr.is_Mul and len(expr.args) == 2 and expr.args[0].is_Number:
+        expr = expr.args[1]
+    if expr.is_Atom or isinstance(expr, Idx):
+        return False
+    return isinstance(expr, Expr) and not expr.is_Relational
+
+
+class _Extractor(object):
+    """Replaces the invariant subexpressions of a loop body with temporaries.
+
+    `hoisted` is a list of ``(symbol, expr)`` pairs, to be computed before
+    the loop. Equal subexpressions share a temporary."""
+
+    def __init__(self, variant, symbols):
+        self.variant = variant
+        self.symbols = symbols
+        self.hoisted = []
+        self.temps = {}
+
+    def invariant(self, expr):
+        return not self.variant.intersection(ir.free_names(expr))
+
+    def temp(self, expr):
+        s = self.temps.get(expr)
+        if s is None:
+            s = self.temps[expr] = next(self.symbols)
+            self.hoisted.append((s, expr))
+        return s
+
+    def __call__(self, expr):
+        if not isinstance(expr, Basic) or expr.is_Atom:
+            return expr
+        if self.invariant(expr):
+            if _worth_hoisting(expr):
+                return self.temp(expr)
+            return expr
+        if expr.is_Add or expr.is_Mul:
+            # Group the invariant terms or factors, including numbers
+            inv = [a for a in expr.args if self.invariant(a)]
+            rest = [self(a) for a in expr.args if not self.invariant(a)]
+            group = expr.func(*inv)
+            if _worth_hoisting(group):
+                return expr.func(self.temp(group), *rest)
+            return expr.func(*(inv + rest))
+        if isinstance(expr, Indexed):
+            return expr.func(expr.base, *[self(i) for i in expr.indices])
+        return expr.func(*[self(a) for a in expr.args])
+
+    def store(self, stmt):
+        """Replace the invariants in a statement, including in the indices
+        of its target."""
+        if isinstance(stmt, ir.Store):
+            if isinstance(stmt.lhs, Indexed):
+                stmt.lhs = self(stmt.lhs)
+            stmt.rhs = self(stmt.rhs)
+        elif isinstance(stmt, ir.Return):
+            stmt.expr = self(stmt.expr)
+
+
+def _hoist_loop(loop, symbols, temps):
+    """Remove the invariant computations from the body of a loop.
+
+    Returns the list of stores computing them, to be placed before the loop.
+    Temporaries hoisted from nested loops, which are in `temps`, are moved
+    out too if they're also invariant in this loop."""
+    # Temporaries stay in the loop if they depend on anything written in it,
+    # including any temporary that stays.
+    ours = [s for s in loop.body if isinstance(s, ir.Store) and
+            s.op is None and s.lhs in temps]
+    variant = ir.written(loop).difference(str(s.lhs) for s in ours)
+    moved = []
+    for stmt in ours:
+        if variant.intersection(ir.free_names(stmt.rhs)):
+            variant.add(str(stmt.lhs))
+        else:
+            moved.append(stmt)
+    loop.body = [s for s in loop.body if not any(s is m for m in moved)]
+    extract = _Extractor(variant, symbols)
+    for stmt in loop.body:
+        extract.store(stmt)
+    for s, e in extract.hoisted:
+        temps[s] = datatype(e)
+        moved.append(ir.Store(s, e))
+    return moved
+
+
+def _hoist_body(body, symbols, temps, parallel=None):
+    """Hoist the loop invariants in a list of statements, returning the new
+    list.
+
+    Temporaries are added to `temps`, and made private to the loop
+    `parallel`, if given."""
+    out = []
+    for stmt in body:
+        if isinstance(stmt, ir.Loop):
+            outer = ir.parallel_loop(stmt, parallel)
+            stmt.body = _hoist_body(stmt.body, symbols, temps, outer)
+            hoisted = _hoist_loop(stmt, symbols, temps)
+            names = tuple(s.lhs for s in hoisted)
+            if outer is stmt:
+                # Hoisted out of the parallel loop, so shared
+                stmt.private = tuple(s for s in stmt.private
+                                     if s not in names)
+            elif parallel is not None:
+                parallel.private += tuple(s for s in names
+                                          if s not in parallel.private)
+            out.extend(hoisted)
+        out.append(stmt)
+    return out
+
+
+def hoist_invariants(procedure, flatten=False, prefix='inv'):
+    """Move the loop-invariant computations in a `Procedure` out of loops.
+
+    In each loop, the largest subexpressions (and groups of terms or
+    factors) which don't depend on the loop target, or on any variable
+    written in the loop, are computed into temporaries before the loop.
+    Nested loops are handled from the inside out, so invariants are moved out
+    of as many loops as they don't depend on. Cheap expressions (symbols,
+    and their negations) are left in place.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    flatten : bool, optional
+        If True, multidimensional `Indexed` objects are first flattened
+        with `flatten_indexed`, so the arithmetic computing their offsets
+        can be hoisted too. Default is False.
+    prefix : str, optional
+        The prefix of the names of the temporaries. Names already used in
+        the procedure are skipped.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The temporaries are declared at the top of
+        the body, with the datatype of the value they hold, and are private
+        to any enclosing parallel loop.
+
+    """
+    if flatten:
+        for stmt in ir.walk(procedure.body):
+            if isinstance(stmt, ir.Store):
+                stmt.lhs = flatten_indexed(stmt.lhs)
+                stmt.rhs = flatten_indexed(stmt.rhs)
+    symbols = ir.new_symbols(procedure, prefix)
+    temps = OrderedDict()
+    procedure.body = _hoist_body(procedure.body, symbols, temps)
+    # Temporaries are declared in order of creation, grouped by datatype
+    dtypes = []
+    for dtype in temps.values():
+        if dtype not in dtypes:
+            dtypes.append(dtype)
+    for dtype in dtypes:
+        ir.declare_temps(procedure, dtype,
+                         [s for s in temps if temps[s] is dtype])
+    return procedure
@@ -0,0 +1,204 @@
+"""
+Tiling and unrolling of `For` loops.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Symbol, Mod, S
+from sympy.functions import Min
+from sympy.sets.fancysets import Range
+
+from symcc.types.ast import For, ParallelFor, loop_range
+
+__all__ = ["tile_loops", "unroll_loop"]
+
+
+def _bounds(loop):
+    """Returns the ``(start, stop, step)`` of a `For` loop."""
+    if not isinstance(loop, For):
+        raise TypeError("Expected a For loop, got {0}".format(type(loop)))
+    if not isinstance(loop.iterable, Range):
+        raise NotImplementedError("Only iterable currently supported is "
+                                  "Range")
+    return loop.iterable.args
+
+
+def _rebuild(loop, target, iterable, body, private=()):
+    """Create a loop like `loop` (keeping it parallel, with its clauses)
+    over a new target and iterable. Symbols in `private` are added to the
+    private clause of a parallel loop."""
+    if not isinstance(loop, ParallelFor):
+        return For(target, iterable, body)
+    private = list(loop.private) + [s for s in private
+                                    if s not in loop.private and s != target]
+    return ParallelFor(target, iterable, body, private, loop.shared,
+                       loop.reductions)
+
+
+def _replace(stmt, mapping):
+    """Substitute symbols in a statement, including in the bounds of
+    nested loops."""
+    if isinstance(stmt, For):
+        iterable = loop_range(*[a.xreplace(mapping) for a in _bounds(stmt)])
+        body = [_replace(s, mapping) for s in stmt.body]
+        return _rebuild(stmt, stmt.target, iterable, body)
+    return stmt.xreplace(mapping)
+
+
+def tile_loops(loop, sizes, targets=None):
+    """Tile a perfect nest of `For` loops, for cache blocking.
+
+    The outer ``len(sizes)`` loops of the nest, starting from `loop`, are
+    each split into a loop over blocks of `size` iterations, and a loop
+    over the iterations in a block. The loops over blocks are all moved
+    outside, so the nest ``i, j`` becomes ``i_tile, j_tile, i, j``. This
+    reorders the iterations of the nest: it's up to the caller to check that
+    this is valid.
+
+    Parameters
+    ----------
+    loop : For
+        The outermost loop of the nest. Each of the loops to tile, except
+        the innermost, must have another `For` as its only statement.
+    sizes : iterable of int
+        The number of iterations in a block, for each loop to tile.
+    targets : iterable of Symbol, optional
+        The targets of the loops over blocks. Default is the target of each
+        loop with ``_tile`` appended. These must be declared by the caller.
+
+    Returns
+    -------
+    For
+        The loop over blocks of the outermost loop. If `loop` is a
+        `ParallelFor`, this is parallel, with the targets of the inner
+        loops added to its private variables.
+
+    Examples
+    --------
+    >>> from sympy import symbols, IndexedBase, Range
+    >>> from symcc.types.ast import For, AugAssign
+    >>> from symcc.printers import ccode
+    >>> i, j = symbols('i, j', integer=True)
+    >>> x, y = IndexedBase('x', shape=(64,)), IndexedBase('y', shape=(64,))
+    >>> loop = For(i, Range(0, 64), [For(j, Range(0, 64),
+    ...            [AugAssign(y[i], '+', x[j])])])
+    >>> print(ccode(tile_loops(loop, [32, 32])))
+    for (i_tile = 0; i_tile < 64; i_tile += 32) {
+        for (j_tile = 0; j_tile < 64; j_tile += 32) {
+            for (i = i_tile; i < i_tile + 32; i += 1) {
+                for (j = j_tile; j < j_tile + 32; j += 1) {
+                    y[i] += x[j];
+                }
+            }
+        }
+    }
+
+    """
+    sizes = list(sizes)
+    if not sizes:
+        raise ValueError("At least one tile size is required")
+    if any(int(s) != s or s < 1 for s in sizes):
+        raise ValueError("Tile sizes must be positive integers")
+    nest = [loop]
+    while len(nest) < len(sizes):
+        body = nest[-1].body
+        if len(body) != 1 or not isinstance(body[0], For):
+            raise ValueError("Only {0} loops in the nest are perfectly "
+                             "nested, can't tile {1}".format(len(nest),
+                                                             len(sizes)))
+        nest.append(body[0])
+    if targets is None:
+        targets = [Symbol('{0}_tile'.format(l.target), integer=True)
+                   for l in nest]
+    targets = list(targets)
+    if len(targets) != len(nest):
+        raise ValueError("Expected {0} tile targets, got "
+                         "{1}".format(len(nest), len(targets)))
+    bounds = [_bounds(l) for l in nest]
+    body = list(nest[-1].body)
+    # Loops over the iterations in a block. A full last block doesn't
+    # need the bound clipped.
+    for l, t, size, (start, stop, step) in reversed(list(zip(nest, targets,
+                                                      sizes, bounds))):
+        end = t + size*step
+        if not ((stop - start)/(size*step)).is_integer:
+            end = Min(end, stop)
+        body = [For(l.target, loop_range(t, end, step), body)]
+    # Loops over blocks
+    for t, size, (start, stop, step) in reversed(list(zip(targets[1:],
+                                                  sizes[1:], bounds[1:]))):
+        body = [For(t, loop_range(start, stop, size*step), body)]
+    start, stop, step = bounds[0]
+    private = targets[1:] + [l.target for l in nest]
+    return _rebuild(loop, targets[0], loop_range(start, stop, sizes[0]*step),
+                    body, private)
+
+
+def unroll_loop(loop, factor=4):
+    """Unroll a `For` loop.
+
+    If the loop has a constant range of at most `factor` iterations, it's
+    replaced by the statements of each iteration. Otherwise the body is
+    repeated `factor` times, for consecutive values of the target, in a loop
+    with a step `factor` times larger. The remaining iterations are
+    unrolled after it if the range is constant, or run in a remainder loop
+    if not.
+
+    Parameters
+    ----------
+    loop : For
+        The loop to unroll.
+    factor : int, optional
+        The number of iterations to run per iteration of the unrolled loop.
+        Default is 4.
+
+    Returns
+    -------
+    list
+        The statements replacing the loop.
+
+    Examples
+    --------
+    >>> from sympy import symbols, IndexedBase, Range
+    >>> from symcc.types.ast import For, AugAssign
+    >>> from symcc.printers import ccode
+    >>> i = symbols('i', integer=True)
+    >>> s, x = symbols('s'), IndexedBase('x', shape=(10,))
+    >>> for stmt in unroll_loop(For(i, Range(0, 10), [AugAssign(s, '+', x[i])])):
+    ...     print(ccode(stmt))
+    for (i = 0; i < 8; i += 4) {
+        s += x[i];
+        s += x[i + 1];
+        s += x[i + 2];
+        s += x[i + 3];
+    }
+    s += x[8];
+    s += x[9];
+
+    """
+    if int(factor) != factor or factor < 1:
+        raise ValueError("The unroll factor must be a positive integer")
+    start, stop, step = _bounds(loop)
+    target = loop.target
+
+    def iteration(value):
+        return [_replace(s, {target: value}) for s in loop.body]
+
+    if all(a.is_Integer for a in (start, stop, step)):
+        values = list(range(int(start), int(stop), int(step)))
+        if len(values) <= factor:
+            return [s for v in values for s in iteration(S(v))]
+        end = start + (len(values)//factor)*factor*step
+        remainder = [s for v in range(int(end), int(stop), int(step))
+                     for s in iteration(S(v))]
+    else:
+        # C and Fortran both truncate the remainder towards zero, so an
+        # empty range stays empty. It's left unevaluated, as SymPy would
+        # otherwise rewrite it in terms of a different (positive) remainder.
+        end = stop - Mod(stop - start, factor*step, evaluate=False)
+        remainder = [For(target, loop_range(end, stop, step), loop.body)]
+    body = [s for n in range(factor) for s in iteration(target + n*step)]
+    unrolled = _rebuild(loop, target, loop_range(start, end, factor*step),
+                        body)
+    return [unrolled] + remainder
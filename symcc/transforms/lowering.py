@@ -0,0 +1,261 @@
+"""
+Lowering of `Routine` descriptions into functions, ready for printing.
+
+Routines are lowered into the lightweight IR of `symcc.types.ir`, which the
+printers work from. The IR can be converted to and from `FunctionDef` ASTs.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Add
+from sympy.core.compatibility import default_sort_key
+from sympy.sets.fancysets import Range
+from sympy.tensor import Indexed, Idx
+from sympy.tensor.index_methods import get_contraction_structure, get_indices
+
+from symcc.types import ir
+from symcc.types.ast import (Assign, AugAssign, Declare, For, ParallelFor,
+        FunctionDef, Result, Return, Variable, Int, loop_range)
+from symcc.transforms.cse import routine_cse, temporary_symbols
+
+__all__ = ["lower_routine", "lower_routine_ir", "to_ir", "from_ir"]
+
+
+def declare(variables):
+    """Create `Declare` statements for an iterable of `Variable`.
+
+    Variables are grouped by datatype, with groups ordered by first
+    appearance."""
+    groups = {}
+    order = []
+    for v in variables:
+        if v.dtype not in groups:
+            groups[v.dtype] = []
+            order.append(v.dtype)
+        groups[v.dtype].append(v)
+    return [Declare(dtype, groups[dtype]) for dtype in order]
+
+
+def _idx_range(idx):
+    """Returns the loop range covering all values of an `Idx`."""
+    if idx.lower is None or idx.upper is None:
+        raise ValueError("Index {0} has no range, and can't be looped "
+                         "over.".format(idx))
+    return loop_range(idx.lower, idx.upper + 1)
+
+
+def _has_nested_contraction(structure):
+    """Check for contractions inside function arguments in the result of
+    `get_contraction_structure`."""
+    for key, value in structure.items():
+        if key is None or isinstance(key, tuple):
+            continue
+        for d in value:
+            if any(isinstance(k, tuple) for k in d):
+                return True
+            if _has_nested_contraction(d):
+                return True
+    return False
+
+
+def _loop_nest(lhs, rhs, indices=(), parallel=False):
+    """Generate the loop nest storing `rhs` in `lhs`, indexed by `indices`.
+
+    The lhs is computed for all values of its indices. Repeated indices on the
+    rhs are summed over, using an inner loop accumulating into the lhs, which
+    may also be a scalar. If `parallel`, the outermost loop over the indices
+    of the lhs is a `ParallelFor`. Each iteration of it writes to distinct
+    elements of the lhs, so this is always safe."""
+
+    for i in sorted(rhs.atoms(Indexed), key=default_sort_key):
+        if not all(isinstance(j, Idx) for j in i.indices):
+            raise ValueError("Only Idx objects may index the rhs of an "
+                             "indexed result, got {0}.".format(i))
+    outer = get_indices(rhs)[0]
+    extra = outer.difference(indices)
+    if extra:
+        raise ValueError("Indices {0} on the rhs don't appear on the lhs "
+                "{1}.".format(', '.join(sorted(str(i) for i in extra)), lhs))
+    structure = get_contraction_structure(rhs)
+    if _has_nested_contraction(structure):
+        raise NotImplementedError("Contractions inside function arguments "
+                                  "are not supported.")
+    # Indices of the lhs repeated in a term are elementwise, not summed over
+    elementwise = list(structure.get(None, ()))
+    contractions = {}
+    for key in structure:
+        if not isinstance(key, tuple):
+            continue
+        dummies = tuple(i for i in key if i not in indices)
+        if dummies:
+            contractions.setdefault(dummies, []).extend(structure[key])
+        else:
+            elementwise.extend(structure[key])
+    body = [Assign(lhs, Add(*elementwise))]
+    for dummies in sorted(contractions, key=default_sort_key):
+        terms = sorted(contractions[dummies], key=default_sort_key)
+        stmt = AugAssign(lhs, '+', Add(*terms))
+        for idx in reversed(sorted(dummies, key=default_sort_key)):
+            stmt = For(idx.label, _idx_range(idx), [stmt])
+        body.append(stmt)
+    for n, idx in reversed(list(enumerate(indices))):
+        loop = ParallelFor if (parallel and n == 0) else For
+        body = [loop(idx.label, _idx_range(idx), body)]
+    return body
+
+
+def _has_contraction(expr):
+    """Check if a scalar result is a sum over indices."""
+    return not getattr(expr, 'is_Matrix', False) and expr.has(Idx)
+
+
+def _loop_variables(statements):
+    """Returns all loop targets in a list of IR statements, in order of first
+    appearance."""
+    targets = []
+    for stmt in ir.walk(statements):
+        if isinstance(stmt, ir.Loop) and stmt.target not in targets:
+            targets.append(stmt.target)
+    return targets
+
+
+def lower_routine_ir(routine, cse=True, parallel=False):
+    """Lower a `Routine` into an IR `Procedure`.
+
+    Inplace results are lowered to stores to their arguments, and returns
+    to a final `Return` statement. Indexed results are lowered to loop nests
+    over the ranges of their indices, with contractions (repeated indices)
+    accumulated in inner loops. Scalar results which are contractions, such
+    as a dot product or a trace, are accumulated in loops too, into their
+    argument, or into a new temporary for returns.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to lower.
+    cse : bool, optional
+        If True [default], common subexpressions across all results of the
+        routine are computed once, and stored in typed temporaries declared at
+        the top of the function body.
+    parallel : bool, optional
+        If True, the outermost loop of each loop nest is parallel, so the
+        iterations are distributed over threads with OpenMP. Default is False.
+
+    Returns
+    -------
+    Procedure
+
+    """
+
+    variables = []
+    body = []
+    if cse:
+        temps, routine = routine_cse(routine)
+        variables.extend(v for (v, e) in temps)
+        body.extend(ir.Store(v.name, e) for (v, e) in temps)
+    for r in routine.inplace:
+        if r.indices:
+            lhs = Indexed(r.argument.name, *r.indices)
+            body.extend(to_ir(s) for s in _loop_nest(lhs, r.expr, r.indices,
+                                                     parallel))
+        elif _has_contraction(r.expr):
+            body.extend(to_ir(s) for s in _loop_nest(r.argument.name,
+                                                     r.expr))
+        else:
+            body.append(ir.Store(r.argument.name, r.expr))
+    returns = []
+    accumulators = temporary_symbols(routine, 'acc')
+    for r in routine.returns:
+        if _has_contraction(r.expr):
+            acc = next(accumulators)
+            variables.append(Variable(r.dtype, acc))
+            body.extend(to_ir(s) for s in _loop_nest(acc, r.expr))
+            returns.append(ir.Return(acc))
+        else:
+            returns.append(ir.Return(r.expr))
+    body.extend(returns)
+    variables.extend(Variable(Int, t) for t in _loop_variables(body))
+    decls = [ir.Declare(d.dtype, d.variables) for d in declare(variables)]
+    return ir.Procedure(routine.name, routine.arguments, decls + body,
+                        [r.dtype for r in routine.returns])
+
+
+def lower_routine(routine, cse=True, parallel=False):
+    """Lower a `Routine` into a `FunctionDef`.
+
+    This is `lower_routine_ir`, with the result converted to an AST. See
+    `lower_routine_ir` for details.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to lower.
+    cse : bool, optional
+        If True [default], common subexpressions are stored in temporaries.
+    parallel : bool, optional
+        If True, the outermost loop of each loop nest is a `ParallelFor`.
+        Default is False.
+
+    Returns
+    -------
+    FunctionDef
+
+    """
+
+    return from_ir(lower_routine_ir(routine, cse, parallel))
+
+
+def to_ir(node):
+    """Convert a `FunctionDef` or statement from the AST into the IR.
+
+    Statements with no equivalent in the IR are kept as they are."""
+    if isinstance(node, Assign):
+        return ir.Store(node.lhs, node.rhs)
+    elif isinstance(node, AugAssign):
+        return ir.Store(node.lhs, node.rhs, node.op)
+    elif isinstance(node, For):
+        if not isinstance(node.iterable, Range):
+            raise NotImplementedError("Only iterable currently supported is "
+                                      "Range")
+        start, stop, step = node.iterable.args
+        body = [to_ir(s) for s in node.body]
+        if isinstance(node, ParallelFor):
+            return ir.Loop(node.target, start, stop, step, body, True,
+                           node.private, node.shared, node.reductions)
+        return ir.Loop(node.target, start, stop, step, body)
+    elif isinstance(node, Declare):
+        return ir.Declare(node.dtype, node.variables)
+    elif isinstance(node, Return):
+        return ir.Return(node.expr)
+    elif isinstance(node, FunctionDef):
+        return ir.Procedure(node.name, node.arguments,
+                            [to_ir(s) for s in node.body],
+                            [r.dtype for r in node.results])
+    return node
+
+
+def from_ir(node):
+    """Convert a `Procedure` or statement from the IR into the AST.
+
+    This is the inverse of `to_ir`."""
+    if isinstance(node, ir.Store):
+        if node.op is None:
+            return Assign(node.lhs, node.rhs)
+        return AugAssign(node.lhs, node.op, node.rhs)
+    elif isinstance(node, ir.Loop):
+        iterable = loop_range(node.start, node.stop, node.step)
+        body = [from_ir(s) for s in node.body]
+        if node.parallel:
+            return ParallelFor(node.target, iterable, body, node.private,
+                               node.shared, node.reductions)
+        return For(node.target, iterable, body)
+    elif isinstance(node, ir.Declare):
+        return Declare(node.dtype, node.variables)
+    elif isinstance(node, ir.Return):
+        return Return(node.expr)
+    elif isinstance(node, ir.Procedure):
+        return FunctionDef(node.name, node.arguments,
+                           [from_ir(s) for s in node.body],
+                           [Result(dtype) for dtype in node.results])
+    return node
@@ -0,0 +1,199 @@
+"""
+Lowering of piecewise expressions in lowered functions into selects or
+branches.
+
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+from sympy.core import Basic
+from sympy.core.relational import (StrictLessThan, LessThan,
+        StrictGreaterThan, GreaterThan)
+from sympy.functions import Piecewise, Min, Max, Abs
+
+from symcc.types import ir
+from symcc.types.ast import Assign, datatype
+
+__all__ = ["lower_piecewise"]
+
+
+def _extremum(expr):
+    """Returns the `Min`, `Max` or `Abs` equal to a `Piecewise` of two
+    pieces, or None.
+
+    These are ``Piecewise((a, a < b), (b, True))`` and the like, and
+    ``Piecewise((a, a > 0), (-a, True))``, for any of the orderings."""
+    if len(expr.args) != 2 or expr.args[1].cond != True:
+        return None
+    (e1, c), (e2, _) = expr.args
+    if isinstance(c, (StrictLessThan, LessThan)):
+        small, large = c.lhs, c.rhs
+    elif isinstance(c, (StrictGreaterThan, GreaterThan)):
+        small, large = c.rhs, c.lhs
+    else:
+        return None
+    if (e1, e2) == (small, large):
+        return Min(small, large)
+    elif (e1, e2) == (large, small):
+        return Max(small, large)
+    elif e1 == -e2 and e1 != 0:
+        # The condition is on the sign of one of the pieces
+        diff = large - small
+        if diff == e1:
+            return Abs(e1)
+        elif diff == e2:
+            return -Abs(e1)
+    return None
+
+
+def _outer_piecewise(expr):
+    """Returns the `Piecewise` subexpressions of `expr` which aren't nested
+    in another, in order of first appearance."""
+    found = OrderedDict()
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if not isinstance(e, Basic) or e.is_Atom:
+            continue
+        if isinstance(e, Piecewise):
+            found[e] = None
+        else:
+            stack.extend(reversed(e.args))
+    return list(found)
+
+
+def _cost(expr):
+    """Returns the number of operations computing all the pieces of a
+    `Piecewise`, and their conditions."""
+    return sum(e.count_ops() + c.count_ops() for (e, c) in expr.args)
+
+
+def _temp(expr, symbols, temps, parallel):
+    """Returns a new temporary for the value of `expr`, private to the loop
+    `parallel`, if given."""
+    s = next(symbols)
+    temps[s] = datatype(expr)
+    if parallel is not None:
+        parallel.private += (s,)
+    return s
+
+
+def _branch(pw, target, max_cost, symbols, temps, parallel):
+    """Returns an `If` storing the piece of `pw` whose condition holds in
+    `target`. Only that piece is computed."""
+    return ir.If([(c, _lower_statement(ir.Store(target, e), max_cost,
+                                       symbols, temps, parallel))
+                  for (e, c) in pw.args])
+
+
+def _lower_statement(stmt, max_cost, symbols, temps, parallel):
+    """Returns the statements replacing a `Store` or `Return`, with the
+    `Piecewise` in its value lowered."""
+    store = isinstance(stmt, ir.Store)
+    expr = stmt.rhs if store else stmt.expr
+    out = []
+    mapping = {}
+    for pw in _outer_piecewise(expr):
+        if pw.has(Assign) or pw.args[-1].cond != True:
+            # Left to the printer, which checks for a default piece
+            continue
+        new = _extremum(pw)
+        if new is not None:
+            mapping[pw] = new
+        elif _cost(pw) <= max_cost and not pw.is_integer:
+            # Compute all the pieces, and select one. Without branches,
+            # loops containing the select can be vectorized.
+            pieces = []
+            for e, c in pw.args:
+                if e.count_ops():
+                    t = _temp(e, symbols, temps, parallel)
+                    out.extend(_lower_statement(ir.Store(t, e), max_cost,
+                                                symbols, temps, parallel))
+                    e = t
+                pieces.append((e, c))
+            mapping[pw] = Piecewise(*pieces)
+        elif store and stmt.op is None and expr == pw:
+            # Branch, storing each piece in the target directly
+            out.append(_branch(pw, stmt.lhs, max_cost, symbols, temps,
+                               parallel))
+            return out
+        else:
+            t = _temp(pw, symbols, temps, parallel)
+            out.append(_branch(pw, t, max_cost, symbols, temps, parallel))
+            mapping[pw] = t
+    if mapping:
+        expr = expr.xreplace(mapping)
+        if store:
+            stmt.rhs = expr
+        else:
+            stmt.expr = expr
+    out.append(stmt)
+    return out
+
+
+def _lower_body(body, max_cost, symbols, temps, parallel=None):
+    """Lower the `Piecewise` in a list of statements, returning the new list.
+    New temporaries are made private to the loop `parallel`, if given."""
+    out = []
+    for stmt in body:
+        if isinstance(stmt, ir.Loop):
+            outer = ir.parallel_loop(stmt, parallel)
+            stmt.body = _lower_body(stmt.body, max_cost, symbols, temps,
+                                    outer)
+            out.append(stmt)
+        elif isinstance(stmt, (ir.Store, ir.Return)):
+            out.extend(_lower_statement(stmt, max_cost, symbols, temps,
+                                        parallel))
+        else:
+            out.append(stmt)
+    return out
+
+
+def lower_piecewise(procedure, max_cost=8, prefix='pw'):
+    """Lower the `Piecewise` expressions stored or returned in a `Procedure`
+    into selects or branches, according to their cost.
+
+    Those equal to a `Min`, `Max`, or `Abs` are replaced by it, which the
+    printers emit as the branchless ``fmin``, ``fmax`` and ``fabs``. Those
+    whose pieces and conditions take at most `max_cost` operations in total
+    are selects: each piece with any operations is computed into a
+    temporary, which the `Piecewise` then chooses between. Compilers emit this as a blend of the
+    values, without branches, so loops containing it can be vectorized.
+    More expensive ones are computed in an `If`, so only the piece whose
+    condition holds is computed.
+
+    Integer `Piecewise` are never selects, as computing all the pieces may
+    divide by zero.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    max_cost : int, optional
+        The maximum number of operations (see `count_ops`) of a `Piecewise`
+        computed with a select. Default is 8.
+    prefix : str, optional
+        The prefix of the names of the temporaries. Names already used in
+        the procedure are skipped.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The temporaries are declared at the top of
+        the body, with the datatype of the value they hold, and are private
+        to any enclosing parallel loop.
+
+    """
+    symbols = ir.new_symbols(procedure, prefix)
+    temps = OrderedDict()
+    procedure.body = _lower_body(procedure.body, max_cost, symbols, temps)
+    dtypes = []
+    for dtype in temps.values():
+        if dtype not in dtypes:
+            dtypes.append(dtype)
+    for dtype in dtypes:
+        ir.declare_temps(procedure, dtype,
+                         [s for s in temps if temps[s] is dtype])
+    return procedure
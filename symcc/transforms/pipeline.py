@@ -0,0 +1,175 @@
+"""
+The optimization passes run when printing a `Routine`, and their settings.
+
+"""
+
+from __future__ import print_function, division
+
+from symcc.transforms.lowering import lower_routine_ir
+from symcc.transforms.powers import reduce_powers
+from symcc.transforms.horner import rewrite_horner
+from symcc.transforms.constants import rewrite_constants
+from symcc.transforms.reciprocals import hoist_reciprocals
+from symcc.transforms.invariants import hoist_invariants
+from symcc.transforms.deadcode import eliminate_dead_code
+from symcc.transforms.reassociate import split_sums
+from symcc.transforms.transcendentals import (rewrite_transcendentals,
+        fuse_sincos)
+from symcc.transforms.piecewise import lower_piecewise
+from symcc.transforms.blas import lower_blas
+from symcc.transforms.sparse import structure_matrices
+
+__all__ = ["pipeline_settings", "optimize_routine"]
+
+
+# The settings of `optimize_routine`, and their defaults. The code printers
+# accept all of them.
+pipeline_settings = {
+    'cse': True,
+    'parallel': False,
+    'precision': 15,
+    'max_pow': 0,
+    'horner': False,
+    'fold_constants': False,
+    'hoist_reciprocals': False,
+    'hoist_invariants': False,
+    'eliminate_dead_code': False,
+    'split_sums': 0,
+    'fuse_transcendentals': False,
+    'select_piecewise': 0,
+    'blas': False,
+    'structured_matrices': 0,
+}
+
+
+def optimize_routine(routine, settings={}, row_major=True,
+        flat_indexing=False):
+    """Lower a `Routine` into an IR `Procedure`, running the optimization
+    passes enabled by `settings`.
+
+    Passes on the `Routine` run first, then it's lowered, and the passes on
+    the `Procedure` run in an order where each one leaves work for the next:
+    matrices are structured before BLAS calls are introduced, invariants are
+    hoisted before powers and reciprocals are computed into temporaries, and
+    dead code is eliminated after all of these.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to lower.
+    settings : dict, optional
+        The settings enabling each pass. Those not given take their default
+        from `pipeline_settings`:
+
+        cse : bool
+            If True [default], common subexpressions are eliminated.
+        parallel : bool
+            If True, the outermost loop over the indices of each indexed
+            result is an OpenMP parallel loop. The code must then be compiled
+            with OpenMP enabled (e.g. ``-fopenmp``). Default is False.
+        precision : int
+            The number of digits constants are folded to [default=15].
+        max_pow : int
+            The squares of powers with an integer or half-integer exponent of
+            magnitude between 4 and ``max_pow`` are stored in temporaries. The
+            printers print the powers themselves as products. Default is 0,
+            which disables this.
+        horner : bool
+            If True, polynomials in the results are rewritten into
+            (multivariate) Horner form. Default is False.
+        fold_constants : bool
+            If True, constant subexpressions in the results (e.g.
+            ``sqrt(2)*pi/3``) are evaluated to ``precision`` digits. Default
+            is False.
+        hoist_reciprocals : bool
+            If True, repeated divisions by the same denominator are replaced
+            by products by its reciprocal, computed once into a temporary.
+            Default is False.
+        hoist_invariants : bool
+            If True, computations in loops which don't depend on the loop
+            variable, or anything written in the loop, are computed into
+            temporaries before the loop. With `flat_indexing`, this includes
+            the arithmetic computing the offsets of multidimensional arrays.
+            Default is False.
+        eliminate_dead_code : bool
+            If True, stores whose values are never read, and the declarations
+            of unused variables, are removed, and temporaries whose lifetimes
+            don't overlap share a variable. Default is False.
+        split_sums : int
+            Sums and products of more than ``split_sums`` terms are computed
+            in chunks of at most that many terms, added to 4 independent
+            partial sums stored in temporaries. Default is 0, which disables
+            this.
+        fuse_transcendentals : bool
+            If True, products of exponentials are merged into one
+            exponential, as are sums of logarithms of positive expressions,
+            and the sine and cosine of the same argument are computed together
+            by a `SinCos` statement. Default is False.
+        select_piecewise : int
+            If nonzero, ``Piecewise`` expressions equal to a minimum, maximum
+            or absolute value are rewritten as such. Those whose pieces take
+            at most ``select_piecewise`` operations compute all the pieces and
+            select one without branching, so loops containing them can be
+            vectorized. More expensive ones only compute the piece selected,
+            in an `If` statement. Default is 0, which disables this.
+        blas : bool
+            If True, arrays assigned matrix expressions with products or
+            inverses are computed with calls to BLAS and LAPACK (``dgemm``,
+            ``dgemv``, ``dgesv``...), instead of entry by entry. The code must
+            then be linked with ``-llapack -lblas``. Default is False.
+        structured_matrices : int
+            If nonzero, matrices assigned to a ``MatrixSymbol`` with at least
+            ``structured_matrices`` zero entries are cleared first, and the
+            zeros aren't assigned. Blocks of equal entries, and runs of at
+            least that many equal entries along a diagonal, row or column are
+            assigned in loops. Default is 0, which disables this.
+
+        Any other settings are ignored.
+    row_major : bool, optional
+        If True [default], arrays are stored in row-major order, as in C.
+        Otherwise they're in column-major order, as in Fortran.
+    flat_indexing : bool, optional
+        If True, multidimensional arrays are indexed by a flat offset, as in
+        C. Default is False.
+
+    Returns
+    -------
+    Procedure
+
+    """
+
+    def setting(name):
+        return settings.get(name, pipeline_settings[name])
+
+    if setting('horner'):
+        routine = rewrite_horner(routine)
+    if setting('fold_constants'):
+        routine = rewrite_constants(routine, setting('precision'))
+    fuse = setting('fuse_transcendentals')
+    if fuse:
+        routine = rewrite_transcendentals(routine)
+    func = lower_routine_ir(routine, cse=setting('cse'),
+                            parallel=setting('parallel'))
+    min_run = setting('structured_matrices')
+    if min_run:
+        structure_matrices(func, min_run, row_major)
+    if setting('blas'):
+        lower_blas(func, row_major)
+    if setting('hoist_invariants'):
+        hoist_invariants(func, flatten=flat_indexing)
+    max_pow = setting('max_pow')
+    if max_pow:
+        reduce_powers(func, max_pow)
+    if setting('hoist_reciprocals'):
+        hoist_reciprocals(func)
+    split = setting('split_sums')
+    if split:
+        split_sums(func, split)
+    if setting('eliminate_dead_code'):
+        eliminate_dead_code(func)
+    if fuse:
+        fuse_sincos(func)
+    select = setting('select_piecewise')
+    if select:
+        lower_piecewise(func, select)
+    return func
@@ -0,0 +1,134 @@
+"""
+Strength reduction of powers in lowered functions.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Pow, Mul
+from sympy.core.compatibility import default_sort_key
+from sympy.functions import sqrt
+
+from symcc.types import ir
+from symcc.types.ast import Double
+
+__all__ = ["pow_reduction", "reduce_powers"]
+
+
+def pow_reduction(expr, max_pow):
+    """Check if a power can be computed as a product of its base.
+
+    This is the case for powers with an integer or half-integer exponent, of
+    magnitude at most `max_pow`. Powers of integers are excluded, as the
+    product may overflow.
+
+    Returns
+    -------
+    None, or a tuple ``(n, half, negative)``, such that ``expr`` is
+    ``base**n``, times ``sqrt(base)`` if `half`, or the reciprocal of this if
+    `negative`.
+
+    """
+    if not max_pow or not getattr(expr, 'is_Pow', False):
+        return None
+    base, exp = expr.args
+    if not exp.is_Rational or exp.q > 2 or base.is_integer:
+        return None
+    n = abs(exp.p)//exp.q
+    if n > max_pow:
+        return None
+    return n, exp.q == 2, exp.is_negative
+
+
+def _reduce_expr(expr, max_pow, symbols):
+    """Rewrite the powers in an expression as products of squares.
+
+    Returns a list of ``(symbol, square)`` pairs, to be computed before the
+    expression, and the rewritten expression."""
+    reductions = {}
+    highest = {}
+    for p in expr.atoms(Pow):
+        r = pow_reduction(p, max_pow)
+        # Powers below 4 need at most one square, so are left to the printer
+        if r is not None and r[0] >= 4:
+            reductions[p] = r
+            highest[p.base] = max(highest.get(p.base, 0), r[0])
+    squares = []
+    chains = {}
+    for base in sorted(highest, key=default_sort_key):
+        # chain[k] is base**(2**k)
+        chain = [base]
+        while 2**len(chain) <= highest[base]:
+            s = next(symbols)
+            squares.append((s, chain[-1]**2))
+            chain.append(s)
+        chains[base] = chain
+    subs = {}
+    for p, (n, half, negative) in reductions.items():
+        chain = chains[p.base]
+        factors = [c for (k, c) in enumerate(chain) if n >> k & 1]
+        if half:
+            factors.append(sqrt(p.base))
+        value = Mul(*factors)
+        subs[p] = 1/value if negative else value
+    return squares, expr.xreplace(subs)
+
+
+def _reduce_body(body, max_pow, symbols, temps, parallel=None):
+    """Reduce the powers in a list of statements, returning the new list.
+
+    Temporaries are appended to `temps`, and made private to the loop
+    `parallel`, if given."""
+    out = []
+    for stmt in body:
+        if isinstance(stmt, ir.Loop):
+            outer = ir.parallel_loop(stmt, parallel)
+            stmt.body = _reduce_body(stmt.body, max_pow, symbols, temps,
+                                     outer)
+        elif isinstance(stmt, (ir.Store, ir.Return)):
+            attr = 'rhs' if isinstance(stmt, ir.Store) else 'expr'
+            squares, expr = _reduce_expr(getattr(stmt, attr), max_pow,
+                                         symbols)
+            setattr(stmt, attr, expr)
+            for (s, e) in squares:
+                out.append(ir.Store(s, e))
+                temps.append(s)
+            if squares and parallel is not None:
+                parallel.private += tuple(s for (s, e) in squares)
+        out.append(stmt)
+    return out
+
+
+def reduce_powers(procedure, max_pow, prefix='pw'):
+    """Rewrite the powers in a `Procedure` as products of repeated squares.
+
+    In each statement, powers with an integer or half-integer exponent of
+    magnitude between 4 and `max_pow` are rewritten. The squares ``base**2,
+    base**4, ...`` they need are computed into temporaries before the
+    statement, and each power is replaced by the product of the squares for
+    the bits of its exponent. Smaller powers, and the squares themselves,
+    are left to be printed as products by the printers (see the ``max_pow``
+    printer setting).
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    max_pow : int
+        The maximum magnitude of exponents to rewrite.
+    prefix : str, optional
+        The prefix of the names of the temporaries. Names already used in
+        the procedure are skipped.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The temporaries are declared at the top of
+        the body, and are private to any enclosing parallel loop.
+
+    """
+    symbols = ir.new_symbols(procedure, prefix)
+    temps = []
+    procedure.body = _reduce_body(procedure.body, max_pow, symbols, temps)
+    ir.declare_temps(procedure, Double, temps)
+    return procedure
@@ -0,0 +1,122 @@
+"""
+Splitting of long sums and products in lowered functions into partial
+accumulators.
+
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+from sympy.core import Add, Mul
+
+from symcc.types import ir
+from symcc.types.ast import datatype
+
+__all__ = ["split_sums"]
+
+
+def _split_statement(stmt, max_terms, accumulators, symbols, temps):
+    """Returns the statements replacing a `Store` or `Return`, computing its
+    value in partial accumulators if it's a long sum or product."""
+    expr = stmt.rhs if isinstance(stmt, ir.Store) else stmt.expr
+    if not (getattr(expr, 'is_Add', False) or getattr(expr, 'is_Mul', False)):
+        return [stmt]
+    if len(expr.args) <= max_terms:
+        return [stmt]
+    func, op = (Add, '+') if expr.is_Add else (Mul, '*')
+    args = expr.args
+    chunks = [func(*args[n:n + max_terms])
+              for n in range(0, len(args), max_terms)]
+    accs = []
+    out = []
+    # Chunks are added to the accumulators in turn, so consecutive stores
+    # are independent of each other
+    for n, chunk in enumerate(chunks):
+        if n < accumulators:
+            s = next(symbols)
+            temps[s] = datatype(expr)
+            accs.append(s)
+            out.append(ir.Store(s, chunk))
+        else:
+            out.append(ir.Store(accs[n % accumulators], chunk, op))
+    if isinstance(stmt, ir.Store):
+        out.append(ir.Store(stmt.lhs, func(*accs), stmt.op))
+    else:
+        out.append(ir.Return(func(*accs)))
+    return out
+
+
+def _split_body(body, max_terms, accumulators, symbols, temps,
+                parallel=None):
+    """Split the long sums and products in a list of statements, returning
+    the new list. New accumulators are made private to the loop `parallel`,
+    if given."""
+    out = []
+    for stmt in body:
+        if isinstance(stmt, ir.Loop):
+            outer = ir.parallel_loop(stmt, parallel)
+            stmt.body = _split_body(stmt.body, max_terms, accumulators,
+                                    symbols, temps, outer)
+            out.append(stmt)
+        elif isinstance(stmt, (ir.Store, ir.Return)):
+            count = len(temps)
+            out.extend(_split_statement(stmt, max_terms, accumulators, symbols,
+                                    temps))
+            if parallel is not None:
+                parallel.private += tuple(list(temps)[count:])
+        else:
+            out.append(stmt)
+    return out
+
+
+def split_sums(procedure, max_terms=64, accumulators=4, prefix='acc'):
+    """Split the long sums and products stored or returned in a `Procedure`
+    into partial accumulators.
+
+    A sum (or product) of more than `max_terms` terms is split into chunks
+    of at most `max_terms` terms, which are added to `accumulators` partial
+    sums in turn. The stored value is then the sum of the partial sums.
+    Instead of one chain of additions, each depending on the last, there are
+    then `accumulators` independent chains, which the processor can run in
+    parallel. This reassociates the sum, as compilers only do with
+    ``-ffast-math``, so the result may differ in the last bits. The
+    statements printed are also shorter, which helps compilers with very
+    large expressions.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    max_terms : int, optional
+        The maximum number of terms computed in one statement. Default is
+        64.
+    accumulators : int, optional
+        The number of partial sums. Default is 4.
+    prefix : str, optional
+        The prefix of the names of the accumulators. Names already used in
+        the procedure are skipped.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The accumulators are declared at the top of
+        the body, with the datatype of the value they hold, and are private
+        to any enclosing parallel loop.
+
+    """
+    if max_terms < 2 or accumulators < 1:
+        raise ValueError("max_terms must be at least 2, and accumulators at "
+                         "least 1")
+    symbols = ir.new_symbols(procedure, prefix)
+    temps = OrderedDict()
+    procedure.body = _split_body(procedure.body, max_terms, accumulators,
+                                 symbols, temps)
+    dtypes = []
+    for dtype in temps.values():
+        if dtype not in dtypes:
+            dtypes.append(dtype)
+    for dtype in dtypes:
+        ir.declare_temps(procedure, dtype,
+                         [s for s in temps if temps[s] is dtype])
+    return procedure
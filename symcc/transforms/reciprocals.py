@@ -0,0 +1,154 @@
+"""
+Hoisting of repeated divisions in lowered functions.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Basic, Mul, Pow
+
+from symcc.types import ir
+from symcc.types.ast import Double
+
+__all__ = ["hoist_reciprocals"]
+
+
+def _split(expr):
+    """Split a product or power into its numerator factors and denominator.
+
+    The denominator is the product of all factors with a negative exponent,
+    excluding constants, which are printed as literals. Returns ``(factors,
+    None)`` if there's no denominator."""
+    factors = Mul.make_args(expr) if expr.is_Mul else (expr,)
+    num, den = [], []
+    for f in factors:
+        if (f.is_Pow and f.exp.is_Number and f.exp.is_negative and
+                not f.base.is_number):
+            den.append(Pow(f.base, -f.exp))
+        else:
+            num.append(f)
+    return num, (Mul(*den) if den else None)
+
+
+def _count_denominators(expr, counts):
+    """Count the divisions by each denominator in an expression."""
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if not isinstance(e, Basic) or e.is_Atom:
+            continue
+        if e.is_Mul or e.is_Pow:
+            num, den = _split(e)
+            if den is not None:
+                counts[den] = counts.get(den, 0) + 1
+                stack.extend(num)
+                stack.extend(den.args if den.is_Mul else (den,))
+                continue
+        stack.extend(e.args)
+
+
+def _replace(expr, recips):
+    """Replace divisions by the denominators in `recips` with products by
+    their reciprocals."""
+    if not isinstance(expr, Basic) or expr.is_Atom:
+        return expr
+    if expr.is_Mul or expr.is_Pow:
+        num, den = _split(expr)
+        if den is not None:
+            num = [_replace(f, recips) for f in num]
+            if den in recips:
+                return Mul(*(num + [recips[den]]))
+            # Only part of the denominator may match, so it's kept whole
+            den = [Pow(_replace(f.base, recips), f.exp) if f.is_Pow else
+                   _replace(f, recips) for f in Mul.make_args(den)]
+            return Mul(*num)/Mul(*den)
+    return expr.func(*[_replace(a, recips) for a in expr.args])
+
+
+def _expr_attr(stmt):
+    return 'rhs' if isinstance(stmt, ir.Store) else 'expr'
+
+
+def _hoist_body(body, symbols, temps, parallel=None):
+    """Hoist the reciprocals in a list of statements, returning the new list.
+
+    Temporaries are appended to `temps`, and made private to the loop
+    `parallel`, if given."""
+    # Group the statements dividing by each denominator, up to the first
+    # statement writing to a variable the denominator depends on. Groups are
+    # [denominator, statement indices, number of divisions].
+    groups = []
+    current = {}
+    for n, stmt in enumerate(body):
+        if isinstance(stmt, ir.Loop):
+            outer = ir.parallel_loop(stmt, parallel)
+            stmt.body = _hoist_body(stmt.body, symbols, temps, outer)
+        elif isinstance(stmt, (ir.Store, ir.Return)):
+            counts = {}
+            _count_denominators(getattr(stmt, _expr_attr(stmt)), counts)
+            for den, count in counts.items():
+                group = current.get(den)
+                if group is None:
+                    group = current[den] = [den, [], 0]
+                    groups.append(group)
+                group[1].append(n)
+                group[2] += count
+        written = ir.written(stmt)
+        if written:
+            for den in list(current):
+                if written.intersection(str(s) for s in den.free_symbols):
+                    del current[den]
+    # Compute each repeated reciprocal before its first use
+    hoisted = {}
+    recips = {}
+    for den, stmts, count in groups:
+        if count < 2:
+            continue
+        s = next(symbols)
+        hoisted.setdefault(stmts[0], []).append(ir.Store(s, 1/den))
+        for n in stmts:
+            recips.setdefault(n, {})[den] = s
+        temps.append(s)
+        if parallel is not None:
+            parallel.private += (s,)
+    out = []
+    for n, stmt in enumerate(body):
+        out.extend(hoisted.get(n, ()))
+        if n in recips:
+            attr = _expr_attr(stmt)
+            setattr(stmt, attr, _replace(getattr(stmt, attr), recips[n]))
+        out.append(stmt)
+    return out
+
+
+def hoist_reciprocals(procedure, prefix='rcp'):
+    """Replace repeated divisions by the same denominator in a `Procedure`
+    with products by its reciprocal.
+
+    Within each block of statements (the function body, or the body of a
+    loop), the reciprocal of each denominator divided by more than once is
+    computed into a temporary before its first use, and the divisions are
+    replaced by products by it. Uses after a statement writing to a variable
+    the denominator depends on use a new temporary. Divisions by constants
+    are left to the printers.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    prefix : str, optional
+        The prefix of the names of the temporaries. Names already used in
+        the procedure are skipped.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The temporaries are declared at the top of
+        the body, and are private to any enclosing parallel loop.
+
+    """
+    symbols = ir.new_symbols(procedure, prefix)
+    temps = []
+    procedure.body = _hoist_body(procedure.body, symbols, temps)
+    ir.declare_temps(procedure, Double, temps)
+    return procedure
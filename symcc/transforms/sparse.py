@@ -0,0 +1,254 @@
+"""
+Storing of explicit matrices according to their structure, and sparse
+outputs of routines.
+
+"""
+
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+from sympy.core import Symbol
+from sympy.matrices import ImmutableMatrix, MatrixBase
+from sympy.matrices.expressions.matexpr import MatrixSymbol
+
+from symcc.types import ir
+from symcc.types.ast import OutArgument, Int
+from symcc.types.routines import Routine, RoutineInplace
+
+__all__ = ["structure_matrices", "sparse_outputs"]
+
+
+def _runs(positions, entries, min_run):
+    """Returns the runs of at least `min_run` consecutive positions in
+    `positions` with the same entry, as lists of positions. Positions
+    without an entry are skipped."""
+    runs = []
+    run = []
+    for p in positions + [None]:
+        if run and (p is None or entries.get(p) != entries[run[0]]):
+            if len(run) >= min_run:
+                runs.append(run)
+            run = []
+        if p in entries:
+            run.append(p)
+    return runs
+
+
+def _blocks(entries, min_run):
+    """Returns the rectangular blocks of at least `min_run` entries all
+    equal to each other, as ``(rows, cols)`` ranges. Each value forms at
+    most one block, which must be all of its entries."""
+    positions = OrderedDict()
+    for p in sorted(entries):
+        positions.setdefault(entries[p], []).append(p)
+    blocks = []
+    for value, ps in positions.items():
+        if len(ps) < min_run:
+            continue
+        rows = [i for (i, j) in ps]
+        cols = [j for (i, j) in ps]
+        r0, r1, c0, c1 = min(rows), max(rows) + 1, min(cols), max(cols) + 1
+        if (r1 - r0)*(c1 - c0) == len(ps):
+            blocks.append(((r0, r1), (c0, c1)))
+    return blocks
+
+
+class _Structure(object):
+    """Builds the statements storing explicit matrices."""
+
+    def __init__(self, procedure, min_run, row_major):
+        self.min_run = min_run
+        self.row_major = row_major
+        # The loop variables, shared by all loops
+        counters = ir.new_symbols(procedure, 'i')
+        self.indices = [Symbol(next(counters).name, integer=True)
+                        for k in range(2)]
+        self.used = set()
+
+    def store(self, target, matrix):
+        """Returns the statements storing the explicit `matrix` in the
+        array `target`."""
+        rows, cols = matrix.shape
+        entries = dict(((i, j), matrix[i, j]) for i in range(rows)
+                       for j in range(cols))
+        out = []
+        zeros = [p for p in entries if entries[p] == 0]
+        if len(zeros) >= self.min_run:
+            out.append(ir.Clear(target))
+            for p in zeros:
+                del entries[p]
+        i, j = self.indices
+        for (r0, r1), (c0, c1) in _blocks(entries, self.min_run):
+            value = entries[(r0, c0)]
+            if r1 - r0 == 1:
+                out.append(ir.Loop(j, c0, c1, 1, [
+                    ir.Store(target[r0, j], value)]))
+            elif c1 - c0 == 1:
+                out.append(ir.Loop(i, r0, r1, 1, [
+                    ir.Store(target[i, c0], value)]))
+            else:
+                out.append(ir.Loop(i, r0, r1, 1, [ir.Loop(j, c0, c1, 1, [
+                    ir.Store(target[i, j], value)])]))
+            for r in range(r0, r1):
+                for c in range(c0, c1):
+                    del entries[(r, c)]
+        # Runs along the diagonals, then along rows and columns
+        for k in range(1 - rows, cols):
+            diagonal = [(r, r + k) for r in range(max(0, -k),
+                                                  min(rows, cols - k))]
+            for run in _runs(diagonal, entries, self.min_run):
+                (r0, c0), value = run[0], entries[run[0]]
+                out.append(ir.Loop(i, r0, r0 + len(run), 1, [
+                    ir.Store(target[i, i + (c0 - r0)], value)]))
+                for p in run:
+                    del entries[p]
+        for r in range(rows):
+            row = [(r, c) for c in range(cols)]
+            for run in _runs(row, entries, self.min_run):
+                c0 = run[0][1]
+                out.append(ir.Loop(j, c0, c0 + len(run), 1, [
+                    ir.Store(target[r, j], entries[run[0]])]))
+                for p in run:
+                    del entries[p]
+        for c in range(cols):
+            col = [(r, c) for r in range(rows)]
+            for run in _runs(col, entries, self.min_run):
+                r0 = run[0][0]
+                out.append(ir.Loop(i, r0, r0 + len(run), 1, [
+                    ir.Store(target[i, c], entries[run[0]])]))
+                for p in run:
+                    del entries[p]
+        # The rest are stored one by one, in the order they're stored in
+        if self.row_major:
+            order = sorted(entries)
+        else:
+            order = sorted(entries, key=lambda p: (p[1], p[0]))
+        self.used.update(s.target for s in ir.walk(out)
+                         if isinstance(s, ir.Loop))
+        out.extend(ir.Store(target[p], entries[p]) for p in order)
+        return out
+
+
+def structure_matrices(procedure, min_run=4, row_major=True):
+    """Store the explicit matrices assigned to arrays in a `Procedure`
+    according to their structure.
+
+    Instead of a store of every entry, an array with at least `min_run`
+    zero entries is first set to zero (with ``memset`` in C), and the zeros
+    are then skipped. Of the other entries, rectangular blocks of equal
+    entries, and runs of at least `min_run` equal entries along a diagonal,
+    a row, or a column are stored in loops. The rest are stored one by one.
+    The size of the code is then proportional to the number of nonzero
+    entries which don't follow a pattern.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    min_run : int, optional
+        The minimum number of entries stored in a loop, or of zeros for the
+        array to be set to zero first. Default is 4.
+    row_major : bool, optional
+        If True [default], arrays are stored in row-major order, as in C.
+        Otherwise they're in column-major order, as in Fortran. Entries are
+        stored one by one in this order.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The loop variables are declared at the top of
+        the body.
+
+    """
+    if min_run < 1:
+        raise ValueError("min_run must be at least 1")
+    structure = _Structure(procedure, min_run, row_major)
+    body = []
+    for stmt in procedure.body:
+        if (isinstance(stmt, ir.Store) and stmt.op is None and
+                isinstance(stmt.lhs, MatrixSymbol) and
+                isinstance(stmt.rhs, MatrixBase)):
+            body.extend(structure.store(stmt.lhs, stmt.rhs))
+        else:
+            body.append(stmt)
+    procedure.body = body
+    ir.declare_temps(procedure, Int, [i for i in structure.indices
+                                      if i in structure.used])
+    return procedure
+
+
+def _column(values):
+    return ImmutableMatrix(len(values), 1, values)
+
+
+def sparse_outputs(routine, format='csr'):
+    """Return matrices from a `Routine` in a sparse format.
+
+    Each explicit matrix assigned to a `MatrixSymbol` output argument ``X``
+    is replaced by outputs holding its nonzero entries, in row-major order,
+    and their (zero-based) indices. These are column vectors, computed by
+    the routine. As the positions of the nonzero entries are known when
+    generating the code, only the entries themselves need to be computed,
+    and the outputs scale with the number of nonzero entries.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to transform.
+    format : str, optional
+        The sparse format of the outputs, as in `scipy.sparse`:
+
+        - ``'csr'`` [default]: ``X_data`` holds the entries, ``X_indices``
+          their columns, and ``X_indptr`` (with one more entry than ``X``
+          has rows) the position in them of the first entry of each row.
+        - ``'coo'``: ``X_data`` holds the entries, and ``X_row`` and
+          ``X_col`` their rows and columns.
+
+        The outputs holding the indices are the same for any inputs, but
+        as they're outputs, they're still stored by every call of the
+        routine. Only ``X_data`` needs to be read after the first call.
+
+    Returns
+    -------
+    Routine
+        A new routine, with the new outputs in place of the matrices.
+
+    """
+    if format not in ('csr', 'coo'):
+        raise ValueError("Unknown sparse format {0}".format(format))
+    sparse = dict((r.argument, r) for r in routine.inplace
+                  if isinstance(r.argument, OutArgument) and
+                  isinstance(r.argument.name, MatrixSymbol) and
+                  isinstance(r.expr, MatrixBase))
+    args = []
+    results = [r for r in routine.results if not
+               (isinstance(r, RoutineInplace) and r.argument in sparse)]
+    for a in routine.arguments:
+        if a not in sparse:
+            args.append(a)
+            continue
+        name, expr = str(a.name), sparse[a].expr
+        rows, cols = expr.shape
+        positions = [(i, j) for i in range(rows) for j in range(cols)
+                     if expr[i, j] != 0]
+        if not positions:
+            raise ValueError("{0} has no nonzero entries".format(name))
+        values = [('data', a.dtype, [expr[p] for p in positions])]
+        if format == 'csr':
+            indptr = [0]*(rows + 1)
+            for (i, j) in positions:
+                indptr[i + 1] += 1
+            for i in range(rows):
+                indptr[i + 1] += indptr[i]
+            values.append(('indices', Int, [j for (i, j) in positions]))
+            values.append(('indptr', Int, indptr))
+        else:
+            values.append(('row', Int, [i for (i, j) in positions]))
+            values.append(('col', Int, [j for (i, j) in positions]))
+        for suffix, dtype, column in values:
+            out = OutArgument(dtype, MatrixSymbol('{0}_{1}'.format(name,
+                                                  suffix), len(column), 1))
+            args.append(out)
+            results.append(RoutineInplace(out, _column(column)))
+    return Routine(routine.name, args, results)
@@ -0,0 +1,78 @@
+from sympy import symbols, MatrixSymbol, Inverse, Matrix
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double, Int
+from symcc.transforms.blas import lower_blas
+
+A = MatrixSymbol('A', 3, 3)
+B = MatrixSymbol('B', 3, 2)
+C = MatrixSymbol('C', 3, 2)
+x = MatrixSymbol('x', 2, 1)
+y = MatrixSymbol('y', 3, 1)
+mat0, mat1 = MatrixSymbol('mat0', 3, 3), MatrixSymbol('mat1', 2, 3)
+vec0 = MatrixSymbol('mat0', 3, 1)
+ipiv0 = MatrixSymbol('ipiv0', 3, 1)
+i0, i1, info0 = symbols('i0, i1, info0', integer=True)
+
+
+def _procedure(out, expr):
+    args = (InArgument(Double, A), InArgument(Double, B),
+            InArgument(Double, x), OutArgument(Double, out))
+    return ir.Procedure('f', args, [ir.Store(out, expr)])
+
+
+def test_lower_blas_products():
+    f = lower_blas(_procedure(C, A*B + 2*B), row_major=False)
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i0), Variable(Int, i1)]),
+            ir.Loop(i0, 0, 3, 1, [
+                ir.Loop(i1, 0, 2, 1, [ir.Store(C[i0, i1], 2*B[i0, i1])])]),
+            ir.Call('dgemm', ('N', 'N', 3, 2, 3, 1, A, 3, B, 3, 1, C, 3))]
+    # In row-major order, the transpose of the product is computed
+    f = lower_blas(_procedure(C, A.T*B/2))
+    assert f.body == [
+            ir.Call('dgemm', ('N', 'T', 2, 3, 3, 0.5, B, 2, A, 3, 0, C, 2))]
+    # Products with vectors are computed from the right
+    f = lower_blas(_procedure(y, A*B*x), row_major=False)
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, vec0)]),
+            ir.Call('dgemv', ('N', 3, 2, 1, B, 3, x, 1, 0, vec0, 1)),
+            ir.Call('dgemv', ('N', 3, 3, 1, A, 3, vec0, 1, 0, y, 1))]
+    # Outputs used as operands are computed into a temporary first
+    f = lower_blas(_procedure(y, A*y))
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, vec0)]),
+            ir.Call('dgemv', ('T', 3, 3, 1, A, 3, y, 1, 0, vec0, 1)),
+            ir.Call('dcopy', (3, vec0, 1, y, 1))]
+
+
+def test_lower_blas_solve():
+    f = lower_blas(_procedure(C, Inverse(A)*B), row_major=False)
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, ipiv0), Variable(Int, info0)]),
+            ir.Declare(Double, [Variable(Double, mat0)]),
+            ir.Call('dcopy', (9, A, 1, mat0, 1)),
+            ir.Call('dcopy', (6, B, 1, C, 1)),
+            ir.Call('dgesv', (3, 2, mat0, 3, ipiv0, C, 3, info0))]
+    # In row-major order, the factorization is of the transpose, and the
+    # right hand sides are transposed
+    f = lower_blas(_procedure(C, Inverse(A)*B))
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, ipiv0), Variable(Int, info0),
+                             Variable(Int, i0), Variable(Int, i1)]),
+            ir.Declare(Double, [Variable(Double, mat0),
+                                Variable(Double, mat1)]),
+            ir.Call('dcopy', (9, A, 1, mat0, 1)),
+            ir.Call('dgetrf', (3, 3, mat0, 3, ipiv0, info0)),
+            ir.Loop(i0, 0, 2, 1, [
+                ir.Loop(i1, 0, 3, 1, [ir.Store(mat1[i0, i1], B[i1, i0])])]),
+            ir.Call('dgetrs', ('T', 3, 2, mat0, 3, ipiv0, mat1, 3, info0)),
+            ir.Loop(i0, 0, 3, 1, [
+                ir.Loop(i1, 0, 2, 1, [ir.Store(C[i0, i1], mat1[i1, i0])])])]
+
+
+def test_lower_blas_elementwise():
+    # Assignments without products or inverses are left to the printer
+    body = [ir.Store(C, 2*B), ir.Store(C, Matrix([[1, 2], [3, 4], [5, 6]]))]
+    f = lower_blas(ir.Procedure('f', (), list(body)))
+    assert f.body == body
@@ -0,0 +1,28 @@
+from sympy import symbols, sqrt, pi, exp, sin, Rational, Matrix, I
+
+from symcc.types.routines import routine
+from symcc.transforms.constants import fold_constants, rewrite_constants
+
+x, y = symbols('x, y')
+
+
+def test_fold_constants():
+    assert str(fold_constants(sqrt(2)*pi*x)) == '4.44288293815837*x'
+    assert str(fold_constants(x + exp(2) + 1)) == 'x + 8.38905609893065'
+    assert str(fold_constants(sin(x + 2*sqrt(3)), 5)) == 'sin(x + 3.4641)'
+    # Sums aren't expanded
+    assert str(fold_constants(2*pi*(x + 1))) == '6.28318530717959*(x + 1)'
+    # Atoms, rationals, and non-real constants are kept
+    expr = pi*x + x/3 + Rational(1, 7)
+    assert fold_constants(expr) == expr
+    assert fold_constants(I*sqrt(2)*x) == I*sqrt(2)*x
+    assert str(fold_constants(Matrix([sqrt(2)*x, y]))) == \
+            'Matrix([[1.4142135623731*x], [y]])'
+
+
+def test_rewrite_constants():
+    r = routine('test', (x, y), (sqrt(2)*x, y + pi**2))
+    folded = rewrite_constants(r, 5)
+    assert [str(res.expr) for res in folded.results] == ['1.4142*x',
+                                                         'y + 9.8696']
+    assert folded.arguments == r.arguments
@@ -0,0 +1,63 @@
+from sympy import (symbols, sin, cos, exp, MatrixSymbol, Matrix, ImmutableMatrix,
+        Piecewise)
+
+from symcc.types.ast import Assign, Variable, OutArgument, Double
+from symcc.types.routines import (routine, Routine, RoutineReturn,
+        RoutineInplace)
+from symcc.transforms.cse import routine_cse, temporary_symbols
+
+a, b, c = symbols('a, b, c')
+out = symbols('out')
+x = MatrixSymbol('x', 2, 1)
+tmp0, tmp1 = symbols('tmp0, tmp1')
+
+
+def test_temporary_symbols():
+    r = routine('test', (a, tmp0), a + tmp0)
+    syms = temporary_symbols(r)
+    assert next(syms) == tmp1
+
+
+def test_routine_cse():
+    r = routine('test', (a, b), sin(a)*cos(b) + exp(sin(a)*cos(b)))
+    temps, red = routine_cse(r)
+    assert temps == [(Variable(Double, tmp0), sin(a)*cos(b))]
+    assert red == Routine('test', r.arguments,
+            (RoutineReturn(Double, tmp0 + exp(tmp0)),))
+
+
+def test_routine_cse_joint():
+    # Subexpressions are shared between returns and inplace results
+    r = routine('test', (a, b, out),
+            (sin(a)*cos(b) + 1, Assign(out, 2*sin(a)*cos(b))))
+    temps, red = routine_cse(r)
+    assert temps == [(Variable(Double, tmp0), sin(a)*cos(b))]
+    out_arg = OutArgument(Double, out)
+    assert red.results == (RoutineReturn(Double, tmp0 + 1),
+            RoutineInplace(out_arg, 2*tmp0))
+
+
+def test_routine_cse_matrix():
+    r = routine('test', (a, b, x),
+            (a*sin(a + b), Assign(x, Matrix([sin(a + b), cos(a + b)]))))
+    temps, red = routine_cse(r)
+    assert temps == [(Variable(Double, tmp0), a + b),
+                     (Variable(Double, tmp1), sin(tmp0))]
+    assert red.returns[0].expr == a*tmp1
+    assert red.inplace[0].expr == ImmutableMatrix([tmp1, cos(tmp0)])
+
+
+def test_routine_cse_piecewise():
+    # The default conditions aren't extracted
+    expr = Piecewise((a, a < b), (b, True)) + Piecewise((sin(a), a > 0),
+                                                        (cos(a), True))
+    temps, red = routine_cse(routine('test', (a, b), expr))
+    assert temps == []
+    assert red.returns[0].expr == expr
+
+
+def test_routine_cse_no_common():
+    r = routine('test', (a, b), a + b)
+    temps, red = routine_cse(r)
+    assert temps == []
+    assert red == r
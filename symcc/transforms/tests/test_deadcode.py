@@ -0,0 +1,167 @@
+from sympy import symbols, sin, cos, IndexedBase, MatrixSymbol
+
+from symcc.types import ir
+from symcc.types.ast import (Assign, Declare, FunctionDef, InArgument,
+        OutArgument, Variable, Double, Int)
+from symcc.transforms.deadcode import eliminate_dead_code
+
+x, y, s, t, t0, t1, t2 = symbols('x, y, s, t, t0, t1, t2')
+i = symbols('i', integer=True)
+A = IndexedBase('A')
+
+
+def test_eliminate_dead_code():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    body = [ir.Declare(Double, [Variable(Double, t0), Variable(Double, t1),
+                                Variable(Double, t2)]),
+            # Overwritten before being read
+            ir.Store(t0, sin(x)),
+            ir.Store(t0, cos(x)),
+            # Never read
+            ir.Store(t1, x**2),
+            ir.Store(y, t0 + 1),
+            ir.Store(y, 2*t0),
+            ir.Store(t2, x + y),
+            ir.Return(t2)]
+    f = eliminate_dead_code(ir.Procedure('f', args, body, [Double]),
+                            reuse_temps=False)
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, t0), Variable(Double, t2)]),
+            ir.Store(t0, cos(x)),
+            ir.Store(y, 2*t0),
+            ir.Store(t2, x + y),
+            ir.Return(t2)]
+    # t0 isn't used once t2 is assigned, so they can share a variable
+    f = eliminate_dead_code(f)
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, t0)]),
+            ir.Store(t0, cos(x)),
+            ir.Store(y, 2*t0),
+            ir.Store(t0, x + y),
+            ir.Return(t0)]
+
+
+def test_eliminate_dead_code_reuse():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    body = [ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, t0), Variable(Double, t1),
+                                Variable(Double, t2)]),
+            ir.Store(t0, sin(x)),
+            ir.Store(t1, t0 + 1),
+            ir.Store(t2, cos(x)),
+            ir.Store(y, t1*t2),
+            ir.Store(i, 2)]
+    f = eliminate_dead_code(ir.Procedure('f', args, body))
+    # t1 takes over t0 in the statement where t0 is last read
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, t0), Variable(Double, t2)]),
+            ir.Store(t0, sin(x)),
+            ir.Store(t0, t0 + 1),
+            ir.Store(t2, cos(x)),
+            ir.Store(y, t0*t2)]
+
+
+def test_eliminate_dead_code_loops():
+    args = (InArgument(Double, A), InArgument(Double, x),
+            OutArgument(Double, y))
+    body = [ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, s), Variable(Double, t)]),
+            ir.Store(s, 0),
+            # s is read by the next iteration
+            ir.Loop(i, 0, 10, 1, [ir.Store(t, x*i), ir.Store(s, s + i)]),
+            ir.Loop(i, 0, 10, 1, [ir.Store(t, x*i)]),
+            ir.Loop(i, 0, 10, 1, [ir.Store(t, x*i), ir.Store(A[i], x)],
+                    True, [t]),
+            ir.Store(y, s)]
+    f = eliminate_dead_code(ir.Procedure('f', args, body))
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, s)]),
+            ir.Store(s, 0),
+            ir.Loop(i, 0, 10, 1, [ir.Store(s, s + i)]),
+            ir.Loop(i, 0, 10, 1, [ir.Store(A[i], x)], True, []),
+            ir.Store(y, s)]
+
+
+def test_eliminate_dead_code_SinCos():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    body = [ir.Declare(Double, [Variable(Double, s), Variable(Double, t),
+                                Variable(Double, t0), Variable(Double, t1)]),
+            ir.SinCos(x, s, t),
+            ir.SinCos(2*x, t0, t1),
+            ir.Store(y, t1)]
+    f = eliminate_dead_code(ir.Procedure('f', args, body), reuse_temps=False)
+    # Both results of a SinCos are kept if either is used
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, t0), Variable(Double, t1)]),
+            ir.SinCos(2*x, t0, t1),
+            ir.Store(y, t1)]
+
+
+def test_eliminate_dead_code_If():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    body = [ir.Declare(Double, [Variable(Double, t0), Variable(Double, t1),
+                                Variable(Double, t2)]),
+            # Only read by the condition and a case
+            ir.Store(t0, sin(x)),
+            ir.Store(t1, cos(x)),
+            ir.Store(t2, x**2),
+            ir.If([(t0 > 0, [ir.Store(t2, x), ir.Store(y, t1)]),
+                   (True, [ir.Store(y, t2)])])]
+    f = eliminate_dead_code(ir.Procedure('f', args, body), reuse_temps=False)
+    assert f.body == body
+    # t2 isn't read after the case overwriting it, and without a default
+    # case y may keep its value
+    body = [ir.Declare(Double, [Variable(Double, t0), Variable(Double, t1)]),
+            ir.Store(t0, sin(x)),
+            ir.Store(t1, cos(x)),
+            ir.If([(t0 > 0, [ir.Store(t1, x), ir.Store(y, t0)]),
+                   (t0 < -1, [ir.Store(t1, x)])])]
+    f = eliminate_dead_code(ir.Procedure('f', args, body), reuse_temps=False)
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, t0)]),
+            ir.Store(t0, sin(x)),
+            ir.If([(t0 > 0, [ir.Store(y, t0)]), (t0 < -1, [])])]
+    # Conditionals left empty are removed
+    body = [ir.If([(x > 0, [ir.Store(t, x)]), (True, [ir.Store(t, -x)])]),
+            ir.Store(y, x)]
+    f = eliminate_dead_code(ir.Procedure('f', args, body))
+    assert f.body == [ir.Store(y, x)]
+
+
+def test_eliminate_dead_code_Call():
+    X, Y = MatrixSymbol('X', 2, 2), MatrixSymbol('Y', 2, 2)
+    args = (InArgument(Double, X), OutArgument(Double, Y))
+    body = [ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, x), Variable(Double, t)]),
+            ir.Store(x, 2),
+            ir.Store(t, 3),
+            ir.Call('dgemm', ('N', 'N', 2, 2, 2, x, X, 2, X, 2, 0, Y, 2))]
+    f = eliminate_dead_code(ir.Procedure('f', args, body))
+    # Calls are kept, and the variables passed to them are live
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, x)]),
+            ir.Store(x, 2),
+            ir.Call('dgemm', ('N', 'N', 2, 2, 2, x, X, 2, X, 2, 0, Y, 2))]
+
+
+def test_eliminate_dead_code_Clear():
+    X, Y = MatrixSymbol('X', 2, 2), MatrixSymbol('Y', 2, 2)
+    args = (InArgument(Double, x), OutArgument(Double, Y))
+    body = [ir.Declare(Double, [Variable(Double, X)]),
+            ir.Clear(X),
+            ir.Store(X[0, 0], x),
+            ir.Store(Y[0, 0], x),
+            ir.Clear(Y),
+            ir.Store(Y[1, 1], x)]
+    f = eliminate_dead_code(ir.Procedure('f', args, body))
+    # Clearing overwrites the whole array
+    assert f.body == [ir.Clear(Y), ir.Store(Y[1, 1], x)]
+
+
+def test_eliminate_dead_code_FunctionDef():
+    args = [InArgument(Double, x), OutArgument(Double, y)]
+    f = FunctionDef('f', args, [Declare(Double, [Variable(Double, t)]),
+                                Assign(t, x + 1), Assign(y, x)], [])
+    assert eliminate_dead_code(f) == FunctionDef('f', args,
+                                                 [Assign(y, x)], [])
@@ -0,0 +1,64 @@
+from sympy import symbols, sin, cos, exp, Matrix, ImmutableMatrix, MatrixSymbol
+from sympy.utilities.pytest import raises
+
+from symcc.types.ast import Assign, InArgument, OutArgument, Double
+from symcc.types.routines import routine, RoutineInplace
+from symcc.transforms.derivatives import jacobian_routine
+
+a, b, c, y = symbols('a, b, c, y')
+n = symbols('n', integer=True)
+x = MatrixSymbol('x', 2, 1)
+F = MatrixSymbol('F', 2, 1)
+
+
+def test_jacobian_routine_gradient():
+    r = routine('f', (a, b, y), (sin(a*b), Assign(y, a**2)))
+    j = jacobian_routine(r, (a, r.arguments[1]))
+    grad, y_grad = MatrixSymbol('grad', 2, 1), MatrixSymbol('y_grad', 2, 1)
+    assert j.name == symbols('f_jac')
+    assert j.arguments == r.arguments + (OutArgument(Double, grad),
+                                         OutArgument(Double, y_grad))
+    # The derivatives come first, to be stored before the values
+    assert j.results == (
+            RoutineInplace(OutArgument(Double, grad),
+                           ImmutableMatrix([b*cos(a*b), a*cos(a*b)])),
+            RoutineInplace(OutArgument(Double, y_grad),
+                           ImmutableMatrix([2*a, 0]))) + r.results
+    # Several returns are numbered
+    r = routine('f', (a, b), (sin(a), a*b))
+    j = jacobian_routine(r, (a,), name='g', values=False)
+    assert j.name == symbols('g')
+    assert [str(arg.name) for arg in j.arguments] == ['a', 'b', 'grad0',
+                                                      'grad1']
+    assert [res.expr for res in j.results] == [ImmutableMatrix([cos(a)]),
+                                               ImmutableMatrix([b])]
+
+
+def test_jacobian_routine_jacobian():
+    r = routine('f', (x, c, F), Assign(F, Matrix([exp(x[0, 0]*x[1, 0]),
+                                                  c*x[1, 0]])))
+    j = jacobian_routine(r, (x, c), values=False)
+    F_jac = MatrixSymbol('F_jac', 2, 3)
+    assert j.arguments == (InArgument(Double, x), InArgument(Double, c),
+                           OutArgument(Double, F_jac))
+    assert len(j.results) == 1
+    assert j.results[0].argument == OutArgument(Double, F_jac)
+    # Products of matrix elements aren't canonical, so they're replaced
+    u, v = symbols('u, v')
+    assert j.results[0].expr.xreplace({x[0, 0]: u, x[1, 0]: v}) == Matrix([
+            [v*exp(u*v), u*exp(u*v), 0],
+            [0, c, v]])
+
+
+def test_jacobian_routine_errors():
+    r = routine('f', (a, n, y), (a*n, Assign(y, a)))
+    raises(ValueError, lambda: jacobian_routine(r, (b,)))
+    raises(ValueError, lambda: jacobian_routine(r, (y,)))
+    raises(ValueError, lambda: jacobian_routine(r, (n,)))
+    raises(ValueError, lambda: jacobian_routine(r, ()))
+    A = MatrixSymbol('A', 2, 2)
+    r = routine('f', (a, A), Assign(A, Matrix([[a, 0], [0, a]])))
+    raises(ValueError, lambda: jacobian_routine(r, (a,)))
+    grad = MatrixSymbol('grad', 1, 1)
+    r = routine('f', (a, grad), (a, Assign(grad, Matrix([a]))))
+    raises(ValueError, lambda: jacobian_routine(r, (a,)))
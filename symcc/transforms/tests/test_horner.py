@@ -0,0 +1,36 @@
+from sympy import symbols, sin, Float, Matrix, expand
+
+from symcc.types.ast import Assign
+from symcc.types.routines import routine
+from symcc.transforms.horner import horner_form, rewrite_horner
+
+x, y, out = symbols('x, y, out')
+
+
+def test_horner_form():
+    assert horner_form(3*x**3 + 2*x**2 + x + 5) == x*(x*(3*x + 2) + 1) + 5
+    # Gaps in the powers are kept as powers
+    assert horner_form(x**6 + x**2) == x**2*(x**4 + 1)
+    # Multivariate polynomials are factored in the variable of highest
+    # degree first
+    p = x**2*y**3 + 3*x*y**2 + y + 1
+    assert horner_form(p) == y*(y*(x**2*y + 3*x) + 1) + 1
+    assert expand(horner_form(p)) == p
+    # Polynomials nested inside other expressions, and in terms of other
+    # expressions
+    assert horner_form(sin(x**2 + x)) == sin(x*(x + 1))
+    assert horner_form(sin(x)**2 + sin(x)) == sin(x)*(sin(x) + 1)
+    assert horner_form(Matrix([x**2 + x, y])) == Matrix([x*(x + 1), y])
+    # Floats are kept exactly
+    c = Float('0.1', 30)
+    assert horner_form(c*x**2 + x) == x*(c*x + 1)
+    # Linear expressions are unchanged
+    assert horner_form(x + y + 1) == x + y + 1
+
+
+def test_rewrite_horner():
+    r = routine('test', (x, y, out), (x**2 + x, Assign(out, y**3 + 2*y)))
+    h = rewrite_horner(r)
+    assert h.arguments == r.arguments
+    assert h.returns[0].expr == x*(x + 1)
+    assert h.inplace[0].expr == y*(y**2 + 2)
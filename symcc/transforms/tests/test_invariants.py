@@ -0,0 +1,48 @@
+from sympy import symbols, sin, cos, IndexedBase, Idx
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double, Int
+from symcc.transforms.invariants import flatten_indexed, hoist_invariants
+
+a, b, inv0, inv1, inv2 = symbols('a, b, inv0, inv1, inv2')
+m, n = symbols('m, n', integer=True)
+A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+i, j = Idx('i', m), Idx('j', n)
+
+
+def test_flatten_indexed():
+    assert flatten_indexed(A[i, j]*x[j]) == \
+            IndexedBase(A.label, shape=(m*n,))[n*i + j]*x[j]
+    assert flatten_indexed(sin(x[i])) == sin(x[i])
+    # Unknown shapes are kept
+    k = symbols('k', integer=True)
+    assert flatten_indexed(A[k, k]) == A[k, k]
+
+
+def test_hoist_invariants():
+    args = (InArgument(Double, A), InArgument(Double, x),
+            OutArgument(Double, y), InArgument(Int, m), InArgument(Int, n),
+            InArgument(Double, a), InArgument(Double, b))
+    inner = ir.Loop(j.label, 0, n, 1,
+                    [ir.Store(y[i], sin(a*b)*A[i, j]*x[j] - a, '+')])
+    outer = ir.Loop(i.label, 0, m, 1,
+                    [ir.Store(y[i], cos(a)*x[i] + b), inner], True, [j.label])
+    f = ir.Procedure('f', args, [ir.Declare(Int, [Variable(Int, i.label),
+                                                  Variable(Int, j.label)]),
+                                 outer])
+    f = hoist_invariants(f, flatten=True)
+    flat = IndexedBase(A.label, shape=(m*n,))
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i.label), Variable(Int, j.label),
+                             Variable(Int, inv0)]),
+            ir.Declare(Double, [Variable(Double, inv1),
+                                Variable(Double, inv2)]),
+            # Moved out of both loops
+            ir.Store(inv1, sin(a*b)),
+            ir.Store(inv2, cos(a)),
+            ir.Loop(i.label, 0, m, 1, [
+                ir.Store(y[i], inv2*x[i] + b),
+                ir.Store(inv0, n*i),
+                ir.Loop(j.label, 0, n, 1,
+                        [ir.Store(y[i], inv1*flat[inv0 + j]*x[j] - a, '+')])],
+                True, [j.label, inv0])]
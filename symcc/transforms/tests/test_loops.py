@@ -0,0 +1,60 @@
+from sympy import symbols, Mod, Min, IndexedBase
+from sympy.sets.fancysets import Range
+from sympy.utilities.pytest import raises
+
+from symcc.types.ast import Assign, AugAssign, For, ParallelFor, loop_range
+from symcc.transforms.loops import tile_loops, unroll_loop
+
+s, t = symbols('s, t')
+i, j, k, n = symbols('i, j, k, n', integer=True)
+i_tile, j_tile = symbols('i_tile, j_tile', integer=True)
+A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+
+
+def test_tile_loops():
+    body = [AugAssign(y[i], '+', A[i, j]*x[j])]
+    loop = For(i, Range(0, 64), [For(j, loop_range(0, n), body)])
+    assert tile_loops(loop, [32, 16]) == \
+            For(i_tile, Range(0, 64, 32), [
+                For(j_tile, loop_range(0, n, 16), [
+                    For(i, loop_range(i_tile, i_tile + 32), [
+                        For(j, loop_range(j_tile, Min(j_tile + 16, n)),
+                            body)])])])
+    # Only the outer loop
+    assert tile_loops(loop, [8], [k]) == \
+            For(k, Range(0, 64, 8), [For(i, loop_range(k, k + 8),
+                                         loop.body)])
+    # Parallel loops stay parallel, with the inner targets private
+    ploop = ParallelFor(i, Range(0, 64), [For(j, loop_range(0, n), body)])
+    tiled = tile_loops(ploop, [32, 32])
+    assert isinstance(tiled, ParallelFor)
+    assert tiled.private == (j, j_tile, i)
+    # The nest isn't perfect
+    raises(ValueError, lambda: tile_loops(For(i, Range(0, 8), body), [4, 4]))
+    raises(ValueError, lambda: tile_loops(loop, [0]))
+
+
+def test_unroll_loop():
+    loop = For(i, Range(0, 10), [AugAssign(s, '+', x[i])])
+    assert unroll_loop(loop) == [
+            For(i, Range(0, 8, 4), [AugAssign(s, '+', x[i]),
+                                    AugAssign(s, '+', x[i + 1]),
+                                    AugAssign(s, '+', x[i + 2]),
+                                    AugAssign(s, '+', x[i + 3])]),
+            AugAssign(s, '+', x[8]),
+            AugAssign(s, '+', x[9])]
+    # Small ranges are fully unrolled
+    assert unroll_loop(For(i, Range(1, 7, 2), [Assign(y[i], x[i])])) == [
+            Assign(y[1], x[1]), Assign(y[3], x[3]), Assign(y[5], x[5])]
+    # Bounds of inner loops are substituted too
+    inner = For(j, loop_range(0, i), [AugAssign(y[i], '+', A[i, j])])
+    assert unroll_loop(For(i, Range(1, 3), [inner])) == [
+            For(j, Range(0, 1), [AugAssign(y[1], '+', A[1, j])]),
+            For(j, Range(0, 2), [AugAssign(y[2], '+', A[2, j])])]
+    # Symbolic ranges have a remainder loop
+    end = n - Mod(n - 1, 2, evaluate=False)
+    assert unroll_loop(For(i, loop_range(1, n), [Assign(t, x[i])]), 2) == [
+            For(i, loop_range(1, end, 2), [Assign(t, x[i]),
+                                           Assign(t, x[i + 1])]),
+            For(i, loop_range(end, n), [Assign(t, x[i])])]
+    raises(ValueError, lambda: unroll_loop(loop, 0))
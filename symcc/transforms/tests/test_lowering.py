@@ -0,0 +1,128 @@
+from sympy import symbols, sin, cos, IndexedBase, Idx
+from sympy.utilities.pytest import raises
+
+from symcc.types.ast import (Assign, AugAssign, Declare, For, ParallelFor,
+        FunctionDef, Result, Return, Variable, Double, Int, loop_range)
+from symcc.types import ir
+from symcc.types.routines import routine
+from symcc.transforms.lowering import (lower_routine, lower_routine_ir,
+        declare, to_ir, from_ir)
+
+a, b, out = symbols('a, b, out')
+n, m = symbols('n, m', integer=True)
+tmp0 = symbols('tmp0')
+
+
+def test_declare():
+    va, vb = Variable(Double, a), Variable(Double, b)
+    vn = Variable(Int, n)
+    assert declare([va, vn, vb]) == [Declare(Double, (va, vb)),
+                                     Declare(Int, (vn,))]
+    assert declare([]) == []
+
+
+def test_lower_routine():
+    r = routine('test', (a, b, out),
+            (sin(a)*cos(b) + 1, Assign(out, 2*sin(a)*cos(b))))
+    f = lower_routine(r)
+    body = (Declare(Double, Variable(Double, tmp0)),
+            Assign(tmp0, sin(a)*cos(b)),
+            Assign(out, 2*tmp0),
+            Return(tmp0 + 1))
+    assert f == FunctionDef('test', r.arguments, body, (Result(Double),))
+    f = lower_routine(r, cse=False)
+    body = (Assign(out, 2*sin(a)*cos(b)), Return(sin(a)*cos(b) + 1))
+    assert f == FunctionDef('test', r.arguments, body, (Result(Double),))
+
+
+def test_lower_routine_Indexed():
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', m), Idx('j', n)
+    r = routine('test', (A, x, y, m, n, a), Assign(y[i], A[i, j]*x[j] + a))
+    f = lower_routine(r)
+    A, x, y = r.arguments[0].name, r.arguments[1].name, r.arguments[2].name
+    inner = For(j.label, loop_range(0, n), (AugAssign(y[i], '+', A[i, j]*x[j]),))
+    loop = For(i.label, loop_range(0, m), (Assign(y[i], a), inner))
+    body = (Declare(Int, (Variable(Int, i.label), Variable(Int, j.label))),
+            loop)
+    assert f == FunctionDef('test', r.arguments, body, ())
+    f = lower_routine(r, parallel=True)
+    loop = ParallelFor(i.label, loop_range(0, m), (Assign(y[i], a), inner))
+    assert loop.private == (j.label,)
+    assert f.body[1] == loop
+    # Indices on the rhs must be on the lhs, or be summed over
+    r = routine('test', (x, y, m, n), Assign(y[i], x[j]))
+    raises(ValueError, lambda: lower_routine(r))
+    # Indices without bounds can't be looped over
+    k, u, v = Idx('k'), IndexedBase('u'), IndexedBase('v')
+    r = routine('test', (u, v), Assign(v[k], 2*u[k]))
+    raises(ValueError, lambda: lower_routine(r))
+    # Indices of the lhs repeated in a product are elementwise
+    r = routine('test', (u, v, m), Assign(v[i], u[i] + u[i]*u[i]))
+    f = lower_routine(r)
+    u, v = r.arguments[0].name, r.arguments[1].name
+    assert f.body[1] == For(i.label, loop_range(0, m),
+                            (Assign(v[i], u[i]**2 + u[i]),))
+    # Constant indices aren't supported
+    A, B, C = IndexedBase('A'), IndexedBase('B'), IndexedBase('C')
+    r = routine('test', (A, B, C, m, n), Assign(C[i, j], A[i, 0]*B[0, j]))
+    raises(ValueError, lambda: lower_routine(r))
+
+
+def test_lower_routine_ir():
+    r = routine('test', (a, b, out),
+            (sin(a)*cos(b) + 1, Assign(out, 2*sin(a)*cos(b))))
+    f = lower_routine_ir(r)
+    body = [ir.Declare(Double, [Variable(Double, tmp0)]),
+            ir.Store(tmp0, sin(a)*cos(b)),
+            ir.Store(out, 2*tmp0),
+            ir.Return(tmp0 + 1)]
+    assert f == ir.Procedure(r.name, r.arguments, body, [Double])
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', m), Idx('j', n)
+    r = routine('test', (A, x, y, m, n), Assign(y[i], A[i, j]*x[j]))
+    f = lower_routine_ir(r, parallel=True)
+    A, x, y = r.arguments[0].name, r.arguments[1].name, r.arguments[2].name
+    inner = ir.Loop(j.label, 0, n, 1, [ir.Store(y[i], A[i, j]*x[j], '+')])
+    loop = ir.Loop(i.label, 0, m, 1, [ir.Store(y[i], 0), inner], True,
+                   private=(j.label,))
+    assert f.body[1:] == [loop]
+
+
+def test_lower_routine_ir_scalar_contraction():
+    x, y, A = IndexedBase('x'), IndexedBase('y'), IndexedBase('A')
+    k = Idx('k', m)
+    # A dot product is accumulated into a temporary, and returned
+    r = routine('dot', (x, y, m), x[k]*y[k])
+    f = lower_routine_ir(r)
+    x, y = r.arguments[0].name, r.arguments[1].name
+    acc0 = symbols('acc0')
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, acc0)]),
+            ir.Declare(Int, [Variable(Int, k.label)]),
+            ir.Store(acc0, 0),
+            ir.Loop(k.label, 0, m, 1, [ir.Store(acc0, x[k]*y[k], '+')]),
+            ir.Return(acc0)]
+    # A trace is accumulated into its argument
+    r = routine('trace', (A, m, a, out), Assign(out, A[k, k] + a))
+    f = lower_routine_ir(r)
+    A = r.arguments[0].name
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, k.label)]),
+            ir.Store(out, a),
+            ir.Loop(k.label, 0, m, 1, [ir.Store(out, A[k, k], '+')])]
+    # Indices which aren't summed over have nowhere to go
+    r = routine('test', (x, m, out), Assign(out, x[k]))
+    raises(ValueError, lambda: lower_routine_ir(r))
+
+
+def test_to_ir_from_ir():
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', m), Idx('j', n)
+    r = routine('test', (A, x, y, m, n, a, out),
+            (Assign(y[i], A[i, j]*x[j] + a), Assign(out, sin(a)), cos(a)))
+    for parallel in (False, True):
+        f = lower_routine(r, parallel=parallel)
+        assert to_ir(f) == lower_routine_ir(r, parallel=parallel)
+        assert from_ir(to_ir(f)) == f
+    raises(NotImplementedError, lambda: to_ir(For(a, (1, 2), [])))
@@ -0,0 +1,52 @@
+from sympy import symbols, sin, exp, Piecewise, Min, Max, Abs
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double, Int
+from symcc.transforms.piecewise import lower_piecewise
+
+x, y, z, pw0, pw1, pw2 = symbols('x, y, z, pw0:3')
+i, n = symbols('i, n', integer=True)
+
+
+def test_lower_piecewise():
+    args = (InArgument(Double, x), InArgument(Double, y),
+            OutArgument(Double, z))
+    body = [ir.Store(z, Piecewise((x, x < y), (y, True)) +
+                        Piecewise((y, x < y), (x, True))),
+            ir.Store(z, Piecewise((x, x > 0), (-x, True)), '+'),
+            # Cheap pieces are computed, and selected
+            ir.Store(z, Piecewise((2*x, x > 0), (y, True)), '*'),
+            # Expensive ones are computed only if selected
+            ir.Store(z, Piecewise((exp(sin(x) + y), x > 0), (0, True)))]
+    f = lower_piecewise(ir.Procedure('f', args, body), 2)
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, pw0)]),
+            ir.Store(z, Min(x, y) + Max(x, y)),
+            ir.Store(z, Abs(x), '+'),
+            ir.Store(pw0, 2*x),
+            ir.Store(z, Piecewise((pw0, x > 0), (y, True)), '*'),
+            ir.If([(x > 0, [ir.Store(z, exp(sin(x) + y))]),
+                   (True, [ir.Store(z, 0)])])]
+
+
+def test_lower_piecewise_nested():
+    args = (InArgument(Double, x), InArgument(Int, n))
+    inner = Piecewise((sin(x), x > 1), (exp(x), True))
+    loop = ir.Loop(i, 0, n, 1, [ir.Return(2*Piecewise((inner, x > 0),
+                                                      (-x, True)))],
+                   True)
+    f = lower_piecewise(ir.Procedure('f', args, [loop], [Double]), 2)
+    # The inner select is only computed in the branch it's in
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, s) for s in (pw0, pw1, pw2)]),
+            ir.Loop(i, 0, n, 1, [
+                ir.If([(x > 0, [ir.Store(pw1, sin(x)),
+                                ir.Store(pw2, exp(x)),
+                                ir.Store(pw0, Piecewise((pw1, x > 1),
+                                                        (pw2, True)))]),
+                       (True, [ir.Store(pw0, -x)])]),
+                ir.Return(2*pw0)], True, [pw0, pw1, pw2])]
+    # Integer values are never selects
+    body = [ir.Return(Piecewise((n - 1, n > 0), (n + 1, True)))]
+    f = lower_piecewise(ir.Procedure('f', args, body, [Int]))
+    assert isinstance(f.body[1], ir.If)
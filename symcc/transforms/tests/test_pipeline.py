@@ -0,0 +1,35 @@
+from sympy import symbols, sin, cos, exp
+
+from symcc.types.ast import Assign
+from symcc.types.routines import routine
+from symcc.transforms.lowering import lower_routine_ir
+from symcc.transforms.reciprocals import hoist_reciprocals
+from symcc.transforms.transcendentals import (rewrite_transcendentals,
+        fuse_sincos)
+from symcc.transforms.pipeline import pipeline_settings, optimize_routine
+from symcc.printers.ccode import CCodePrinter
+from symcc.printers.fcode import FCodePrinter
+
+a, b, out = symbols('a, b, out')
+
+
+def test_optimize_routine():
+    r = routine('test', (a, b, out),
+            (sin(a)/b + cos(a)/b, Assign(out, exp(a)*exp(b)/b)))
+    assert optimize_routine(r) == lower_routine_ir(r)
+    assert optimize_routine(r, {'cse': False}) == lower_routine_ir(r, False)
+    f = optimize_routine(r, {'hoist_reciprocals': True,
+                             'fuse_transcendentals': True})
+    g = lower_routine_ir(rewrite_transcendentals(r))
+    hoist_reciprocals(g)
+    fuse_sincos(g)
+    assert f == g != lower_routine_ir(r)
+
+
+def test_printer_settings():
+    for printer in (CCodePrinter, FCodePrinter):
+        settings = printer._default_settings
+        for name, value in pipeline_settings.items():
+            assert settings[name] == value
+    assert 'dereference' in CCodePrinter._default_settings
+    assert 'dereference' not in FCodePrinter._default_settings
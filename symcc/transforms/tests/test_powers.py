@@ -0,0 +1,49 @@
+from sympy import symbols, sqrt, sin, Rational
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double, Int
+from symcc.transforms.powers import pow_reduction, reduce_powers
+
+x, y, pw0, pw1, pw2 = symbols('x, y, pw0, pw1, pw2')
+i, n = symbols('i, n', integer=True)
+
+
+def test_pow_reduction():
+    assert pow_reduction(x**5, 8) == (5, False, False)
+    assert pow_reduction(x**-5, 8) == (5, False, True)
+    assert pow_reduction(x**Rational(5, 2), 8) == (2, True, False)
+    assert pow_reduction(x**Rational(-1, 2), 8) == (0, True, True)
+    assert pow_reduction(x**9, 8) is None
+    assert pow_reduction(x**Rational(1, 3), 8) is None
+    assert pow_reduction(x**y, 8) is None
+    assert pow_reduction(n**2, 8) is None
+    assert pow_reduction(x**2, 0) is None
+    assert pow_reduction(sin(x), 8) is None
+
+
+def test_reduce_powers():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    # pw0 is already used, and is skipped
+    body = [ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, pw0)]),
+            ir.Store(pw0, x**3),
+            ir.Store(y, x**7 - pw0/x**Rational(9, 2))]
+    f = reduce_powers(ir.Procedure('f', args, body), 8)
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, pw0), Variable(Double, pw1),
+                                Variable(Double, pw2)]),
+            ir.Store(pw0, x**3),
+            ir.Store(pw1, x**2),
+            ir.Store(pw2, pw1**2),
+            ir.Store(y, pw1*pw2*x - pw0/(pw2*sqrt(x)))]
+    # Temporaries inside parallel loops are private
+    body = [ir.Loop(i, 0, n, 1, [ir.Store(y, (x + i)**4, '+')], True,
+                    reductions=[('+', y)])]
+    f = reduce_powers(ir.Procedure('f', args, body), 8)
+    assert f.body[0] == ir.Declare(Double, [Variable(Double, pw0),
+                                            Variable(Double, pw1)])
+    loop = f.body[1]
+    assert loop.private == (pw0, pw1)
+    assert loop.body == [ir.Store(pw0, (x + i)**2), ir.Store(pw1, pw0**2),
+                         ir.Store(y, pw1, '+')]
@@ -0,0 +1,44 @@
+from sympy import symbols, sin
+from sympy.utilities.pytest import raises
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double
+from symcc.transforms.reassociate import split_sums
+
+x, y, z, acc0, acc1, acc2, acc3 = symbols('x, y, z, acc0:4')
+i = symbols('i', integer=True)
+a = symbols('a0:7')
+
+
+def test_split_sums():
+    args = (InArgument(Double, x), OutArgument(Double, y),
+            OutArgument(Double, z))
+    body = [ir.Store(y, sum(a) + 1),
+            ir.Store(z, sin(x) + x),
+            ir.Store(z, a[0]*a[1]*a[2]*x, '*')]
+    f = split_sums(ir.Procedure('f', args, body), 3, 2)
+    terms = (sum(a) + 1).args
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, s) for s in
+                                (acc0, acc1, acc2, acc3)]),
+            ir.Store(acc0, sum(terms[0:3])),
+            ir.Store(acc1, sum(terms[3:6])),
+            ir.Store(acc0, sum(terms[6:8]), '+'),
+            ir.Store(y, acc0 + acc1),
+            # Short enough
+            ir.Store(z, sin(x) + x),
+            ir.Store(acc2, a[0]*a[1]*a[2]),
+            ir.Store(acc3, x),
+            ir.Store(z, acc2*acc3, '*')]
+    raises(ValueError, lambda: split_sums(f, 1))
+
+
+def test_split_sums_parallel():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    loop = ir.Loop(i, 0, 10, 1, [ir.Store(y, i*x + x**2 + x + i, '+')],
+                   True, [], [], [('+', y)])
+    f = split_sums(ir.Procedure('f', args, [loop]), 2)
+    assert f.body[0] == ir.Declare(Double, [Variable(Double, acc0),
+                                            Variable(Double, acc1)])
+    assert f.body[1].private == (acc0, acc1)
+    assert len(f.body[1].body) == 3
@@ -0,0 +1,44 @@
+from sympy import symbols, sin
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double, Int
+from symcc.transforms.reciprocals import hoist_reciprocals
+
+x, y, z, d, rcp0, rcp1 = symbols('x, y, z, d, rcp0, rcp1')
+i = symbols('i', integer=True)
+
+
+def test_hoist_reciprocals():
+    args = (InArgument(Double, x), InArgument(Double, d),
+            OutArgument(Double, y), OutArgument(Double, z))
+    body = [ir.Declare(Int, [Variable(Int, i)]),
+            ir.Store(y, sin(x)/(d*x) + 2/(d*x)),
+            ir.Store(z, x/d),
+            ir.Store(x, x/d + y),
+            ir.Store(z, 1/(d*x) + 1/(d*x + 1) + 1/d),
+            ir.Return(1/(y + 1))]
+    f = hoist_reciprocals(ir.Procedure('f', args, body, [Double]))
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i)]),
+            ir.Declare(Double, [Variable(Double, rcp0),
+                                Variable(Double, rcp1)]),
+            ir.Store(rcp0, 1/(d*x)),
+            ir.Store(y, rcp0*sin(x) + 2*rcp0),
+            ir.Store(rcp1, 1/d),
+            ir.Store(z, rcp1*x),
+            ir.Store(x, rcp1*x + y),
+            # x is written, so 1/(d*x) is no longer rcp0
+            ir.Store(z, 1/(d*x) + 1/(d*x + 1) + rcp1),
+            ir.Return(1/(y + 1))]
+
+
+def test_hoist_reciprocals_parallel():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    loop = ir.Loop(i, 0, 10, 1, [ir.Store(y, i/(x + i), '+'),
+                                 ir.Store(y, 1/(x + i), '-')], True)
+    f = hoist_reciprocals(ir.Procedure('f', args, [loop]))
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, rcp0)]),
+            ir.Loop(i, 0, 10, 1, [ir.Store(rcp0, 1/(x + i)),
+                                  ir.Store(y, i*rcp0, '+'),
+                                  ir.Store(y, rcp0, '-')], True, [rcp0])]
@@ -0,0 +1,100 @@
+from sympy import symbols, Matrix, ImmutableMatrix, MatrixSymbol
+from sympy.utilities.pytest import raises
+
+from symcc.types import ir
+from symcc.types.ast import Assign, OutArgument, Variable, Int
+from symcc.types.routines import routine, RoutineInplace
+from symcc.transforms.sparse import structure_matrices, sparse_outputs
+
+x, y = symbols('x, y')
+i0, i1 = symbols('i0, i1', integer=True)
+X = MatrixSymbol('X', 4, 4)
+
+
+def _procedure(expr):
+    return ir.Procedure('f', (OutArgument(Int, X),), [ir.Store(X, expr)])
+
+
+def test_structure_matrices():
+    # Tridiagonal, stored along the diagonals
+    mat = Matrix(4, 4, lambda i, j: x if i == j else
+                                    (y if abs(i - j) == 1 else 0))
+    f = structure_matrices(_procedure(mat), min_run=3)
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i0)]),
+            ir.Clear(X),
+            ir.Loop(i0, 1, 4, 1, [ir.Store(X[i0, i0 - 1], y)]),
+            ir.Loop(i0, 0, 4, 1, [ir.Store(X[i0, i0], x)]),
+            ir.Loop(i0, 0, 3, 1, [ir.Store(X[i0, i0 + 1], y)])]
+    # Blocks, rows and columns, with the rest stored one by one
+    mat = Matrix([[x, x, 0, 0],
+                  [x, x, 0, 0],
+                  [1, 2, 3, 4],
+                  [y, y, y, 5]])
+    f = structure_matrices(_procedure(mat), min_run=3, row_major=False)
+    assert f.body == [
+            ir.Declare(Int, [Variable(Int, i0), Variable(Int, i1)]),
+            ir.Clear(X),
+            ir.Loop(i0, 0, 2, 1, [
+                ir.Loop(i1, 0, 2, 1, [ir.Store(X[i0, i1], x)])]),
+            ir.Loop(i1, 0, 3, 1, [ir.Store(X[3, i1], y)]),
+            ir.Store(X[2, 0], 1),
+            ir.Store(X[2, 1], 2),
+            ir.Store(X[2, 2], 3),
+            ir.Store(X[2, 3], 4),
+            ir.Store(X[3, 3], 5)]
+    # Without enough zeros or runs, every entry is stored
+    Y = MatrixSymbol('Y', 2, 2)
+    mat = Matrix([[x, 0], [0, y]])
+    f = structure_matrices(ir.Procedure('f', (), [ir.Store(Y, mat)]))
+    assert f.body == [ir.Store(Y[0, 0], x), ir.Store(Y[0, 1], 0),
+                      ir.Store(Y[1, 0], 0), ir.Store(Y[1, 1], y)]
+    raises(ValueError, lambda: structure_matrices(_procedure(mat), 0))
+
+
+def test_sparse_outputs():
+    mat = Matrix([[x, 0, 0], [0, 0, 0], [y, 2, 0]])
+    A = MatrixSymbol('A', 3, 3)
+    r = routine('f', (x, y, A), (x + y, Assign(A, mat)))
+    csr = sparse_outputs(r)
+    data, indices, indptr = [MatrixSymbol('A_' + s, n, 1) for (s, n) in
+                             (('data', 3), ('indices', 3), ('indptr', 4))]
+    assert csr.arguments == r.arguments[:2] + (
+            OutArgument(r.arguments[2].dtype, data),
+            OutArgument(Int, indices), OutArgument(Int, indptr))
+    assert csr.results[0] == r.results[0]
+    assert [(res.argument.name, res.expr) for res in csr.results[1:]] == [
+            (data, ImmutableMatrix([x, y, 2])),
+            (indices, ImmutableMatrix([0, 0, 1])),
+            (indptr, ImmutableMatrix([0, 1, 1, 3]))]
+    coo = sparse_outputs(r, 'coo')
+    assert [(str(res.argument.name), res.expr) for res in coo.results
+            if isinstance(res, RoutineInplace)] == [
+            ('A_data', ImmutableMatrix([x, y, 2])),
+            ('A_row', ImmutableMatrix([0, 2, 2])),
+            ('A_col', ImmutableMatrix([0, 0, 1]))]
+    raises(ValueError, lambda: sparse_outputs(r, 'csc'))
+    r = routine('f', (A,), Assign(A, Matrix.zeros(3, 3)))
+    raises(ValueError, lambda: sparse_outputs(r))
+
+
+def test_sparse_outputs_csr():
+    # Empty rows at the start, middle and end
+    mat = Matrix([[0, x, 0, 0, 3],
+                  [0, 0, 0, 0, 0],
+                  [y, 0, 0, 0, 0],
+                  [0, 0, 0, 0, 0],
+                  [1, 2, x*y, 0, 4],
+                  [0, 0, 0, 0, 0]])
+    A = MatrixSymbol('A', 6, 5)
+    csr = sparse_outputs(routine('f', (x, y, A), Assign(A, mat)))
+    data, indices, indptr = [list(res.expr) for res in csr.results]
+    assert data == [x, 3, y, 1, 2, x*y, 4]
+    assert indices == [1, 4, 0, 0, 1, 2, 4]
+    assert indptr == [0, 2, 2, 3, 3, 7, 7]
+    # Rebuilding the matrix gives it back
+    dense = Matrix.zeros(6, 5)
+    for i in range(6):
+        for k in range(indptr[i], indptr[i + 1]):
+            dense[i, indices[k]] = data[k]
+    assert dense == mat
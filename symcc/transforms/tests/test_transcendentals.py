@@ -0,0 +1,65 @@
+from sympy import symbols, sin, cos, exp, log, Matrix
+
+from symcc.types import ir
+from symcc.types.ast import InArgument, OutArgument, Variable, Double
+from symcc.transforms.transcendentals import merge_exp_log, fuse_sincos
+
+x, y, z, t, sin0, cos0, sin1 = symbols('x, y, z, t, sin0, cos0, sin1')
+a, b = symbols('a, b', positive=True)
+i = symbols('i', integer=True)
+
+
+def test_merge_exp_log():
+    assert merge_exp_log(exp(x)*exp(y)*sin(exp(x)*exp(2*y))) == \
+            exp(x + y)*sin(exp(x + 2*y))
+    assert merge_exp_log(log(a) + log(b) - log(a + 1) + x) == \
+            log(a*b/(a + 1)) + x
+    # Logarithms of expressions not known to be positive aren't merged
+    assert merge_exp_log(log(a) + log(x)) == log(a) + log(x)
+    assert merge_exp_log(Matrix([exp(x)*exp(y), 1])) == \
+            Matrix([exp(x + y), 1])
+
+
+def test_fuse_sincos():
+    args = (InArgument(Double, x), OutArgument(Double, y),
+            OutArgument(Double, z))
+    body = [ir.Declare(Double, [Variable(Double, t)]),
+            ir.Store(y, sin(x)**2 + sin(x + 1)),
+            ir.Store(t, cos(x)),
+            ir.Store(z, t*cos(x + 1))]
+    f = fuse_sincos(ir.Procedure('f', args, body))
+    # The store copying cos(x) is replaced by the fused call
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, s) for s in
+                                (t, sin0, sin1, cos0)]),
+            ir.SinCos(x, sin0, t),
+            ir.SinCos(x + 1, sin1, cos0),
+            ir.Store(y, sin0**2 + sin1),
+            ir.Store(z, t*cos0)]
+
+
+def test_fuse_sincos_dependencies():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    body = [ir.Store(y, sin(x)),
+            ir.Store(x, 2*x),
+            # x has changed, so this isn't the cosine of the same value
+            ir.Store(y, cos(x), '+'),
+            ir.Return(sin(x))]
+    f = fuse_sincos(ir.Procedure('f', args, body))
+    assert f.body == [
+            ir.Declare(Double, [Variable(Double, sin0), Variable(Double, cos0)]),
+            ir.Store(y, sin(x)),
+            ir.Store(x, 2*x),
+            ir.SinCos(x, sin0, cos0),
+            ir.Store(y, cos0, '+'),
+            ir.Return(sin0)]
+
+
+def test_fuse_sincos_loops():
+    args = (InArgument(Double, x), OutArgument(Double, y))
+    loop = ir.Loop(i, 0, 10, 1, [ir.Store(y, sin(i*x)*cos(i*x), '+')],
+                   True, [], [], [('+', y)])
+    f = fuse_sincos(ir.Procedure('f', args, [loop]))
+    assert f.body[1].body == [ir.SinCos(i*x, sin0, cos0),
+                              ir.Store(y, sin0*cos0, '+')]
+    assert f.body[1].private == (sin0, cos0)
@@ -0,0 +1,244 @@
+"""
+Fusion of calls to transcendental functions.
+
+"""
+
+from __future__ import print_function, division
+
+from sympy.core import Basic, Expr, Add, Mul, Symbol
+from sympy.core.compatibility import default_sort_key
+from sympy.functions import exp, log, sin, cos
+from sympy.matrices import MatrixBase
+
+from symcc.types import ir
+from symcc.types.ast import Double
+
+__all__ = ["merge_exp_log", "rewrite_transcendentals", "fuse_sincos"]
+
+
+def _log_term(term):
+    """Returns ``(arg, sign)`` if `term` is ``log(arg)`` or ``-log(arg)``,
+    with `arg` positive. Returns None otherwise."""
+    c, f = term.as_coeff_Mul()
+    if abs(c) == 1 and f.func is log and f.args[0].is_positive:
+        return f.args[0], c
+    return None
+
+
+def merge_exp_log(expr):
+    """Merge products of exponentials, and sums of logarithms.
+
+    ``exp(a)*exp(b)`` is rewritten as ``exp(a + b)``, which is always valid.
+    ``log(a) + log(b) - log(c)`` is rewritten as ``log(a*b/c)``, which is
+    only valid if ``a``, ``b`` and ``c`` are positive, so only logarithms of
+    expressions known to be positive from their assumptions are merged. Each
+    merge replaces a call to the function with an addition or
+    multiplication.
+
+    Note that the merged forms may overflow where the original didn't, e.g.
+    if ``a*b`` is too large for a double.
+
+    Examples
+    --------
+
+    >>> from sympy import symbols, exp, log
+    >>> x, y = symbols('x, y')
+    >>> a, b = symbols('a, b', positive=True)
+    >>> merge_exp_log(3*exp(x)*exp(2*y))
+    3*exp(x + 2*y)
+    >>> merge_exp_log(log(a) - log(b) + log(x))
+    log(x) + log(a/b)
+
+    """
+    if isinstance(expr, MatrixBase):
+        return expr.applyfunc(merge_exp_log)
+    if not isinstance(expr, Expr) or expr.is_Atom:
+        return expr
+    args = [merge_exp_log(a) for a in expr.args]
+    if expr.is_Mul:
+        exps = [f for f in args if f.func is exp]
+        if len(exps) > 1:
+            rest = [f for f in args if f.func is not exp]
+            return Mul(*rest)*exp(Add(*[f.args[0] for f in exps]))
+    elif expr.is_Add:
+        logs = [(t, _log_term(t)) for t in args]
+        if sum(1 for (t, l) in logs if l is not None) > 1:
+            num = [l[0] for (t, l) in logs if l is not None and l[1] > 0]
+            den = [l[0] for (t, l) in logs if l is not None and l[1] < 0]
+            rest = [t for (t, l) in logs if l is None]
+            return Add(*rest) + log(Mul(*num)/Mul(*den))
+    if args != list(expr.args):
+        return expr.func(*args)
+    return expr
+
+
+def rewrite_transcendentals(routine):
+    """Merge the exponentials and logarithms in the results of a `Routine`.
+
+    See `merge_exp_log` for details.
+
+    Returns
+    -------
+    Routine
+        A new routine, with the rewritten results.
+
+    """
+    results = [r.func(r.args[0], merge_exp_log(r.expr), *r.args[2:])
+               for r in routine.results]
+    return routine.func(routine.name, routine.arguments, results)
+
+
+def _stmt_expr(stmt):
+    return stmt.rhs if isinstance(stmt, ir.Store) else stmt.expr
+
+
+def _set_stmt_expr(stmt, expr):
+    if isinstance(stmt, ir.Store):
+        stmt.rhs = expr
+    else:
+        stmt.expr = expr
+
+
+def _trig_args(expr):
+    """Returns the arguments of the `sin` and `cos` calls in an expression,
+    as two sets."""
+    sins, coss = set(), set()
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if not isinstance(e, Basic) or e.is_Atom:
+            continue
+        if e.func is sin:
+            sins.add(e.args[0])
+        elif e.func is cos:
+            coss.add(e.args[0])
+        stack.extend(e.args)
+    return sins, coss
+
+
+def _copy_target(stmt, call, doubles):
+    """Returns the target of `stmt` if it only stores `call` in a double
+    precision scalar."""
+    if (isinstance(stmt, ir.Store) and stmt.op is None and
+            stmt.rhs == call and str(stmt.lhs) in doubles):
+        return stmt.lhs
+    return None
+
+
+def _fuse_body(body, sins, coss, doubles, temps, parallel=None):
+    """Fuse the sines and cosines in a list of statements, returning the new
+    list.
+
+    Temporaries are appended to `temps`, and made private to the loop
+    `parallel`, if given."""
+    # Group the statements using the sine or cosine of each argument, up to
+    # the first statement writing to a variable the argument depends on.
+    # Groups are [argument, statement indices, uses sin, uses cos].
+    groups = []
+    current = {}
+    for n, stmt in enumerate(body):
+        if isinstance(stmt, ir.Loop):
+            outer = ir.parallel_loop(stmt, parallel)
+            stmt.body = _fuse_body(stmt.body, sins, coss, doubles, temps,
+                                   outer)
+        elif isinstance(stmt, (ir.Store, ir.Return)):
+            s_args, c_args = _trig_args(_stmt_expr(stmt))
+            for arg in sorted(s_args | c_args, key=default_sort_key):
+                group = current.get(arg)
+                if group is None:
+                    group = current[arg] = [arg, [], False, False]
+                    groups.append(group)
+                group[1].append(n)
+                group[2] |= arg in s_args
+                group[3] |= arg in c_args
+        written = ir.written(stmt)
+        if written:
+            for arg in list(current):
+                if written.intersection(str(s) for s in arg.free_symbols):
+                    del current[arg]
+    hoisted = {}
+    replace = {}
+    dropped = set()
+    for arg, stmts, has_sin, has_cos in groups:
+        if not (has_sin and has_cos):
+            continue
+        start = stmts[0]
+        targets = []
+        for call, symbols in ((sin(arg), sins), (cos(arg), coss)):
+            # A statement copying the call into a variable not used since
+            # the start of the group is replaced by the fused call
+            target = None
+            for n in stmts:
+                t = _copy_target(body[n], call, doubles)
+                if (t is not None and n not in dropped and not any(
+                        str(t) in ir.names(body[m]) for m in range(start, n))):
+                    target = t
+                    dropped.add(n)
+                    break
+            if target is None:
+                target = next(symbols)
+                temps.append(target)
+                if parallel is not None:
+                    parallel.private += (target,)
+            targets.append(target)
+        hoisted.setdefault(start, []).append((arg, targets))
+        for n in stmts:
+            mapping = replace.setdefault(n, {})
+            mapping[sin(arg)] = targets[0]
+            mapping[cos(arg)] = targets[1]
+    out = []
+    for n, stmt in enumerate(body):
+        # Arguments may contain other fused calls, which are computed first
+        calls = sorted(hoisted.get(n, ()), key=lambda c: c[0].count_ops())
+        for arg, (s, c) in calls:
+            out.append(ir.SinCos(arg.xreplace(replace[n]), s, c))
+        if n in dropped:
+            continue
+        if n in replace:
+            _set_stmt_expr(stmt, _stmt_expr(stmt).xreplace(replace[n]))
+        out.append(stmt)
+    return out
+
+
+def fuse_sincos(procedure, prefix=('sin', 'cos')):
+    """Compute the sine and cosine of the same argument in a `Procedure`
+    together, with a single `SinCos` statement.
+
+    Within each block of statements (the function body, or the body of a
+    loop), each argument with both its sine and cosine computed is passed to
+    a `SinCos` before its first use, and the calls are replaced by the
+    results. Uses after a statement writing to a variable the argument
+    depends on are fused separately. A statement only storing the sine or
+    cosine in a double precision scalar is replaced by the `SinCos`, if
+    possible.
+
+    This should be the last pass run on the procedure, as the others don't
+    know about `SinCos` statements.
+
+    Parameters
+    ----------
+    procedure : Procedure
+        The function to transform. It's modified in place.
+    prefix : tuple of str, optional
+        The prefixes of the names of the temporaries for the sines and the
+        cosines. Names already used in the procedure are skipped.
+
+    Returns
+    -------
+    Procedure
+        The same `procedure`. The temporaries are declared at the top of
+        the body, and are private to any enclosing parallel loop.
+
+    """
+    sins = ir.new_symbols(procedure, prefix[0])
+    coss = ir.new_symbols(procedure, prefix[1])
+    # Scalars the results can be stored in directly
+    doubles = set(str(a.name) for a in procedure.arguments
+                  if a.dtype is Double and isinstance(a.name, Symbol))
+    for stmt in procedure.body:
+        if isinstance(stmt, ir.Declare) and stmt.dtype is Double:
+            doubles.update(str(v.name) for v in stmt.variables)
+    temps = []
+    procedure.body = _fuse_body(procedure.body, sins, coss, doubles, temps)
+    ir.declare_temps(procedure, Double, temps)
+    return procedure
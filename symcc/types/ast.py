@@ -9,8 +9,24 @@ AST Type Tree
 -------------
 
 *Basic*
-     |--->Assign
-     |--->AugAssign
+     |--->Interned
+     |           |--->Assign
+     |           |--->AugAssign
+     |           |--->For
+     |           |           |--->ParallelFor
+     |           |--->Variable
+     |           |           |--->Argument
+     |           |           |           |
+     |           |           |           |--->InArgument
+     |           |           |           |--->OutArgument
+     |           |           |           |--->InOutArgument
+     |           |           |--->Result
+     |           |
+     |           |--->FunctionDef
+     |           |--->Import
+     |           |--->Declare
+     |           |--->Return
+     |
      |--->NativeOp
      |           |--------------|
      |                          |--->AddOp
@@ -26,37 +42,70 @@ AST Type Tree
      |                    |--->NativeFloat
      |                    |--->NativeDouble
      |                    |--->NativeVoid
-     |
-     |--->For
-     |--->Variable
-     |           |--->Argument
-     |           |           |
-     |           |           |--->InArgument
-     |           |           |--->OutArgument
-     |           |           |--->InOutArgument
-     |           |--->Result
-     |
-     |--->FunctionDef
-     |--->Import
-     |--->Declare
-     |--->Return
 """
 
 from __future__ import print_function, division
 
+from weakref import WeakValueDictionary
 
 from sympy.core import Symbol, Tuple
 from sympy.core.singleton import Singleton
 from sympy.core.basic import Basic
 from sympy.core.sympify import _sympify
 from sympy.core.compatibility import with_metaclass
-from sympy.tensor import Indexed
+from sympy.sets.fancysets import Range
+from sympy.tensor import Indexed, IndexedBase
 from sympy.matrices import ImmutableDenseMatrix
 from sympy.matrices.expressions.matexpr import MatrixSymbol, MatrixElement
 from sympy.utilities.iterables import iterable
 
 
-class Assign(Basic):
+# Table of all live interned nodes, keyed by ``(cls,) + args``. Values are
+# held weakly, so nodes are removed once no longer referenced elsewhere.
+_intern_table = WeakValueDictionary()
+
+
+class Interned(Basic):
+    """Base class for AST nodes that are hash-consed.
+
+    Constructing a node equal to one that already exists returns the existing
+    instance, so structurally equal nodes are always identical. As the
+    children of a node are also interned (and sympy caches the hash of every
+    `Basic`), the hash of a node is computed once, and comparing two nodes of
+    the same type is O(1) instead of a walk over both trees.
+
+    Subclasses should validate and canonicalize their arguments in `__new__`,
+    and then call `Interned.__new__` in place of `Basic.__new__`.
+
+    """
+
+    def __new__(cls, *args):
+        key = (cls,) + args
+        try:
+            return _intern_table[key]
+        except KeyError:
+            pass
+        obj = Basic.__new__(cls, *args)
+        _intern_table[key] = obj
+        return obj
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        # Equal nodes of the same type are the same instance. Nodes created
+        # without going through the table still compare by structure, but
+        # can be ruled out by their (cached) hashes first.
+        if type(self) is type(other) and hash(self) != hash(other):
+            return False
+        return Basic.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = Basic.__hash__
+
+
+class Assign(Interned):
     """Represents variable assignment for code generation.
 
     Parameters
@@ -102,8 +151,8 @@ class Assign(Basic):
         # Indexed types implement shape, but don't define it until later. This
         # causes issues in assignment validation. For now, matrices are defined
         # as anything with a shape that is not an Indexed
-        lhs_is_mat = hasattr(lhs, 'shape') and not isinstance(lhs, Indexed)
-        rhs_is_mat = hasattr(rhs, 'shape') and not isinstance(rhs, Indexed)
+        lhs_is_mat = not isinstance(lhs, Indexed) and hasattr(lhs, 'shape')
+        rhs_is_mat = not isinstance(rhs, Indexed) and hasattr(rhs, 'shape')
         # If lhs and rhs have same structure, then this assignment is ok
         if lhs_is_mat:
             if not rhs_is_mat:
@@ -112,7 +161,7 @@ class Assign(Basic):
                 raise ValueError("Dimensions of lhs and rhs don't align.")
         elif rhs_is_mat and not lhs_is_mat:
             raise ValueError("Cannot assign a matrix to a scalar.")
-        return Basic.__new__(cls, lhs, rhs)
+        return Interned.__new__(cls, lhs, rhs)
 
     def _sympystr(self, printer):
         sstr = printer.doprint
@@ -172,7 +221,7 @@ def operator(op):
     return op_registry[op]
 
 
-class AugAssign(Basic):
+class AugAssign(Interned):
     """Represents augmented variable assignment for code generation.
 
     Parameters
@@ -213,8 +262,8 @@ class AugAssign(Basic):
         # Indexed types implement shape, but don't define it until later. This
         # causes issues in assignment validation. For now, matrices are defined
         # as anything with a shape that is not an Indexed
-        lhs_is_mat = hasattr(lhs, 'shape') and not isinstance(lhs, Indexed)
-        rhs_is_mat = hasattr(rhs, 'shape') and not isinstance(rhs, Indexed)
+        lhs_is_mat = not isinstance(lhs, Indexed) and hasattr(lhs, 'shape')
+        rhs_is_mat = not isinstance(rhs, Indexed) and hasattr(rhs, 'shape')
         # If lhs and rhs have same structure, then this assignment is ok
         if lhs_is_mat:
             if not rhs_is_mat:
@@ -227,7 +276,7 @@ class AugAssign(Basic):
             op = operator(op)
         elif op not in op_registry.values():
             raise TypeError("Unrecognized Operator")
-        return Basic.__new__(cls, lhs, op, rhs)
+        return Interned.__new__(cls, lhs, op, rhs)
 
     def _sympystr(self, printer):
         sstr = printer.doprint
@@ -247,7 +296,7 @@ class AugAssign(Basic):
         return self._args[2]
 
 
-class For(Basic):
+class For(Interned):
     """Represents a 'for-loop' in the code.
 
     Expressions are of the form:
@@ -269,7 +318,7 @@ class For(Basic):
         if not iterable(body):
             raise TypeError("body must be an iterable")
         body = Tuple(*(_sympify(i) for i in body))
-        return Basic.__new__(cls, target, iter, body)
+        return Interned.__new__(cls, target, iter, body)
 
     @property
     def target(self):
@@ -284,6 +333,117 @@ class For(Basic):
         return self._args[2]
 
 
+class ParallelFor(For):
+    """Represents a 'for-loop' whose iterations may be run in parallel.
+
+    This is printed as an OpenMP parallel loop. The data-sharing clauses are
+    inferred from the loop body if not provided: targets of inner loops and
+    scalars assigned to in the body are private, and scalars only updated
+    with `AugAssign` are reductions.
+
+    Parameters
+    ----------
+    target : symbol
+    iter : iterable
+    body : sympy expr
+    private : iterable, optional
+        Symbols that are private to each iteration.
+    shared : iterable, optional
+        Symbols that are explicitly shared between all iterations.
+    reductions : iterable, optional
+        Pairs of ``(op, symbol)``, where ``op`` is one of ``'+', '-', '*'``.
+        Each thread accumulates into a private copy of ``symbol``, which are
+        then combined with ``op`` after the loop.
+    """
+
+    def __new__(cls, target, iter, body, private=None, shared=(),
+                reductions=None):
+        loop = For(target, iter, body)
+        inferred_private, inferred_reductions = _loop_clauses(loop)
+        if private is None:
+            private = inferred_private
+        if reductions is None:
+            reductions = inferred_reductions
+        if not iterable(private) or not iterable(shared):
+            raise TypeError("private and shared must be iterables")
+        private = Tuple(*(_sympify(i) for i in private))
+        shared = Tuple(*(_sympify(i) for i in shared))
+        reductions = Tuple(*(_reduction(op, s) for (op, s) in reductions))
+        return Interned.__new__(cls, loop.target, loop.iterable, loop.body,
+                             private, shared, reductions)
+
+    @property
+    def private(self):
+        return self._args[3]
+
+    @property
+    def shared(self):
+        return self._args[4]
+
+    @property
+    def reductions(self):
+        return self._args[5]
+
+
+def _reduction(op, symbol):
+    """Validate a reduction clause, returning it as a Tuple"""
+    if isinstance(op, str):
+        op = operator(op)
+    if not isinstance(op, (AddOp, SubOp, MulOp)):
+        raise ValueError("Unsupported reduction operator "
+                         "{0}".format(op._symbol))
+    symbol = _sympify(symbol)
+    if not isinstance(symbol, Symbol):
+        raise TypeError("Only scalar Symbols can be reduced over")
+    return Tuple(op, symbol)
+
+
+def _loop_clauses(loop):
+    """Infer the private variables and reductions of the body of a loop."""
+    targets = []
+    assigned = []
+    updated = []
+    stack = list(reversed(loop.body))
+    while stack:
+        stmt = stack.pop()
+        if isinstance(stmt, For):
+            targets.append(stmt.target)
+            stack.extend(reversed(stmt.body))
+        elif isinstance(stmt, Assign) and isinstance(stmt.lhs, Symbol):
+            assigned.append(stmt.lhs)
+        elif isinstance(stmt, AugAssign) and isinstance(stmt.lhs, Symbol):
+            updated.append((stmt.op, stmt.lhs))
+    private = []
+    for s in targets + assigned:
+        if s != loop.target and s not in private:
+            private.append(s)
+    reductions = []
+    for (op, s) in updated:
+        if s not in private and (op, s) not in reductions:
+            reductions.append((op, s))
+    return private, reductions
+
+
+def loop_range(start, stop, step=1):
+    """Create a `Range` for use as the iterable of a `For` loop.
+
+    SymPy's `Range` only supports integer bounds. If any of the bounds are
+    symbolic, an unevaluated `Range` is returned instead. This can be printed
+    as a loop, but doesn't support iteration or any of the set methods.
+
+    Parameters
+    ----------
+    start, stop, step : int or Expr
+        Bounds of the range, with the same meaning as for the builtin
+        `range` (stop is exclusive).
+
+    """
+    start, stop, step = [_sympify(i) for i in (start, stop, step)]
+    if all(i.is_Integer for i in (start, stop, step)):
+        return Range(start, stop, step)
+    return Basic.__new__(Range, start, stop, step)
+
+
 # The following are defined to be sympy approved nodes. If there is something
 # smaller that could be used, that would be preferable. We only use them as
 # tokens.
@@ -374,7 +534,7 @@ def datatype(arg):
             return infer_dtype(arg)
 
 
-class Variable(Basic):
+class Variable(Interned):
     """Represents a typed variable.
 
     Parameters
@@ -382,7 +542,7 @@ class Variable(Basic):
     dtype : str, DataType
         The type of the variable. Can be either a DataType, or a str (bool,
         int, float, double).
-    name : Symbol, MatrixSymbol
+    name : Symbol, MatrixSymbol, IndexedBase
         The sympy object the variable represents.
 
     """
@@ -394,9 +554,10 @@ class Variable(Basic):
             raise TypeError("datatype must be an instance of DataType.")
         if isinstance(name, str):
             name = Symbol(name)
-        elif not isinstance(name, (Symbol, MatrixSymbol)):
-            raise TypeError("Only Symbols and MatrixSymbols can be Variables.")
-        return Basic.__new__(cls, dtype, name)
+        elif not isinstance(name, (Symbol, MatrixSymbol, IndexedBase)):
+            raise TypeError("Only Symbols, MatrixSymbols, and IndexedBases can "
+                            "be Variables.")
+        return Interned.__new__(cls, dtype, name)
 
     @property
     def dtype(self):
@@ -480,7 +641,7 @@ class InOutArgument(Argument):
     pass
 
 
-class FunctionDef(Basic):
+class FunctionDef(Interned):
     """Represents a function definition.
 
     Parameters
@@ -518,7 +679,7 @@ class FunctionDef(Basic):
         if not all(isinstance(i, Result) for i in results):
             raise TypeError("All results must be of type Result")
         results = Tuple(*results)
-        return Basic.__new__(cls, name, args, body, results)
+        return Interned.__new__(cls, name, args, body, results)
 
     @property
     def name(self):
@@ -537,7 +698,7 @@ class FunctionDef(Basic):
         return self._args[3]
 
 
-class Import(Basic):
+class Import(Interned):
     """Represents inclusion of dependencies in the code.
 
     Parameters
@@ -559,7 +720,7 @@ class Import(Basic):
             funcs = Tuple(Symbol(funcs))
         else:
             raise TypeError("Unrecognized funcs type: ", funcs)
-        return Basic.__new__(cls, fil, funcs)
+        return Interned.__new__(cls, fil, funcs)
 
     @property
     def fil(self):
@@ -571,7 +732,7 @@ class Import(Basic):
 
 
 # TODO: Should Declare have an optional init value for each var?
-class Declare(Basic):
+class Declare(Interned):
     """Represents a variable declaration in the code.
 
     Parameters
@@ -597,7 +758,7 @@ class Declare(Basic):
             if var.dtype != dtype:
                 raise ValueError("All variables must have the same dtype")
         variables = Tuple(*variables)
-        return Basic.__new__(cls, dtype, variables)
+        return Interned.__new__(cls, dtype, variables)
 
     @property
     def dtype(self):
@@ -608,7 +769,7 @@ class Declare(Basic):
         return self._args[1]
 
 
-class Return(Basic):
+class Return(Interned):
     """Represents a function return in the code.
 
     Parameters
@@ -620,7 +781,7 @@ class Return(Basic):
 
     def __new__(cls, expr):
         expr = _sympify(expr)
-        return Basic.__new__(cls, expr)
+        return Interned.__new__(cls, expr)
 
     @property
     def expr(self):
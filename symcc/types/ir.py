@@ -0,0 +1,400 @@
+"""
+A lightweight intermediate representation of lowered functions.
+
+The types in `symcc.types.ast` are SymPy objects. This makes them easy to
+construct and transform symbolically, but every node carries SymPy's argument
+tuple, hashing, and assumptions machinery. Once a `Routine` is lowered, the
+structure of the generated function no longer changes symbolically, so it's
+represented with these plain nodes instead. Nodes store their fields in
+``__slots__``, do no validation on construction, and hold their bodies in
+plain lists, which passes may modify in place.
+
+Statements are in a three-address form: a `Store` writes a single target, from
+a single expression and an optional operator (``target = target op value``).
+The expressions themselves, and the variables and arguments, are still SymPy
+and `symcc.types.ast` objects, so the printers handle them as before.
+
+
+IR Type Tree
+------------
+
+*Node*
+     |--->Procedure
+     |--->Declare
+     |--->Store
+     |--->Loop
+     |--->Return
+     |--->SinCos
+     |--->If
+     |--->Call
+     |--->Clear
+
+Helpers for passes finding the variables statements read and write
+(`free_names`, `target_name`, `names`, `written`), and introducing
+temporaries (`new_symbols`, `declare_temps`) are also provided.
+"""
+
+from __future__ import print_function, division
+
+from itertools import chain
+
+from sympy.core.compatibility import string_types
+from sympy.matrices.expressions.matexpr import MatrixElement
+from sympy.tensor import Indexed
+from sympy.utilities.iterables import numbered_symbols
+
+from symcc.types.ast import NativeOp, operator, Variable
+
+__all__ = ["Node", "Procedure", "Declare", "Store", "Loop", "Return", "SinCos",
+           "If", "Call", "Clear", "walk", "free_names", "target_name", "names",
+           "written", "parallel_loop", "used_names", "new_symbols",
+           "declare_temps"]
+
+
+class Node(object):
+    """Base class for all IR nodes.
+
+    The fields of each node are given by its `__slots__`. Nodes compare equal
+    if they're of the same type, and all of their fields are equal. As they
+    may be modified in place, nodes aren't hashable."""
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return False
+        return all(getattr(self, f) == getattr(other, f)
+                   for f in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(repr(getattr(self, f)) for f in self.__slots__)
+        return '{0}({1})'.format(type(self).__name__, fields)
+
+
+class Procedure(Node):
+    """A lowered function definition.
+
+    Parameters
+    ----------
+    name : Symbol
+        The name of the function.
+    arguments : iterable
+        The arguments to the function, of type `Argument`.
+    body : iterable
+        The statements of the function body.
+    results : iterable
+        The `DataType` of each value directly returned from the function.
+
+    """
+
+    __slots__ = ('name', 'arguments', 'body', 'results')
+
+    def __init__(self, name, arguments, body, results=()):
+        self.name = name
+        self.arguments = tuple(arguments)
+        self.body = list(body)
+        self.results = list(results)
+
+
+class Declare(Node):
+    """A declaration of variables sharing a datatype.
+
+    Parameters
+    ----------
+    dtype : DataType
+        The type for the declaration.
+    variables : iterable
+        The declared `Variable` objects.
+
+    """
+
+    __slots__ = ('dtype', 'variables')
+
+    def __init__(self, dtype, variables):
+        self.dtype = dtype
+        self.variables = list(variables)
+
+
+class Store(Node):
+    """Stores the value of an expression in a target.
+
+    Parameters
+    ----------
+    lhs : Symbol, MatrixSymbol, MatrixElement, or Indexed
+        The target of the store.
+    rhs : Expr
+        The value being stored.
+    op : NativeOp or str, optional
+        If given, the target is updated with ``lhs = lhs op rhs``, instead of
+        being overwritten.
+
+    """
+
+    __slots__ = ('lhs', 'rhs', 'op')
+
+    def __init__(self, lhs, rhs, op=None):
+        if op is not None and not isinstance(op, NativeOp):
+            op = operator(op)
+        self.lhs = lhs
+        self.rhs = rhs
+        self.op = op
+
+
+class Loop(Node):
+    """A counted loop, ``for target in range(start, stop, step)``.
+
+    Parameters
+    ----------
+    target : Symbol
+        The loop variable.
+    start, stop, step : Expr
+        The bounds of the loop, with the same meaning as for the builtin
+        `range` (stop is exclusive).
+    body : iterable
+        The statements of the loop body.
+    parallel : bool, optional
+        If True, the iterations are run in parallel with OpenMP. Default is
+        False.
+    private, shared, reductions : iterable, optional
+        The data-sharing clauses of a parallel loop. See `ParallelFor`.
+
+    """
+
+    __slots__ = ('target', 'start', 'stop', 'step', 'body', 'parallel',
+                 'private', 'shared', 'reductions')
+
+    def __init__(self, target, start, stop, step, body, parallel=False,
+                 private=(), shared=(), reductions=()):
+        self.target = target
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.body = list(body)
+        self.parallel = parallel
+        self.private = tuple(private)
+        self.shared = tuple(shared)
+        self.reductions = tuple(reductions)
+
+
+class Return(Node):
+    """Returns the value of an expression from the function.
+
+    Parameters
+    ----------
+    expr : Expr
+        The expression to return.
+
+    """
+
+    __slots__ = ('expr',)
+
+    def __init__(self, expr):
+        self.expr = expr
+
+
+class SinCos(Node):
+    """Stores the sine and cosine of an expression, computed together.
+
+    Parameters
+    ----------
+    arg : Expr
+        The argument of the sine and cosine.
+    sin, cos : Symbol
+        The targets of the sine and cosine.
+
+    """
+
+    __slots__ = ('arg', 'sin', 'cos')
+
+    def __init__(self, arg, sin, cos):
+        self.arg = arg
+        self.sin = sin
+        self.cos = cos
+
+
+class If(Node):
+    """Runs the body of the first case whose condition holds.
+
+    Parameters
+    ----------
+    cases : iterable
+        Pairs of ``(condition, body)``, with the body a list of statements.
+        The condition of the last case may be True, to run its body if no
+        other condition holds.
+
+    """
+
+    __slots__ = ('cases',)
+
+    def __init__(self, cases):
+        self.cases = [(cond, list(body)) for (cond, body) in cases]
+
+
+class Call(Node):
+    """Calls an external subroutine, such as a BLAS or LAPACK routine.
+
+    Parameters
+    ----------
+    name : str
+        The name of the subroutine.
+    args : iterable
+        The arguments. Arrays are passed as their `MatrixSymbol`, scalars as
+        expressions, and character arguments as a `str`.
+
+    """
+
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = list(args)
+
+
+class Clear(Node):
+    """Sets every entry of an array to zero.
+
+    Parameters
+    ----------
+    target : MatrixSymbol
+        The array to set.
+
+    """
+
+    __slots__ = ('target',)
+
+    def __init__(self, target):
+        self.target = target
+
+
+def walk(body):
+    """Iterate over all statements in a body in order, including those nested
+    inside loops and conditionals."""
+    stack = [iter(body)]
+    while stack:
+        for stmt in stack[-1]:
+            yield stmt
+            if isinstance(stmt, Loop):
+                stack.append(iter(stmt.body))
+                break
+            elif isinstance(stmt, If):
+                stack.append(chain.from_iterable(b for (c, b) in stmt.cases))
+                break
+        else:
+            stack.pop()
+
+
+def free_names(expr):
+    """Returns the names of the free symbols of an expression."""
+    return set(str(s) for s in getattr(expr, 'free_symbols', ()))
+
+
+def target_name(lhs):
+    """Returns the name of the variable written by a store to `lhs`."""
+    if isinstance(lhs, Indexed):
+        return str(lhs.base.label)
+    elif isinstance(lhs, MatrixElement):
+        return str(lhs.parent)
+    return str(lhs)
+
+
+def _exprs(stmt):
+    """Returns the expressions in the fields of a single statement, not
+    including nested statements."""
+    if isinstance(stmt, Store):
+        return (stmt.lhs, stmt.rhs)
+    elif isinstance(stmt, Loop):
+        return (stmt.target, stmt.start, stmt.stop, stmt.step)
+    elif isinstance(stmt, Return):
+        return (stmt.expr,)
+    elif isinstance(stmt, SinCos):
+        return (stmt.arg, stmt.sin, stmt.cos)
+    elif isinstance(stmt, If):
+        return tuple(c for (c, b) in stmt.cases)
+    elif isinstance(stmt, Call):
+        return tuple(a for a in stmt.args if not isinstance(a, string_types))
+    elif isinstance(stmt, Clear):
+        return (stmt.target,)
+    elif isinstance(stmt, Declare):
+        return ()
+    raise TypeError("Unknown statement {0}".format(type(stmt).__name__))
+
+
+def names(stmt):
+    """Returns the names of all variables referenced by a statement,
+    including in nested statements. Declarations reference nothing."""
+    out = set()
+    for s in walk([stmt]):
+        for e in _exprs(s):
+            out.update(free_names(e))
+    return out
+
+
+def written(stmt):
+    """Returns the names of all variables a statement may write, including
+    nested statements and loop targets. Any variable passed to a `Call` may
+    be written."""
+    out = set()
+    for s in walk([stmt]):
+        if isinstance(s, Store):
+            out.add(target_name(s.lhs))
+        elif isinstance(s, Loop):
+            out.add(str(s.target))
+        elif isinstance(s, SinCos):
+            out.update((str(s.sin), str(s.cos)))
+        elif isinstance(s, Call):
+            out.update(names(s))
+        elif isinstance(s, Clear):
+            out.add(str(s.target))
+    return out
+
+
+def parallel_loop(loop, parallel):
+    """Returns the outermost parallel loop enclosing the body of `loop`,
+    where `parallel` is the one enclosing `loop` itself (or None)."""
+    if parallel is None and loop.parallel:
+        return loop
+    return parallel
+
+
+def used_names(procedure):
+    """Returns the names of all symbols used in a `Procedure`"""
+    out = set(str(a.name) for a in procedure.arguments)
+    out.add(str(procedure.name))
+    for stmt in walk(procedure.body):
+        if isinstance(stmt, Declare):
+            out.update(str(v.name) for v in stmt.variables)
+        for e in _exprs(stmt):
+            out.update(free_names(e))
+    return out
+
+
+def new_symbols(procedure, prefix):
+    """Returns an iterator of numbered symbols ``prefix0, prefix1, ...``,
+    skipping names already used in a `Procedure`."""
+    used = used_names(procedure)
+    return (s for s in numbered_symbols(prefix) if s.name not in used)
+
+
+def declare_temps(procedure, dtype, symbols):
+    """Declare temporaries at the top of the body of a `Procedure`.
+
+    They're added to the first leading `Declare` of the same datatype, or to
+    a new one after the leading declarations."""
+    if not symbols:
+        return
+    variables = [Variable(dtype, s) for s in symbols]
+    body = procedure.body
+    for n, stmt in enumerate(body):
+        if not isinstance(stmt, Declare):
+            body.insert(n, Declare(dtype, variables))
+            break
+        if stmt.dtype is dtype:
+            stmt.variables.extend(variables)
+            break
+    else:
+        body.append(Declare(dtype, variables))
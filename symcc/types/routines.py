@@ -13,13 +13,15 @@ from sympy.core.sympify import _sympify
 from sympy import simplify
 from sympy.core.assumptions import _assume_defined
 from sympy.matrices.expressions.matexpr import MatrixExpr, MatrixElement
+from sympy.tensor import Indexed, IndexedBase, Idx
+from sympy.tensor.indexed import IndexException
 
-from symcc.types.ast import (Assign, Argument, DataType, datatype,
+from symcc.types.ast import (Interned, Assign, Argument, DataType, datatype,
         InOutArgument, OutArgument, InArgument, Bool, Int, Float, Double)
 from symcc.utilities.util import do_once, iterate
 
 
-class RoutineResult(Basic):
+class RoutineResult(Interned):
     """Base class for all outgoing information from a routine."""
     pass
 
@@ -51,7 +53,7 @@ class RoutineReturn(RoutineResult):
         expr = _sympify(expr)
         if not isinstance(expr, (Expr, MatrixExpr)):
             raise TypeError("Unsupported expression type %s." % type(expr))
-        return Basic.__new__(cls, dtype, expr)
+        return Interned.__new__(cls, dtype, expr)
 
     @property
     def dtype(self):
@@ -71,6 +73,10 @@ class RoutineInplace(RoutineResult):
         Argument in which the result will be returned.
     expr : sympifyable
         Expression to be returned.
+    indices : iterable, optional
+        If the argument is an `IndexedBase`, the `Idx` objects indexing the
+        result. The result is computed for all values in the ranges of these
+        indices.
 
     Attributes
     ----------
@@ -80,20 +86,29 @@ class RoutineInplace(RoutineResult):
         Argument in which the result will be returned.
     expr : sympifyable
         Expression to be returned.
+    indices : Tuple
+        The indices of the result. Empty for non-indexed results.
 
     """
 
-    def __new__(cls, arg, expr):
+    def __new__(cls, arg, expr, indices=()):
         if not isinstance(arg, (OutArgument, InOutArgument)):
             raise TypeError("arg must be of type OutArgument or InOutArgument")
         expr = _sympify(expr)
         if not isinstance(expr, (Expr, MatrixExpr)):
             raise TypeError("Unsupported expression type %s." % type(expr))
-        return Basic.__new__(cls, arg, expr)
+        if not iterable(indices):
+            raise TypeError("indices must be an iterable")
+        if not all(isinstance(i, Idx) for i in indices):
+            raise TypeError("All indices must be of type Idx")
+        if indices and not isinstance(arg.name, IndexedBase):
+            raise TypeError("Only IndexedBase arguments can have indices")
+        indices = Tuple(*indices)
+        return Interned.__new__(cls, arg, expr, indices)
 
     @property
     def dtype(self):
-        return self.name.dtype
+        return self.argument.dtype
 
     @property
     def argument(self):
@@ -103,6 +118,10 @@ class RoutineInplace(RoutineResult):
     def expr(self):
         return self._args[1]
 
+    @property
+    def indices(self):
+        return self._args[2]
+
 
 def routine_result(expr):
     """Easy creation of instances of `RoutineResult`.
@@ -121,12 +140,15 @@ def routine_result(expr):
     expr = _sympify(expr)
     if isinstance(expr, Assign):
         lhs = expr.lhs
+        if isinstance(lhs, Indexed):
+            return RoutineInplace(OutArgument(datatype(lhs), lhs.base),
+                    expr.rhs, lhs.indices)
         return RoutineInplace(OutArgument(datatype(lhs), lhs), expr.rhs)
     else:
         return RoutineReturn(datatype(expr), expr)
 
 
-class Routine(Basic):
+class Routine(Interned):
     """Represents a routine definition.
 
     Parameters
@@ -175,7 +197,7 @@ class Routine(Basic):
         if not all(isinstance(i, RoutineResult) for i in results):
             raise TypeError("All results must be of type RoutineResult")
         results = Tuple(*results)
-        return Basic.__new__(cls, name, args, results)
+        return Interned.__new__(cls, name, args, results)
 
     @property
     def name(self):
@@ -213,7 +235,8 @@ def routine(name, args, expr):
     name : str
         The name of the routine.
     args : iterable
-        The arguments to the routine. Can be Symbols or MatrixSymbols.
+        The arguments to the routine. Can be Symbols, MatrixSymbols, or
+        IndexedBases.
     expr
         The expression to generate code for. Can be a single expression,
         or a tuple of expressions. Tuples will result in multiple results.
@@ -222,6 +245,16 @@ def routine(name, args, expr):
     -------
     Routine
 
+    Notes
+    -----
+    Assignments to `Indexed` objects are computed for all values of the
+    indices on the lhs, with repeated indices on the rhs summed over
+    (Einstein summation). The loop ranges are taken from the bounds of the
+    `Idx` objects, and the shape of each `IndexedBase` argument is inferred
+    from them if not provided. All symbols in these bounds must be passed as
+    arguments. Scalar results may be sums over repeated indices too, such as
+    ``x[i]*y[i]``.
+
     """
 
     if isinstance(name, str):
@@ -229,11 +262,40 @@ def routine(name, args, expr):
     elif not isinstance(name, Symbol):
         raise TypeError("name must be str or Symbol")
     expr = _sympify(expr)
+    args, expr = _infer_shapes(args, expr)
     args = _make_arguments(args, expr)
     results = [routine_result(i) for i in iterate(expr)]
     return Routine(name, args, results)
 
 
+def _infer_shapes(args, expr):
+    """Helper function, used for inferring the shape of `IndexedBase`
+    arguments from the ranges of the indices they're used with.
+
+    Returns the new arguments, and the expression with all instances of the
+    old arguments replaced."""
+
+    subs = {}
+    indexed = sorted(expr.atoms(Indexed), key=str)
+    for a in args:
+        if not isinstance(a, IndexedBase) or a.shape is not None:
+            continue
+        for i in indexed:
+            if i.base == a:
+                try:
+                    subs[a] = IndexedBase(a.label, shape=i.shape)
+                except IndexException:
+                    continue
+                break
+    args = [subs.get(a, a) for a in args]
+    return args, expr.xreplace(subs)
+
+
+def _arg_symbol(arg):
+    """Returns the symbol representing an argument in `free_symbols`"""
+    return arg.label if isinstance(arg, IndexedBase) else arg
+
+
 def _make_arguments(args, expr):
     """Helper function, used for creating Argument instances automatically.
 
@@ -258,25 +320,42 @@ def _make_arguments(args, expr):
 
     """
 
-    frees = expr.free_symbols
+    # Loop indices aren't arguments
+    idx_labels = set(i.label for i in expr.atoms(Idx))
+    frees = expr.free_symbols - idx_labels
+    args_order = [_arg_symbol(a) for a in args]
+    args = dict(zip(args_order, args))
     args_set = set(args)
     missing = frees - args_set
     if not args_set == frees:
         raise ValueError("Missing arguments {0}".format(', '.join(
                 str(a) for a in missing)))
-    outs = set([i.lhs for i in iterate(expr) if isinstance(i, Assign)])
-    getvars = lambda x: x.rhs.free_symbols if isinstance(x, Assign) else x.free_symbols
+    def getouts(x):
+        if isinstance(x.lhs, Indexed):
+            return x.lhs.base.label
+        return x.lhs
+    def getvars(x):
+        if not isinstance(x, Assign):
+            return x.free_symbols - idx_labels
+        elif isinstance(x.lhs, Indexed):
+            # Symbols in the index bounds on the lhs are inputs
+            frees = x.rhs.free_symbols.union(*[i.free_symbols for i in
+                    x.lhs.indices])
+            return frees - idx_labels
+        return x.rhs.free_symbols - idx_labels
+    outs = set([getouts(i) for i in iterate(expr) if isinstance(i, Assign)])
     ins = set.union(*[getvars(i) for i in iterate(expr)])
     inouts = ins.intersection(outs)
     ins = ins - inouts
     outs = outs - inouts
     arglist = []
-    for i in args:
-        if i in ins:
+    for s in args_order:
+        i = args[s]
+        if s in ins:
             arglist.append(InArgument(datatype(i), i))
-        elif i in outs:
+        elif s in outs:
             arglist.append(OutArgument(datatype(i), i))
-        elif i in inouts:
+        elif s in inouts:
             arglist.append(InOutArgument(datatype(i), i))
         else:
             raise ValueError("How did you even get here????")
@@ -292,7 +371,7 @@ _accepted_types = {Int: (Int,),
                    Float: (Double, Float, Int)}
 
 
-class RoutineCall(Basic):
+class RoutineCall(Interned):
     """Represents a call to a `Routine` in the generated code.
 
     Parameters
@@ -327,7 +406,7 @@ class RoutineCall(Basic):
         for n, (a, p) in enumerate(zip(args, routine.arguments)):
             cls._validate_arg(a, p)
         args = Tuple(*args)
-        return Basic.__new__(cls, routine, args)
+        return Interned.__new__(cls, routine, args)
 
     @staticmethod
     def _validate_arg(arg, param):
@@ -4,7 +4,7 @@ from sympy.utilities.pytest import raises
 
 from symcc.types.ast import (Assign, AugAssign, datatype, Bool, Int, Float,
         Double, Void, For, InArgument, OutArgument, InOutArgument, Variable,
-        Result, Return, FunctionDef)
+        Result, Return, FunctionDef, loop_range, ParallelFor, AddOp, MulOp)
 
 x, y = symbols("x, y")
 n = symbols("n", integer=True)
@@ -96,10 +96,39 @@ def test_For():
     raises(TypeError, lambda: For(n, x, (x + y,)))
 
 
+def test_ParallelFor():
+    m = symbols('m', integer=True)
+    inner = For(m, Range(0, 3), (AugAssign(y, '*', m),))
+    f = ParallelFor(n, Range(0, 3), (Assign(x, n), AugAssign(y, '+', x), inner))
+    assert f.func(*f.args) == f
+    assert f.private == (m, x)
+    assert f.shared == ()
+    assert f.reductions == ((AddOp(), y), (MulOp(), y))
+    f = ParallelFor(n, Range(0, 3), (AugAssign(y, '+', n),), private=(),
+                    shared=(x,), reductions=())
+    assert f.private == f.reductions == ()
+    assert f.shared == (x,)
+    assert isinstance(f, For)
+    raises(ValueError, lambda: ParallelFor(n, Range(0, 3),
+            (AugAssign(y, '/', n),)))
+    raises(TypeError, lambda: ParallelFor(n, Range(0, 3), (),
+            reductions=(('+', A),)))
+
+
+def test_loop_range():
+    assert loop_range(0, 3) == Range(0, 3)
+    r = loop_range(1, n + 1)
+    assert isinstance(r, Range)
+    assert r.args == (1, n + 1, 1)
+    f = For(i.label, r, (Assign(x, x + i),))
+    assert f.func(*f.args) == f
+
+
 def test_Variable():
     v = Variable('int', x)
     assert v.func(*v.args) == v
     Variable('double', A)
+    Variable('double', B)
     raises(TypeError, lambda: Variable('int', x + y))
 
 
@@ -132,3 +161,24 @@ def test_FunctionDef():
 def test_Return():
     r = Return(x + y)
     assert r.func(*r.args) == r
+
+
+def test_interning():
+    assert Assign(x, y) is Assign(x, y)
+    assert AugAssign(x, '+', y) is AugAssign(x, AddOp(), y)
+    assert Variable('int', x) is Variable(Int, x)
+    assert Result('double') is Result(Double)
+    assert Variable('double', x) is not InArgument('double', x)
+    assert Variable('double', x) != InArgument('double', x)
+    assert Assign(x, y) != Assign(y, x)
+    f = FunctionDef('test', (InArgument('double', x),), (Return(x),),
+            (Result('double'),))
+    assert f.func(*f.args) is f
+    # Nodes are only kept alive by outside references
+    import gc
+    from symcc.types.ast import _intern_table
+    z = symbols('z_interning')
+    key = (Assign, z, y)
+    Assign(z, y)
+    gc.collect()
+    assert key not in _intern_table
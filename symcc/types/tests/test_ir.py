@@ -0,0 +1,70 @@
+from sympy import symbols, sin, IndexedBase
+
+from symcc.types.ast import AddOp, Double, Int, Variable, InArgument
+from symcc.types.ir import (Procedure, Declare, Store, Loop, Return, walk,
+        names, written, new_symbols, declare_temps)
+
+x, y, i, j = symbols('x, y, i, j')
+
+
+def test_Node():
+    s = Store(x, sin(y))
+    assert s == Store(x, sin(y))
+    assert s != Store(x, sin(y), '+')
+    assert s != Return(sin(y))
+    assert repr(s) == "Store(x, sin(y), None)"
+    assert not hasattr(s, '__dict__')
+    # Nodes are mutable, and unhashable
+    s.rhs = y
+    assert s == Store(x, y)
+    try:
+        hash(s)
+    except TypeError:
+        pass
+    else:
+        assert False
+
+
+def test_Store():
+    assert Store(x, y, '+').op is AddOp()
+    assert Store(x, y, AddOp()) == Store(x, y, '+')
+    assert Store(x, y).op is None
+
+
+def test_Procedure():
+    f = Procedure('f', (), (Store(x, y),), (Double,))
+    assert f.body == [Store(x, y)]
+    assert f.results == [Double]
+    f.body.append(Return(x))
+    assert f == Procedure('f', (), [Store(x, y), Return(x)], [Double])
+
+
+def test_walk():
+    inner = Loop(j, 0, 3, 1, [Store(y, j, '+')])
+    outer = Loop(i, 0, 3, 1, [Store(x, i), inner, Store(x, y, '*')])
+    body = [Declare(Double, []), outer, Return(x)]
+    assert list(walk(body)) == [body[0], outer, outer.body[0], inner,
+                                inner.body[0], outer.body[2], body[2]]
+    assert list(walk([])) == []
+
+
+def test_names():
+    A = IndexedBase('A')
+    loop = Loop(i, 0, j, 1, [Store(A[i], x*y), Return(y)])
+    assert names(loop) == set(['i', 'j', 'A', 'x', 'y'])
+    assert written(loop) == set(['i', 'A'])
+    assert names(Declare(Double, [Variable(Double, x)])) == set()
+
+
+def test_temps():
+    t0, t1, t2 = symbols('t0, t1, t2')
+    f = Procedure('f', (InArgument(Double, t0),),
+                  [Declare(Int, [Variable(Int, i)]), Store(x, t1)])
+    # t0 and t1 are already used
+    assert next(new_symbols(f, 't')) == t2
+    declare_temps(f, Double, [t2])
+    assert f.body[:2] == [Declare(Int, [Variable(Int, i)]),
+                          Declare(Double, [Variable(Double, t2)])]
+    declare_temps(f, Double, [x])
+    assert f.body[1] == Declare(Double, [Variable(Double, t2),
+                                         Variable(Double, x)])
@@ -1,9 +1,10 @@
 from sympy import (symbols, sin, cos, Dict, sqrt, tan, simplify, MatrixSymbol,
-        MatrixExpr, Matrix)
+        MatrixExpr, Matrix, IndexedBase, Idx)
 from sympy.utilities.pytest import raises
 from sympy.core.assumptions import _assume_defined
 
-from symcc.types.ast import Assign, InArgument, OutArgument, datatype, Double
+from symcc.types.ast import (Assign, InArgument, OutArgument, datatype, Double,
+        Int)
 from symcc.types.routines import (RoutineReturn, RoutineInplace, Routine,
         routine, routine_result, ScalarRoutineCallResult, MatrixRoutineCallResult)
 
@@ -57,6 +58,26 @@ def test_routine():
     raises(ValueError, lambda: routine('test', (a, b, c, out), expr))
 
 
+def test_routine_Indexed():
+    m, n = symbols('m, n', integer=True)
+    i, j = Idx('i', m), Idx('j', n)
+    A, v, y = IndexedBase('A'), IndexedBase('v'), IndexedBase('y')
+    test = routine('test', (A, v, y, m, n), Assign(y[i], A[i, j]*v[j]))
+    A, v, y = [IndexedBase(s, shape=sh) for (s, sh) in
+               (('A', (m, n)), ('v', (n,)), ('y', (m,)))]
+    y_arg = OutArgument(Double, y)
+    args = (InArgument(Double, A), InArgument(Double, v), y_arg,
+            InArgument(Int, m), InArgument(Int, n))
+    res = RoutineInplace(y_arg, A[i, j]*v[j], (i,))
+    assert test == Routine('test', args, (res,))
+    assert res.indices == (i,)
+    assert res.func(*res.args) == res
+    # Bounds of the indices are required arguments
+    raises(ValueError, lambda: routine('test', (A, v, y, m), Assign(y[i], A[i, j]*v[j])))
+    # Only IndexedBase results may have indices
+    raises(TypeError, lambda: RoutineInplace(out_arg, a, (i,)))
+
+
 def test_Routine():
     test = routine('test', (a, b, c), expr)
     assert test.name == symbols('test')
@@ -78,6 +99,14 @@ def test_Routine():
     assert test.inplace == (routine_result(mat_expr),)
 
 
+def test_Routine_interning():
+    test = routine('test', (a, b, c, out), (expr, inp_expr))
+    assert routine('test', (a, b, c, out), (expr, inp_expr)) is test
+    assert routine_result(inp_expr) is test.inplace[0]
+    assert test(1, 2, 3, out) is test(1, 2, 3, out)
+    assert routine('test', (a, b, c), expr) is not test
+
+
 def test_RoutineCall():
     test = routine('test', (a, b, c), expr)
     rcall = test(1, 2, 3)
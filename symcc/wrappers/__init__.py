@@ -0,0 +1,3 @@
+from .cwrapper import *
+from .cache import *
+from .ufunc import *
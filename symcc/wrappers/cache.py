@@ -0,0 +1,224 @@
+"""
+A persistent, content-addressed cache of compiled routines.
+
+Compiled libraries are stored in a directory, keyed by a hash of everything
+that determines the generated code. Entries are written atomically, so the
+cache may be shared between concurrent processes. When the total size of the
+cache exceeds a limit, the least recently used entries are evicted.
+
+"""
+
+from __future__ import print_function, division
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from sympy.core import Basic, Symbol
+from sympy.printing import srepr
+
+__all__ = ["CompilationCache"]
+
+
+# Bump this whenever the format of the cache changes. Changes to the code
+# generation are caught by `_generator_hash`.
+_CACHE_VERSION = 2
+
+_SUFFIX = '.so'
+
+
+_GENERATOR_HASH = []
+
+
+def _generator_hash():
+    """Returns a hash of the source of the symcc package, which determines
+    the generated code. Computed once per process."""
+    if not _GENERATOR_HASH:
+        h = hashlib.sha256()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d != 'tests')
+            for name in sorted(filenames):
+                if name.endswith('.py'):
+                    path = os.path.join(dirpath, name)
+                    h.update(os.path.relpath(path, root).encode('utf-8'))
+                    with open(path, 'rb') as f:
+                        h.update(f.read())
+        _GENERATOR_HASH.append(h.hexdigest())
+    return _GENERATOR_HASH[0]
+
+
+def _canonical(obj):
+    """Returns a string representing `obj`, which is the same in every
+    process. The items of sets and dicts are sorted, and sympy objects are
+    represented by their `srepr`."""
+    if isinstance(obj, dict):
+        items = sorted((_canonical(k), _canonical(v)) for (k, v) in
+                       obj.items())
+        return '{' + ', '.join('{0}: {1}'.format(k, v) for (k, v) in
+                               items) + '}'
+    elif isinstance(obj, (set, frozenset)):
+        return '{' + ', '.join(sorted(_canonical(i) for i in obj)) + '}'
+    elif isinstance(obj, (list, tuple)):
+        return '[' + ', '.join(_canonical(i) for i in obj) + ']'
+    elif isinstance(obj, Basic):
+        return srepr(obj)
+    return repr(obj)
+
+
+def _default_path():
+    path = os.environ.get('SYMCC_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME',
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'symcc')
+
+
+class CompilationCache(object):
+    """An on-disk cache of compiled routines, with LRU eviction.
+
+    Parameters
+    ----------
+    path : str, optional
+        The directory to store the cache in. Defaults to the
+        ``SYMCC_CACHE_DIR`` environment variable if set, otherwise
+        ``$XDG_CACHE_HOME/symcc`` (``~/.cache/symcc``).
+    max_size : int, optional
+        The maximum total size of the cache in bytes [default=256 MiB]. If
+        None, the cache is unbounded.
+
+    Examples
+    --------
+
+    >>> from sympy import symbols
+    >>> from symcc.types.routines import routine
+    >>> from symcc.wrappers import compile_routine
+    >>> a, b = symbols('a, b')
+    >>> cache = CompilationCache('/tmp/symcc_cache')
+    >>> f = compile_routine(routine('f', (a, b), a + b), cache=cache)
+    >>> f(1, 2)
+    3.0
+
+    """
+
+    def __init__(self, path=None, max_size=2**28):
+        self.path = path or _default_path()
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # Another process may have created it first
+                if not os.path.isdir(self.path):
+                    raise
+
+    def key(self, routine, settings=None, compiler=None, flags=(), tag=None):
+        """Compute the cache key for a routine.
+
+        The key is a stable hash of the structure of the routine (name,
+        arguments, datatypes, and result expressions, including the
+        assumptions on all symbols), the printer settings, the compiler, the
+        compiler flags, and an optional `tag` identifying any additional
+        generated code. The source of symcc itself is also hashed, so
+        libraries built by other versions of the code generator are never
+        used.
+        """
+        h = hashlib.sha256()
+        def update(obj):
+            h.update(str(obj).encode('utf-8'))
+            h.update(b'\0')
+        update(_CACHE_VERSION)
+        update(_generator_hash())
+        update(srepr(routine))
+        symbols = [s for s in routine.free_symbols if isinstance(s, Symbol)]
+        for s in sorted(symbols, key=str):
+            update(s.name)
+            update(sorted(s.assumptions0.items()))
+        update(_canonical(settings or {}))
+        update(compiler)
+        update(list(flags))
+        update(tag)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + _SUFFIX)
+
+    def get(self, key):
+        """Returns the path to the library stored under `key`, or None if
+        there is no such entry. Marks the entry as recently used."""
+        path = self._entry(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, lib_path):
+        """Store the library at `lib_path` under `key`, and return the path of
+        the cached copy."""
+        path = self._entry(key)
+        # Copy to a temporary file in the cache directory, and then rename.
+        # The rename is atomic, so other processes never see partial files.
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with open(lib_path, 'rb') as src:
+                    shutil.copyfileobj(src, f)
+            os.rename(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            # On some platforms rename fails if the target exists, in which
+            # case another process already stored this entry.
+            if not os.path.exists(path):
+                raise
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        """Returns a list of ``(mtime, size, path)`` for all cache entries,
+        least recently used first."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        """Returns the total size of the cache in bytes."""
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache is smaller than
+        `max_size`. The entry at path `keep` is never removed."""
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for (mtime, size, path) in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for (mtime, size, path) in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
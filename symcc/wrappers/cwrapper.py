@@ -0,0 +1,333 @@
+"""
+Compilation of `Routine` objects into C shared libraries, loaded as python
+callables using `ctypes`.
+
+"""
+
+from __future__ import print_function, division
+
+import atexit
+import ctypes
+import os
+import shutil
+import subprocess
+import tempfile
+from functools import reduce
+from operator import mul
+
+from sympy.matrices.expressions.matexpr import MatrixSymbol
+from sympy.tensor import IndexedBase
+from sympy.utilities.iterables import iterable
+
+from symcc.types.ast import (Import, InArgument, OutArgument, InOutArgument,
+        Bool, Int, Float, Double)
+from symcc.printers.ccode import CCodePrinter
+from symcc.wrappers.cache import CompilationCache
+
+__all__ = ["compile_routine", "build_library", "CompiledRoutine",
+        "CompileError"]
+
+
+# Mapping of symcc datatypes to ctypes types
+_ctypes_types = {Bool: ctypes.c_bool,
+                 Int: ctypes.c_int,
+                 Float: ctypes.c_float,
+                 Double: ctypes.c_double}
+
+# Headers included in every generated translation unit
+_headers = ('math.h', 'stdbool.h', 'stddef.h', 'string.h')
+
+
+class CompileError(Exception):
+    """Raised when compiling generated code fails."""
+    pass
+
+
+def _shape(arg):
+    """Returns the shape of an argument as a tuple of ints, or None if the
+    argument is a scalar."""
+    if isinstance(arg.name, MatrixSymbol):
+        shape = arg.name.shape
+    elif isinstance(arg.name, IndexedBase):
+        shape = arg.name.shape
+        if shape is None:
+            raise ValueError("Shape of {0} is unknown.".format(arg.name))
+    else:
+        return None
+    if not all(i.is_Integer for i in shape):
+        raise ValueError("Only arguments with a constant shape can be "
+                         "passed from python, got {0}.".format(arg.name))
+    return tuple(int(i) for i in shape)
+
+
+def _size(shape):
+    """Returns the number of elements in an array of the given shape."""
+    return reduce(mul, shape, 1)
+
+
+def _argtype(arg):
+    """Returns the ctypes type used to pass an argument."""
+    ctype = _ctypes_types[arg.dtype]
+    if isinstance(arg, InArgument) and _shape(arg) is None:
+        return ctype
+    return ctypes.POINTER(ctype)
+
+
+def _flatten(value):
+    """Flatten a (possibly nested) sequence of values in row-major order."""
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+    flat = []
+    for v in value:
+        if iterable(v):
+            flat.extend(_flatten(v))
+        else:
+            flat.append(v)
+    return flat
+
+
+def _nest(flat, shape):
+    """Inverse of `_flatten`, building nested lists of the given shape."""
+    if len(shape) == 1:
+        return list(flat)
+    step = _size(shape[1:])
+    return [_nest(flat[i*step:(i + 1)*step], shape[1:])
+            for i in range(shape[0])]
+
+
+def _to_c(arg, ctype, value):
+    """Convert a python value into a ctypes object for the given argument."""
+    shape = _shape(arg)
+    if shape is None:
+        return ctype(value)
+    size = _size(shape)
+    flat = _flatten(value)
+    if len(flat) != size:
+        raise ValueError("Argument {0} must have {1} elements, got "
+                "{2}.".format(arg.name, size, len(flat)))
+    return (ctype*size)(*flat)
+
+
+def _from_c(arg, cvalue):
+    """Convert a ctypes object back into a python value. Arrays are returned
+    as nested lists, so matrices are a list of rows."""
+    shape = _shape(arg)
+    if shape is None:
+        return cvalue.value
+    return _nest(cvalue[:], shape)
+
+
+class CompiledRoutine(object):
+    """A callable wrapping a compiled `Routine`.
+
+    The callable accepts values for all `InArgument` and `InOutArgument`
+    parameters of the routine, in the order they appear in the routine. The
+    result is a tuple of all returned values, followed by the values of all
+    `OutArgument` and `InOutArgument` parameters, in order. If there is only
+    one result, it is returned directly. Matrices and arrays are passed as
+    (possibly nested) sequences in row-major order, and returned as nested
+    lists (a list of rows for matrices). Arrays must have a constant shape.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine that was compiled.
+    path : str
+        Path to the shared library containing the compiled routine.
+
+    Attributes
+    ----------
+    routine : Routine
+        The routine that was compiled.
+    path : str
+        Path to the shared library containing the compiled routine.
+
+    """
+
+    def __init__(self, routine, path):
+        self.routine = routine
+        self.path = path
+        self._lib = ctypes.CDLL(path)
+        self._func = getattr(self._lib, str(routine.name))
+        self._func.argtypes = [_argtype(a) for a in routine.arguments]
+        returns = routine.returns
+        if returns:
+            self._func.restype = _ctypes_types[returns[0].dtype]
+        else:
+            self._func.restype = None
+        self._inputs = [a for a in routine.arguments
+                        if not isinstance(a, OutArgument)]
+        self._outputs = [a for a in routine.arguments
+                         if isinstance(a, (OutArgument, InOutArgument))]
+
+    def __call__(self, *args):
+        if len(args) != len(self._inputs):
+            raise TypeError("{0} takes {1} arguments ({2} given)".format(
+                    self.routine.name, len(self._inputs), len(args)))
+        values = dict(zip(self._inputs, args))
+        c_args = []
+        c_outs = []
+        for arg in self.routine.arguments:
+            ctype = _ctypes_types[arg.dtype]
+            if isinstance(arg, OutArgument):
+                shape = _shape(arg)
+                if shape is None:
+                    cval = ctype()
+                else:
+                    cval = (ctype*_size(shape))()
+            else:
+                cval = _to_c(arg, ctype, values[arg])
+            if isinstance(arg, (OutArgument, InOutArgument)):
+                c_outs.append(cval)
+                if _shape(arg) is None:
+                    cval = ctypes.byref(cval)
+            c_args.append(cval)
+        res = self._func(*c_args)
+        results = [res] if self.routine.returns else []
+        results.extend(_from_c(a, c) for (a, c) in zip(self._outputs, c_outs))
+        if not results:
+            return None
+        elif len(results) == 1:
+            return results[0]
+        return tuple(results)
+
+    def __repr__(self):
+        args = ', '.join(str(a.name) for a in self._inputs)
+        return "<CompiledRoutine {0}({1})>".format(self.routine.name, args)
+
+
+def _write_source(path, routine, printer, wrappers, headers=()):
+    """Print a `Routine` and any wrappers as a C translation unit, streaming
+    the code to the file at `path`. `headers` are included first."""
+    with open(path, 'w') as f:
+        for h in headers:
+            printer.write(Import(h), f)
+        # Declares GNU extensions to the math library, such as sincos
+        f.write('#define _GNU_SOURCE 1\n')
+        for h in _headers:
+            printer.write(Import(h), f)
+        f.write('\n')
+        printer.write(routine, f)
+        for w in wrappers:
+            f.write('\n')
+            f.write(w(routine, printer))
+
+
+def _compile(src_path, compiler, flags, libs=()):
+    """Compile the C source at `src_path` into a shared library, linked with
+    the libraries `libs`. Returns the path to the library."""
+    lib_path = os.path.splitext(src_path)[0] + '.so'
+    cmd = ([compiler, '-shared', '-fPIC'] + list(flags) +
+           ['-o', lib_path, src_path] + ['-l' + l for l in libs] + ['-lm'])
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+    except OSError as e:
+        raise CompileError("Failed to run compiler {0}: {1}".format(compiler, e))
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise CompileError("Compilation failed:\n{0}\n{1}".format(
+                ' '.join(cmd), output.decode('utf-8', 'replace')))
+    return lib_path
+
+
+def build_library(routine, compiler=None, flags=('-O2',), tmpdir=None,
+        cache=None, wrappers=(), headers=(), **settings):
+    """Print a `Routine` as a C translation unit, and compile it into a shared
+    library.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to compile.
+    compiler : str, optional
+        The C compiler to use. Defaults to the ``CC`` environment variable,
+        or ``cc`` if not set.
+    flags : iterable, optional
+        Additional flags passed to the compiler [default=('-O2',)].
+    tmpdir : str, optional
+        Directory in which to write the source and library. If not provided,
+        a temporary directory is created and removed at exit. Each build is
+        given new file names, starting with the name of the routine.
+    cache : CompilationCache or bool, optional
+        If provided, compiled libraries are looked up in and stored to this
+        cache, skipping code generation and compilation on a hit. If True,
+        the default `CompilationCache` is used.
+    wrappers : iterable, optional
+        Functions of ``(routine, printer)``, each returning additional C code
+        to append to the translation unit.
+    headers : iterable, optional
+        Headers the wrappers need included before any other, such as
+        ``Python.h``.
+    settings
+        Any additional settings are passed to `CCodePrinter`. If
+        ``parallel=True``, OpenMP is enabled with ``-fopenmp``. If
+        ``blas=True``, the library is linked with LAPACK and BLAS.
+
+    Returns
+    -------
+    path : str
+        The path to the compiled library.
+
+    """
+
+    if compiler is None:
+        compiler = os.environ.get('CC', 'cc')
+    if settings.get('parallel'):
+        flags = tuple(flags) + ('-fopenmp',)
+    libs = ('lapack', 'blas') if settings.get('blas') else ()
+    if cache is True:
+        cache = CompilationCache()
+    if cache:
+        tag = ['{0}.{1}'.format(w.__module__, w.__name__) for w in wrappers]
+        tag.extend(headers)
+        key = cache.key(routine, settings, compiler, flags, tag)
+        path = cache.get(key)
+        if path is not None:
+            return path
+    if tmpdir is None:
+        tmpdir = tempfile.mkdtemp(prefix='symcc_')
+        atexit.register(shutil.rmtree, tmpdir, True)
+    printer = CCodePrinter(settings)
+    # A library is only loaded once per path, so a new build mustn't reuse
+    # the path of an earlier one
+    fd, src_path = tempfile.mkstemp(prefix=str(routine.name) + '_',
+                                    suffix='.c', dir=tmpdir)
+    os.close(fd)
+    _write_source(src_path, routine, printer, wrappers, headers)
+    path = _compile(src_path, compiler, flags, libs)
+    if cache:
+        path = cache.put(key, path)
+    return path
+
+
+def compile_routine(routine, compiler=None, flags=('-O2',), tmpdir=None,
+        cache=None, **settings):
+    """Compile a `Routine` with the local C compiler, and load it.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to compile.
+    compiler, flags, tmpdir, cache, settings
+        See `build_library`.
+
+    Returns
+    -------
+    CompiledRoutine
+
+    Examples
+    --------
+
+    >>> from sympy import symbols, sin
+    >>> from symcc.types.ast import Assign
+    >>> from symcc.types.routines import routine
+    >>> a, b, c = symbols('a, b, c')
+    >>> f = compile_routine(routine('f', (a, b, c), (a + b, Assign(c, a*b))))
+    >>> f(2, 3)
+    (5.0, 6.0)
+
+    """
+
+    path = build_library(routine, compiler, flags, tmpdir, cache, **settings)
+    return CompiledRoutine(routine, path)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from distutils.spawn import find_executable
+
+import pytest
+from sympy import symbols, sin, cos
+
+from symcc.types.ast import Assign
+from symcc.types.routines import routine
+from symcc.wrappers import cache as cache_module
+from symcc.wrappers.cache import CompilationCache
+from symcc.wrappers.cwrapper import compile_routine
+
+requires_cc = pytest.mark.skipif(
+        not find_executable(os.environ.get('CC', 'cc')),
+        reason="No C compiler available")
+
+a, b, c = symbols('a, b, c')
+n = symbols('n', integer=True)
+
+
+def setup_function(func):
+    global cache_dir
+    cache_dir = tempfile.mkdtemp()
+
+
+def teardown_function(func):
+    shutil.rmtree(cache_dir, True)
+
+
+def _put(cache, key, size, mtime):
+    path = os.path.join(cache_dir, 'src')
+    with open(path, 'wb') as f:
+        f.write(b'0'*size)
+    path = cache.put(key, path)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_key():
+    cache = CompilationCache(cache_dir)
+    r = routine('f', (a, b), sin(a)*cos(b))
+    key = cache.key(r, {}, 'cc', ('-O2',))
+    assert key == cache.key(routine('f', (a, b), sin(a)*cos(b)), {}, 'cc',
+            ('-O2',))
+    assert key != cache.key(routine('g', (a, b), sin(a)*cos(b)), {}, 'cc',
+            ('-O2',))
+    assert key != cache.key(routine('f', (a, b), sin(b)*cos(a)), {}, 'cc',
+            ('-O2',))
+    assert key != cache.key(r, {'cse': False}, 'cc', ('-O2',))
+    assert key != cache.key(r, {}, 'gcc', ('-O2',))
+    assert key != cache.key(r, {}, 'cc', ('-O3',))
+    # Assumptions change the generated code
+    n2 = symbols('n')
+    assert (cache.key(routine('f', (n,), abs(n)), {}, 'cc') !=
+            cache.key(routine('f', (n2,), abs(n2)), {}, 'cc'))
+
+
+def test_key_canonical():
+    # Sets are hashed in the same order in every process
+    code = ("from sympy import symbols\n"
+            "from symcc.types.routines import routine\n"
+            "from symcc.wrappers.cache import CompilationCache\n"
+            "a, b, c, d = symbols('a, b, c, d')\n"
+            "r = routine('f', (a, b, c, d), a*b*c*d)\n"
+            "cache = CompilationCache({0!r})\n"
+            "print(cache.key(r, {{'dereference': set([a, b, c, d])}}))\n"
+            ).format(cache_dir)
+    keys = set()
+    for seed in ('1', '2', '3'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        keys.add(subprocess.check_output([sys.executable, '-c', code],
+                                         env=env).strip())
+    assert len(keys) == 1
+    # Changes to the code generator invalidate the keys
+    cache = CompilationCache(cache_dir)
+    r = routine('f', (a, b), a + b)
+    key = cache.key(r)
+    old = cache_module._GENERATOR_HASH[:]
+    try:
+        cache_module._GENERATOR_HASH[:] = ['0']
+        assert cache.key(r) != key
+    finally:
+        cache_module._GENERATOR_HASH[:] = old
+
+
+def test_get_put():
+    cache = CompilationCache(cache_dir)
+    assert cache.get('abc') is None
+    path = _put(cache, 'abc', 10, 1000)
+    assert cache.get('abc') == path
+    # Getting an entry marks it as recently used
+    assert os.stat(path).st_mtime > 1000
+    assert cache.size() == 10
+    cache.clear()
+    assert cache.get('abc') is None
+    assert cache.size() == 0
+
+
+def test_evict():
+    cache = CompilationCache(cache_dir, max_size=25)
+    p1 = _put(cache, 'a', 10, 1000)
+    p2 = _put(cache, 'b', 10, 2000)
+    cache.get('a')
+    # 'b' is now least recently used, and is evicted first
+    p3 = _put(cache, 'c', 10, 3000)
+    assert cache.get('b') is None
+    assert not os.path.exists(p2)
+    assert cache.get('a') == p1
+    assert cache.get('c') == p3
+    # Entries larger than the cache are still stored
+    p4 = _put(cache, 'd', 30, 4000)
+    assert os.path.exists(p4)
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+
+
+@requires_cc
+def test_compile_routine_cached():
+    cache = CompilationCache(cache_dir)
+    r = routine('f', (a, b, c), (a + b, Assign(c, a*b)))
+    f = compile_routine(r, cache=cache)
+    assert f(2, 3) == (5.0, 6.0)
+    assert len(cache.entries()) == 1
+    # The second compilation is a cache hit
+    f = compile_routine(r, cache=cache)
+    assert len(cache.entries()) == 1
+    assert f.path == cache.entries()[0][2]
+    assert f(2, 3) == (5.0, 6.0)
@@ -0,0 +1,195 @@
+import os
+from ctypes.util import find_library
+from distutils.spawn import find_executable
+
+import pytest
+from sympy import (symbols, sin, cos, exp, Matrix, MatrixSymbol, IndexedBase,
+        Idx, Rational, sqrt, pi, Piecewise, Inverse)
+from sympy.utilities.pytest import raises
+
+from symcc.types.ast import Assign
+from symcc.types.routines import routine
+from symcc.transforms.sparse import sparse_outputs
+from symcc.transforms.derivatives import jacobian_routine
+from symcc.wrappers.cwrapper import compile_routine, CompileError
+
+requires_cc = pytest.mark.skipif(
+        not find_executable(os.environ.get('CC', 'cc')),
+        reason="No C compiler available")
+requires_lapack = pytest.mark.skipif(
+        not (find_library('lapack') and find_library('blas')),
+        reason="No LAPACK or BLAS available")
+
+a, b, c = symbols('a, b, c')
+n = symbols('n', integer=True)
+X = MatrixSymbol('X', 2, 2)
+Y = MatrixSymbol('Y', 2, 1)
+
+
+@requires_cc
+def test_compile_routine_return():
+    f = compile_routine(routine('f', (a, b), sin(a)*cos(b) + 1))
+    assert abs(f(1.0, 2.0) - (1 + sin(1.0)*cos(2.0))) < 1e-12
+    raises(TypeError, lambda: f(1.0))
+
+
+@requires_cc
+def test_compile_routine_inplace():
+    f = compile_routine(routine('f', (a, b, c), (a + b, Assign(c, a*b))))
+    assert f(2, 3) == (5.0, 6.0)
+    f = compile_routine(routine('f', (a, c), Assign(c, c + a)))
+    assert f(2, 3) == 5.0
+    f = compile_routine(routine('f', (n,), n*3))
+    assert f(4) == 12
+
+
+@requires_cc
+def test_compile_routine_matrix():
+    f = compile_routine(routine('f', (X, Y),
+            Assign(Y, Matrix([X[0, 0] + X[0, 1], X[1, 0]*X[1, 1]]))))
+    assert f([[1, 2], [3, 4]]) == [[3.0], [12.0]]
+    assert f([1, 2, 3, 4]) == [[3.0], [12.0]]
+    raises(ValueError, lambda: f([1, 2, 3]))
+
+
+@requires_cc
+def test_compile_routine_indexed():
+    A, x, y = IndexedBase('A'), IndexedBase('x'), IndexedBase('y')
+    i, j = Idx('i', 3), Idx('j', 2)
+    r = routine('matvec', (A, x, y), Assign(y[i], A[i, j]*x[j]))
+    f = compile_routine(r)
+    assert f([[1, 2], [3, 4], [5, 6]], [1, 1]) == [3.0, 7.0, 11.0]
+    f = compile_routine(r, parallel=True)
+    assert f([[1, 2], [3, 4], [5, 6]], [1, 1]) == [3.0, 7.0, 11.0]
+    # Indices of the lhs repeated in a product aren't summed over
+    u, v = IndexedBase('u'), IndexedBase('v')
+    r = routine('f', (u, v, y), Assign(y[i], u[i] + u[i]*v[i]))
+    f = compile_routine(r)
+    assert f([1, 2, 3], [4, 5, 6]) == [5.0, 12.0, 21.0]
+    # Scalar contractions
+    k = Idx('k', 3)
+    f = compile_routine(routine('dot', (u, v), u[k]*v[k]))
+    assert f([1, 2, 3], [4, 5, 6]) == 32.0
+    f = compile_routine(routine('trace', (A, c), Assign(c, A[k, k])))
+    assert f([[1, 2, 3], [4, 5, 6], [7, 8, 9]]) == 15.0
+    # Arrays passed from python must have a constant shape
+    m = symbols('m', integer=True)
+    r = routine('f', (x, y, m), Assign(y[Idx('i', m)], 2*x[Idx('i', m)]))
+    raises(ValueError, lambda: compile_routine(r))
+
+
+@requires_cc
+def test_compile_routine_invariants():
+    A, x, y, z = [IndexedBase(s) for s in 'Axyz']
+    i, j = Idx('i', 3), Idx('j', 2)
+    r = routine('f', (A, x, y, z, a),
+                Assign(y[i], sin(a)*A[i, j]*x[j] + a*z[i]))
+    expected = [sin(2.0)*3 + 2, sin(2.0)*7 + 4, sin(2.0)*11 + 2]
+    for parallel in (False, True):
+        f = compile_routine(r, parallel=parallel, hoist_invariants=True)
+        result = f([[1, 2], [3, 4], [5, 6]], [1, 1], [1, 2, 1], 2.0)
+        assert all(abs(u - v) < 1e-12 for (u, v) in zip(result, expected))
+
+
+@requires_cc
+def test_compile_routine_max_pow():
+    expr = a**7 + sin(a**5)*b**Rational(9, 2) - 1/a**6
+    f = compile_routine(routine('f', (a, b), expr), max_pow=8)
+    assert abs(f(1.5, 2.0) - float(expr.subs({a: 1.5, b: 2.0}))) < 1e-12
+
+
+@requires_cc
+def test_compile_routine_constants():
+    expr = sqrt(2)*pi*a/(a + b) + sin(b)/(a + b) - 1/(a + b)**2
+    f = compile_routine(routine('f', (a, b), expr), cse=False,
+                        fold_constants=True, hoist_reciprocals=True)
+    assert abs(f(1.5, 2.0) - float(expr.subs({a: 1.5, b: 2.0}))) < 1e-12
+
+
+@requires_cc
+def test_compile_routine_fuse_transcendentals():
+    expr = sin(a)*cos(a) + sin(a + b)**2 - cos(a + b)
+    f = compile_routine(routine('f', (a, b), expr), fuse_transcendentals=True)
+    assert abs(f(1.5, 2.0) - float(expr.subs({a: 1.5, b: 2.0}))) < 1e-12
+
+
+@requires_cc
+def test_compile_routine_select_piecewise():
+    expr = (Piecewise((a, a < b), (b, True)) +
+            Piecewise((2*a, a > 0), (b, True)) +
+            Piecewise((exp(sin(a) + b), a > 1), (0, True)))
+    f = compile_routine(routine('f', (a, b), expr), select_piecewise=2)
+    for (u, v) in ((1.5, 2.0), (-1.0, 0.5), (0.5, -2.0)):
+        assert abs(f(u, v) - float(expr.subs({a: u, b: v}))) < 1e-12
+
+
+@requires_cc
+@requires_lapack
+def test_compile_routine_blas():
+    A, B = MatrixSymbol('A', 3, 3), MatrixSymbol('B', 3, 2)
+    C, x, y = [MatrixSymbol(s, m, n) for (s, m, n) in
+               (('C', 3, 2), ('x', 2, 1), ('y', 3, 1))]
+    r = routine('f', (A, B, x, C, y), (Assign(C, A.T*B + 2*B),
+                                       Assign(y, Inverse(A)*B*x)))
+    a_val = Matrix([[4, 1, 2], [1, 5, 3], [0, 2, 6]])
+    b_val = Matrix([[1, 2], [3, 4], [5, 6]])
+    x_val = Matrix([1, -1])
+    f = compile_routine(r, blas=True)
+    c_out, y_out = f(a_val, b_val, x_val)
+    expected = (a_val.T*b_val + 2*b_val, a_val.inv()*b_val*x_val)
+    for out, expected_val in zip((c_out, y_out), expected):
+        assert all(abs(u - float(v)) < 1e-12 for (u, v) in
+                   zip(sum(out, []), expected_val))
+
+
+@requires_cc
+def test_compile_routine_structured_matrices():
+    A = MatrixSymbol('A', 5, 5)
+    mat = Matrix(5, 5, lambda i, j: 2*a if i == j else
+                                    (b if abs(i - j) == 1 else 0))
+    r = routine('f', (a, b, A), Assign(A, mat))
+    f = compile_routine(r, structured_matrices=3)
+    assert f(1.0, 3.0) == mat.subs({a: 1, b: 3}).tolist()
+    f = compile_routine(sparse_outputs(r), structured_matrices=3)
+    data, indices, indptr = f(1.0, 3.0)
+    assert sum(data, []) == [2.0, 3.0] + [3.0, 2.0, 3.0]*3 + [3.0, 2.0]
+    assert sum(indices, []) == [0, 1, 0, 1, 2, 1, 2, 3, 2, 3, 4, 3, 4]
+    assert sum(indptr, []) == [0, 2, 5, 8, 11, 13]
+
+
+@requires_cc
+def test_compile_routine_jacobian():
+    F = MatrixSymbol('F', 2, 1)
+    r = routine('f', (a, b, F), (a*b, Assign(F, Matrix([sin(a*b), a**2]))))
+    f = compile_routine(jacobian_routine(r, (a, b)))
+    value, F_out, grad, F_jac = f(2.0, 3.0)
+    assert value == 6.0
+    assert grad == [[3.0], [2.0]]
+    assert abs(F_jac[0][0] - 3*cos(6.0)) < 1e-12
+    assert abs(F_jac[0][1] - 2*cos(6.0)) < 1e-12
+    assert F_jac[1] == [4.0, 0.0]
+    # The derivatives are computed from the inputs before they're overwritten
+    r = routine('f', (a,), Assign(a, sin(a)))
+    f = compile_routine(jacobian_routine(r, (a,)))
+    value, a_grad = f(0.5)
+    assert abs(value - sin(0.5)) < 1e-12
+    assert abs(a_grad[0][0] - cos(0.5)) < 1e-12
+
+
+@requires_cc
+def test_compile_routine_tmpdir(tmpdir):
+    # Routines of the same name built in one directory don't replace each
+    # other
+    f = compile_routine(routine('f', (a, b), a + b), tmpdir=str(tmpdir))
+    g = compile_routine(routine('f', (a, b), a*b), tmpdir=str(tmpdir))
+    assert f.path != g.path
+    assert g(1, 2) == 2.0
+    assert f(1, 2) == 3.0
+
+
+@requires_cc
+def test_compile_routine_error():
+    raises(CompileError, lambda: compile_routine(routine('f', (a,), a),
+            compiler='symcc-no-such-compiler'))
+    raises(CompileError, lambda: compile_routine(routine('f', (a,), a),
+            flags=('-no-such-flag',)))
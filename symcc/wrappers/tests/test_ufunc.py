@@ -0,0 +1,103 @@
+import os
+from distutils.spawn import find_executable
+
+import pytest
+from sympy import symbols, sin, MatrixSymbol
+from sympy.utilities.pytest import raises
+
+from symcc.types.ast import Assign
+from symcc.types.routines import routine
+from symcc.printers import CCodePrinter
+from symcc.wrappers.ufunc import ufuncify, ufunc_loop, ufunc_constructor
+
+np = pytest.importorskip('numpy')
+
+requires_cc = pytest.mark.skipif(
+        not find_executable(os.environ.get('CC', 'cc')),
+        reason="No C compiler available")
+
+a, b, c = symbols('a, b, c')
+n = symbols('n', integer=True)
+X = MatrixSymbol('X', 2, 1)
+
+
+def test_ufunc_loop():
+    r = routine('f', (a, b, c), (sin(a)*b, Assign(c, a + b)))
+    assert ufunc_loop(r, CCodePrinter()) == (
+        "void f_loop(char **args, const ptrdiff_t *dimensions, "
+        "const ptrdiff_t *steps, void *data) {\n"
+        "    ptrdiff_t i;\n"
+        "    ptrdiff_t n = dimensions[0];\n"
+        "    char *p0 = args[0];\n"
+        "    char *p1 = args[1];\n"
+        "    char *p2 = args[2];\n"
+        "    char *p3 = args[3];\n"
+        "    for (i = 0; i < n; i++) {\n"
+        "        *(double *)p2 = f(*(double *)p0, *(double *)p1, (double *)p3);\n"
+        "        p0 += steps[0];\n"
+        "        p1 += steps[1];\n"
+        "        p2 += steps[2];\n"
+        "        p3 += steps[3];\n"
+        "    }\n"
+        "}\n")
+
+
+def test_ufunc_constructor():
+    r = routine('f', (a, n, c), (sin(a)*n, Assign(c, a + n)))
+    assert ufunc_constructor(r, CCodePrinter()) == (
+        "static PyUFuncGenericFunction f_funcs[] = "
+        "{(PyUFuncGenericFunction)f_loop};\n"
+        "static void *f_data[] = {NULL};\n"
+        "static char f_types[] = {NPY_DOUBLE, NPY_INT, NPY_DOUBLE, "
+        "NPY_DOUBLE};\n"
+        "\n"
+        "PyObject *f_ufunc(void) {\n"
+        "    import_umath();\n"
+        "    return PyUFunc_FromFuncAndData(f_funcs, f_data, f_types, 1, 2, "
+        "2, PyUFunc_None, \"f\", \"Compiled ufunc of routine f\", 0);\n"
+        "}\n")
+
+
+def test_ufunc_loop_errors():
+    printer = CCodePrinter()
+    raises(ValueError, lambda: ufunc_loop(routine('f', (X, a),
+            Assign(a, X[0, 0])), printer))
+    raises(ValueError, lambda: ufunc_loop(routine('f', (a,),
+            Assign(a, a + 1)), printer))
+
+
+@requires_cc
+def test_ufuncify():
+    f = ufuncify(routine('f', (a, b, c), (sin(a)*b, Assign(c, a + b))))
+    assert isinstance(f, np.ufunc)
+    assert (f.nin, f.nout) == (2, 2)
+    x = np.linspace(0, 1, 5)
+    y = np.arange(3.0)[:, None]
+    o1, o2 = f(x, y)
+    assert o1.shape == o2.shape == (3, 5)
+    assert np.allclose(o1, np.sin(x)*y)
+    assert np.allclose(o2, x + y)
+    # Preallocated outputs
+    out = np.empty(5)
+    f(x, 2.0, out=(out, None))
+    assert np.allclose(out, np.sin(x)*2)
+    # Strided inputs
+    o1, o2 = f(x[::2], x[::-2])
+    assert np.allclose(o2, x[::2] + x[::-2])
+
+
+@requires_cc
+def test_ufuncify_int():
+    g = ufuncify(routine('g', (n,), n*2))
+    assert g.types == ['i->i']
+    assert (g(np.arange(4, dtype=np.intc)) == [0, 2, 4, 6]).all()
+
+
+@requires_cc
+def test_ufuncify_headers(tmpdir):
+    ufuncify(routine('h', (a,), a + 1), flags=('-Werror',),
+             tmpdir=str(tmpdir))
+    # Python.h is included before any standard header
+    src, = tmpdir.listdir('h_*.c')
+    with open(str(src)) as f:
+        assert f.readline() == '#include "Python.h"\n'
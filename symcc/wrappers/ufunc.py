@@ -0,0 +1,180 @@
+"""
+Generation of NumPy ufuncs from scalar `Routine` objects.
+
+The routine is compiled together with a loop over strided arrays, written
+with the signature NumPy expects for the inner loop of a ufunc. This loop is
+then registered with NumPy as a real `numpy.ufunc`, through the public numpy
+C-API, so broadcasting, type casting, and output allocation all follow
+NumPy's rules, while the loop over elements runs in C. This requires numpy,
+and the Python and numpy headers.
+
+"""
+
+from __future__ import print_function, division
+
+import ctypes
+import sysconfig
+
+from sympy.core import Symbol
+
+from symcc.types.ast import (InArgument, OutArgument, Bool, Int, Float,
+        Double)
+from symcc.wrappers.cwrapper import build_library
+
+__all__ = ["ufuncify"]
+
+
+# Mapping of symcc datatypes to the corresponding numpy type numbers
+_numpy_type_nums = {Bool: 'NPY_BOOL',
+                    Int: 'NPY_INT',
+                    Float: 'NPY_FLOAT',
+                    Double: 'NPY_DOUBLE'}
+
+# The headers needed by `ufunc_constructor`. Python.h must come before any
+# standard header.
+_ufunc_headers = ('Python.h', 'numpy/ndarraytypes.h', 'numpy/ufuncobject.h')
+
+# Ufuncs keep pointers to the loop, data, and type signature of the library
+# they're created by, so it must be kept loaded for the lifetime of the
+# process.
+_keepalive = []
+
+
+def _operands(routine):
+    """Returns the inputs and outputs of a scalar routine, as lists of
+    ``(dtype, argument)``. A direct return value has an argument of None."""
+    inputs = []
+    outputs = []
+    for r in routine.returns:
+        outputs.append((r.dtype, None))
+    for a in routine.arguments:
+        if not isinstance(a.name, Symbol):
+            raise ValueError("Only routines with scalar arguments can be "
+                             "made into ufuncs, got {0}.".format(a.name))
+        if isinstance(a, InArgument):
+            inputs.append((a.dtype, a))
+        elif isinstance(a, OutArgument):
+            outputs.append((a.dtype, a))
+        else:
+            raise ValueError("InOutArguments can't be used in ufuncs.")
+    if len(routine.returns) > 1:
+        raise ValueError("Routines used in ufuncs may only have one return.")
+    if not outputs:
+        raise ValueError("Routines used in ufuncs must have outputs.")
+    return inputs, outputs
+
+
+def ufunc_loop(routine, printer):
+    """Generate a loop calling `routine` over strided arrays, with the
+    signature of a ufunc inner loop (``PyUFuncGenericFunction``)."""
+    inputs, outputs = _operands(routine)
+    ops = inputs + outputs
+    name = str(routine.name)
+    ctype = lambda dtype: printer._print(dtype)
+    # Map arguments to their operand index
+    index = dict((a, n) for (n, (dtype, a)) in enumerate(ops))
+    call_args = []
+    for a in routine.arguments:
+        n = index[a]
+        if isinstance(a, InArgument):
+            call_args.append('*({0} *)p{1}'.format(ctype(a.dtype), n))
+        else:
+            call_args.append('({0} *)p{1}'.format(ctype(a.dtype), n))
+    call = '{0}({1})'.format(name, ', '.join(call_args))
+    if routine.returns:
+        n = index[None]
+        call = '*({0} *)p{1} = {2}'.format(ctype(ops[n][0]), n, call)
+    lines = ['void {0}_loop(char **args, const ptrdiff_t *dimensions, '
+             'const ptrdiff_t *steps, void *data) {{'.format(name),
+             'ptrdiff_t i;',
+             'ptrdiff_t n = dimensions[0];']
+    lines.extend('char *p{0} = args[{0}];'.format(n) for n in range(len(ops)))
+    lines.append('for (i = 0; i < n; i++) {')
+    lines.append(call + ';')
+    lines.extend('p{0} += steps[{0}];'.format(n) for n in range(len(ops)))
+    lines.append('}')
+    lines.append('}')
+    return '\n'.join(printer.indent_code(lines)) + '\n'
+
+
+def ufunc_constructor(routine, printer):
+    """Generate a function creating the ufunc of `routine` from the loop
+    generated by `ufunc_loop`, with ``PyUFunc_FromFuncAndData`` from the
+    public numpy C-API. It returns a new reference to the ufunc, or NULL
+    with a Python exception set. The translation unit must include the
+    headers `_ufunc_headers` first."""
+    inputs, outputs = _operands(routine)
+    name = str(routine.name)
+    types = ', '.join(_numpy_type_nums[dtype]
+                      for (dtype, a) in inputs + outputs)
+    lines = ['static PyUFuncGenericFunction {0}_funcs[] = '
+             '{{(PyUFuncGenericFunction){0}_loop}};'.format(name),
+             'static void *{0}_data[] = {{NULL}};'.format(name),
+             'static char {0}_types[] = {{{1}}};'.format(name, types),
+             '',
+             'PyObject *{0}_ufunc(void) {{'.format(name),
+             'import_umath();',
+             # The identity is PyUFunc_None, as routines have no reduction
+             # identity
+             'return PyUFunc_FromFuncAndData({0}_funcs, {0}_data, '
+             '{0}_types, 1, {1}, {2}, PyUFunc_None, "{0}", '
+             '"Compiled ufunc of routine {0}", 0);'.format(name, len(inputs),
+                                                          len(outputs)),
+             '}']
+    return '\n'.join(printer.indent_code(lines)) + '\n'
+
+
+def _include_flags():
+    """Returns the compiler flags adding the Python and numpy headers to the
+    include path."""
+    import numpy as np
+    return ('-I' + sysconfig.get_paths()['include'], '-I' + np.get_include(),
+            '-DNPY_NO_DEPRECATED_API=NPY_1_7_API_VERSION')
+
+
+def ufuncify(routine, compiler=None, flags=('-O2',), tmpdir=None, cache=None,
+        **settings):
+    """Compile a scalar `Routine` into a `numpy.ufunc`.
+
+    All arguments to the routine must be scalars. `InArgument` parameters are
+    the inputs of the ufunc, in order. The outputs are the return value (if
+    any), followed by all `OutArgument` parameters in order.
+
+    Parameters
+    ----------
+    routine : Routine
+        The routine to compile.
+    compiler, flags, tmpdir, cache, settings
+        See `build_library`. The Python and numpy include directories are
+        added to `flags`.
+
+    Returns
+    -------
+    numpy.ufunc
+
+    Examples
+    --------
+
+    >>> import numpy as np
+    >>> from sympy import symbols
+    >>> from symcc.types.routines import routine
+    >>> a, b = symbols('a, b')
+    >>> f = ufuncify(routine('f', (a, b), a*b + 1))
+    >>> f(np.arange(3), np.array([[1.0], [2.0]]))
+    array([[1., 2., 3.],
+           [1., 3., 5.]])
+
+    """
+
+    _operands(routine)
+    flags = tuple(flags) + _include_flags()
+    path = build_library(routine, compiler, flags, tmpdir, cache,
+            wrappers=(ufunc_loop, ufunc_constructor),
+            headers=_ufunc_headers, **settings)
+    # Loaded as a Python library, so the GIL is held and errors are raised
+    lib = ctypes.PyDLL(path)
+    _keepalive.append(lib)
+    constructor = getattr(lib, str(routine.name) + '_ufunc')
+    constructor.argtypes = []
+    constructor.restype = ctypes.py_object
+    return constructor()